@@ -0,0 +1,170 @@
+import sys
+import time
+
+import cspuz
+from cspuz.backend import z3 as z3_backend
+from cspuz.backend.sugar_like import _AUX_PREFIX, SugarLikeBackend, _find_common_subexprs
+from cspuz.expr import BoolExpr
+from cspuz.solver import _get_backend_by_name
+
+from generator import ALL_BENCHES
+from pzv_problem import solve_problem
+
+# Problems generated by the benches in `generator`. Generating problems takes too long with z3,
+# so these are solved instead.
+PROBLEMS = [
+    "https://puzz.link/p?masyu/10/10/2051020b00010300i0i50020002696020i",
+    "https://puzz.link/p?masyu/10/10/00266000600220603230i09000c00169i0",
+    "https://puzz.link/p?masyu/10/10/0023i30090366000080i1326000021160i",
+    "https://puzz.link/p?masyu/10/10/063o03000003oil032813601000ia9i030",
+    "https://puzz.link/p?masyu/10/10/210030390600409i0182i00200010i0i20",
+    "https://puzz.link/p?nurimisaki/10/10/g.i.w.j.i.h.k.h.g.y.h.i.i.h.g.h.n.k",
+    "https://puzz.link/p?nurimisaki/10/10/h.g.g.w.g.q.h.g.h.m.h.n.m.h.q.h.g.k",
+    "https://puzz.link/p?nurimisaki/10/10/h.n.j.m.j.zh.h.j.n.m.m.l.g.k",
+    "https://puzz.link/p?nurimisaki/10/10/w.i.j.h.h.h.m.l.j.r.g.i.j.h.h.s.",
+    "https://puzz.link/p?nurimisaki/10/10/h.l.g.j.k.g.j.g.g.h.w.h.n.g.g.g.h.g.z.g",
+]
+
+
+def solver_benches():
+    kinds = {}
+    for url in PROBLEMS:
+        kinds.setdefault(url.split("?")[1].split("/")[0], []).append(url)
+
+    def bench_for(urls):
+        def bench():
+            for url in urls:
+                assert solve_problem(url)
+
+        return bench
+
+    return [(bench_for(urls), kind) for kind, urls in kinds.items()]
+
+
+class DescriptionStats:
+    def __init__(self):
+        self.num_calls = 0
+        self.num_bytes = 0
+        self.num_aux_vars = 0
+        self.solver_time = 0.0
+
+
+def run_with_stats(bench, cse_threshold):
+    cspuz.config.cse_threshold = cse_threshold
+    stats = DescriptionStats()
+    # executable backends stream the description without calling `_call_solver`
+    backend_class = _get_backend_by_name(cspuz.config.default_backend)
+    run_solver = backend_class._run_solver
+
+    def _run_solver(self, extra_lines=()):
+        stats.num_calls += 1
+        stats.num_bytes += sum(len(chunk) for chunk in self._description_chunks(extra_lines))
+        stats.num_aux_vars += self._num_aux_vars
+        start = time.time()
+        ret = run_solver(self, extra_lines)
+        stats.solver_time += time.time() - start
+        return ret
+
+    backend_class._run_solver = _run_solver
+    try:
+        bench()
+    finally:
+        backend_class._run_solver = run_solver
+        cspuz.config.cse_threshold = None
+    return stats
+
+
+def run_with_stats_z3(bench, cse_threshold):
+    # CSE is implemented only in Sugar-like backends. For z3, the subexpressions which a
+    # Sugar-like backend replaces are replaced by auxiliary z3 constants defined by equalities,
+    # and the size of the model is measured by the Sugar-like description of the constraints.
+    cspuz.config.cse_threshold = cse_threshold
+    stats = DescriptionStats()
+    backend_class = z3_backend.Z3Backend
+    init = backend_class.__init__
+    add_constraint = backend_class.add_constraint
+    check = backend_class._check
+
+    def _init(self, variables):
+        init(self, variables)
+        self._description_backend = SugarLikeBackend(variables)
+
+    def _add_constraint(self, constraint):
+        if not isinstance(constraint, list):
+            constraint = [constraint]
+        description_backend = self._description_backend
+        description_backend.add_constraint(constraint)
+        if cse_threshold is not None:
+            z3 = z3_backend.z3
+            for e, _ in _find_common_subexprs(constraint, cse_threshold):
+                # follow the decision of the Sugar-like backend on whether to replace `e`
+                text = description_backend._converted_exprs.get(id(e))
+                if text is None or not text.startswith(_AUX_PREFIX):
+                    continue
+                if id(e) in self._converted_exprs:
+                    continue
+                value = z3_backend._convert_expr(
+                    e, self.variables_dict, self._ctx, self._converted_exprs
+                )
+                if isinstance(e, BoolExpr):
+                    aux = z3.Bool(text, self._ctx)
+                else:
+                    aux = z3.Int(text, self._ctx)
+                self.converted_constraints.append(aux == value)
+                self._converted_exprs[id(e)] = (e, aux)
+        add_constraint(self, constraint)
+
+    def _check(self, solver):
+        stats.num_calls += 1
+        stats.num_bytes += len(self._description_backend._csp_description())
+        stats.num_aux_vars += self._description_backend._num_aux_vars
+        start = time.time()
+        ret = check(self, solver)
+        stats.solver_time += time.time() - start
+        return ret
+
+    backend_class.__init__ = _init
+    backend_class.add_constraint = _add_constraint
+    backend_class._check = _check
+    try:
+        bench()
+    finally:
+        backend_class.__init__ = init
+        backend_class.add_constraint = add_constraint
+        backend_class._check = check
+        cspuz.config.cse_threshold = None
+    return stats
+
+
+def main():
+    cse_threshold = 1
+    if len(sys.argv) >= 2:
+        cse_threshold = int(sys.argv[1])
+    flt = None
+    if len(sys.argv) >= 3:
+        flt = sys.argv[2].split(",")
+    if cspuz.config.default_backend == "z3":
+        run = run_with_stats_z3
+        benches = solver_benches()
+    else:
+        run = run_with_stats
+        benches = ALL_BENCHES
+
+    # CSE detects only subexpressions shared as Python objects
+    cspuz.config.use_expr_interning = True
+    for bench, name in benches:
+        if flt is not None and name not in flt:
+            continue
+        base = run(bench, None)
+        cse = run(bench, cse_threshold)
+        print(
+            f"{name}: {base.num_calls} calls, "
+            f"description {base.num_bytes} -> {cse.num_bytes} bytes "
+            f"({cse.num_bytes / base.num_bytes * 100:.1f}%), "
+            f"{cse.num_aux_vars} auxiliary variables, "
+            f"solver time {base.solver_time:.3f} -> {cse.solver_time:.3f} s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import sys
+import time
+import tracemalloc
+
+from cspuz import Solver
+
+
+def build_model(height, width):
+    solver = Solver()
+    is_active = solver.bool_array((height, width))
+    rank = solver.int_array((height, width), 0, height * width - 1)
+    for y in range(height):
+        for x in range(width):
+            less_ranks = [
+                (rank[y2, x2] < rank[y, x]) & is_active[y2, x2]
+                for y2, x2 in is_active.four_neighbor_indices(y, x)
+            ]
+            solver.ensure(is_active[y, x].then(sum(b.cond(1, 0) for b in less_ranks) >= 1))
+    return solver
+
+
+def count_nodes(solver):
+    visited = set()
+    stack = list(solver.variables) + list(solver.constraints)
+    while len(stack) > 0:
+        e = stack.pop()
+        if id(e) in visited or not hasattr(e, "operands"):
+            continue
+        visited.add(id(e))
+        stack += e.operands
+    return len(visited)
+
+
+def bench_memory(height, width):
+    tracemalloc.start()
+    solver = build_model(height, width)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    num_nodes = count_nodes(solver)
+    print(f"memory ({height}x{width}): {num_nodes} nodes, {current / num_nodes:.1f} bytes/node")
+
+
+def bench_construction(height, width, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        solver = build_model(height, width)
+    elapsed = time.perf_counter() - start
+    num_nodes = count_nodes(solver) * repeat
+    print(
+        f"construction ({height}x{width} x {repeat}): {elapsed:.3f} s, "
+        f"{num_nodes / elapsed / 1000:.1f} knodes/s"
+    )
+
+
+def main():
+    size = 50
+    if len(sys.argv) >= 2:
+        size = int(sys.argv[1])
+    bench_memory(size, size)
+    bench_construction(size, size, 5)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@ from .solver import Solver
 from .constraints import alldifferent, count_true, cond, fold_and, fold_or
 from .configuration import config
 from .grid_frame import BoolGridFrame
+from .batch import solve_many
 
 __all__ = [
     "Solver",
@@ -12,4 +13,5 @@ __all__ = [
     "fold_or",
     "config",
     "BoolGridFrame",
+    "solve_many",
 ]
@@ -1,10 +1,82 @@
 from multiprocessing import Pool
-from typing import Any, List, Optional, Tuple, Union
+from typing import Any, List, Optional, Tuple, Union, cast
 
-from .solver import Solver, _get_backend
+from .refinement import new_backend
+from .solver import Solver, _get_backend, _solve_irrefutably
 from .array import BoolArray2D, IntArray2D
-from .expr import BoolExpr, BoolVar, IntVar
+from .expr import BoolExpr, BoolExprLike, BoolVar, IntVar
 from .constraints import flatten_iterator
+from .flat import FlatModel
+from .simplify import flatten_chains
+
+
+def _test_unlearnt_fact(
+    variables,
+    constraints,
+    axiom_constraints,
+    optional_constraints,
+    i,
+    unlearnt_facts,
+    learnt_facts,
+    backend,
+):
+    backend_type = _get_backend(backend)
+    is_active_constraint = [True for _ in range(len(optional_constraints))]
+    is_active_fact = [True for _ in range(len(learnt_facts))]
+
+    def check():
+        active_constraints = [constraints[j] for j in axiom_constraints]
+        for k in range(len(optional_constraints)):
+            if is_active_constraint[k]:
+                _, cs = optional_constraints[k]
+                active_constraints += [constraints[j] for j in cs]
+        for k in range(len(learnt_facts)):
+            if is_active_fact[k]:
+                vi, val = learnt_facts[k]
+                active_constraints.append(variables[vi] == val)
+        vi, val = unlearnt_facts[i]
+        active_constraints.append(variables[vi] != val)
+        csp_solver = new_backend(backend_type, variables, active_constraints)
+        return not csp_solver.solve()
+
+    for j in range(len(is_active_constraint)):
+        is_active_constraint[j] = False
+        if not check():
+            is_active_constraint[j] = True
+
+    for j in range(len(is_active_fact)):
+        is_active_fact[j] = False
+        if not check():
+            is_active_fact[j] = True
+
+    active_constraint_ids = [
+        i for i in range(len(is_active_constraint)) if is_active_constraint[i]
+    ]
+    active_fact_ids = [i for i in range(len(is_active_fact)) if is_active_fact[i]]
+    score = len(active_constraint_ids) + len(active_fact_ids)
+    return score, active_constraint_ids, active_fact_ids
+
+
+# The model being analyzed, which is restored in each worker process of `Analyzer.analyze` from
+# the flat representation shipped once to the worker (rather than pickling the whole `Analyzer`
+# into every task).
+_worker_model = None
+
+
+def _init_worker(model, axiom_constraints, optional_constraints):
+    global _worker_model
+    variables = model.make_variables()
+    _worker_model = (
+        variables,
+        model.constraints(variables),
+        axiom_constraints,
+        optional_constraints,
+    )
+
+
+def _test_unlearnt_fact_in_worker(i, unlearnt_facts, learnt_facts, backend):
+    assert _worker_model is not None
+    return _test_unlearnt_fact(*_worker_model, i, unlearnt_facts, learnt_facts, backend)
 
 
 class Analyzer(Solver):
@@ -64,6 +136,8 @@ class Analyzer(Solver):
         flat_constraints = []
         for x in flatten_iterator(constraint):
             if isinstance(x, (BoolExpr, bool)):
+                if self._expr_table is not None:
+                    x = self._expr_table.intern(x)
                 flat_constraints.append(x)
             else:
                 raise TypeError("each element in 'constraint' must be BoolExpr-like")
@@ -74,85 +148,73 @@ class Analyzer(Solver):
             self.optional_constraints.append((name, new_ids))
         self.constraints += flat_constraints
 
-    def _test_unlearnt_fact(self, i, unlearnt_facts, learnt_facts, backend):
-        backend_type = _get_backend(backend)
-        is_active_constraint = [True for _ in range(len(self.optional_constraints))]
-        is_active_fact = [True for _ in range(len(learnt_facts))]
-
-        def check():
-            csp_solver = backend_type(self.variables)
-            csp_solver.add_constraint([self.constraints[j] for j in self.axiom_constraints])
-            for k in range(len(self.optional_constraints)):
-                if is_active_constraint[k]:
-                    _, cs = self.optional_constraints[k]
-                    csp_solver.add_constraint([self.constraints[j] for j in cs])
-            for k in range(len(learnt_facts)):
-                if is_active_fact[k]:
-                    vi, val = learnt_facts[k]
-                    csp_solver.add_constraint(self.variables[vi] == val)
-            vi, val = unlearnt_facts[i]
-            csp_solver.add_constraint(self.variables[vi] != val)
-            return not csp_solver.solve()
-
-        for j in range(len(is_active_constraint)):
-            is_active_constraint[j] = False
-            if not check():
-                is_active_constraint[j] = True
-
-        for j in range(len(is_active_fact)):
-            is_active_fact[j] = False
-            if not check():
-                is_active_fact[j] = True
-
-        active_constraint_ids = [
-            i for i in range(len(is_active_constraint)) if is_active_constraint[i]
-        ]
-        active_fact_ids = [i for i in range(len(is_active_fact)) if is_active_fact[i]]
-        score = len(active_constraint_ids) + len(active_fact_ids)
-        return score, active_constraint_ids, active_fact_ids
-
     def analyze(self, n_workers: int = 0, backend: Union[None, str, type] = None):
         backend_type = _get_backend(backend)
-        csp_solver = backend_type(self.variables)
-        csp_solver.add_constraint(self.constraints)
+        constraints = cast(List[BoolExprLike], flatten_chains(self.constraints))
+        csp_solver = new_backend(backend_type, self.variables, constraints)
 
-        if not csp_solver.solve_irrefutably(self.is_answer_key):
+        if not _solve_irrefutably(csp_solver, self.variables, self.is_answer_key):
             return None
 
         unlearnt_facts = []
         for i, v in enumerate(self.variables):
             if self.is_answer_key[i] and self.variables[i].sol is not None:
                 unlearnt_facts.append((i, self.variables[i].sol))
-        learnt_facts: List[Tuple[int, Union[bool, int]]] = []
 
+        pool = None
+        if n_workers >= 0:
+            pool = Pool(
+                None if n_workers == 0 else n_workers,
+                initializer=_init_worker,
+                initargs=(
+                    FlatModel(self.variables, constraints, self.is_answer_key),
+                    self.axiom_constraints,
+                    self.optional_constraints,
+                ),
+            )
+        try:
+            return self._analyze(pool, constraints, backend_type, backend, unlearnt_facts)
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+    def _analyze(self, pool, constraints, backend_type, backend, unlearnt_facts):
+        learnt_facts: List[Tuple[int, Union[bool, int]]] = []
         res = []
         while len(unlearnt_facts) > 0:
-            if n_workers >= 0:
-                with Pool(None if n_workers == 0 else n_workers) as pool:
-                    args = [
-                        (i, unlearnt_facts, learnt_facts, backend)
-                        for i in range(len(unlearnt_facts))
-                    ]
-                    cand_all = pool.starmap(self._test_unlearnt_fact, args)
+            if pool is not None:
+                args = [
+                    (i, unlearnt_facts, learnt_facts, backend) for i in range(len(unlearnt_facts))
+                ]
+                cand_all = pool.starmap(_test_unlearnt_fact_in_worker, args)
             else:
                 cand_all = [
-                    self._test_unlearnt_fact(i, unlearnt_facts, learnt_facts, backend)
+                    _test_unlearnt_fact(
+                        self.variables,
+                        constraints,
+                        self.axiom_constraints,
+                        self.optional_constraints,
+                        i,
+                        unlearnt_facts,
+                        learnt_facts,
+                        backend,
+                    )
                     for i in range(len(unlearnt_facts))
                 ]
 
             best_cand = min(cand_all)
 
             _, active_constraint_ids, active_fact_ids = best_cand
-            csp_solver = backend_type(self.variables)
-            csp_solver.add_constraint([self.constraints[i] for i in self.axiom_constraints])
+            active_constraints = [constraints[i] for i in self.axiom_constraints]
             for k in active_constraint_ids:
                 _, cs = self.optional_constraints[k]
-                csp_solver.add_constraint([self.constraints[j] for j in cs])
+                active_constraints += [constraints[j] for j in cs]
             for k in active_fact_ids:
                 vi, val = learnt_facts[k]
-                csp_solver.add_constraint(self.variables[vi] == val)
+                active_constraints.append(self.variables[vi] == val)
+            csp_solver = new_backend(backend_type, self.variables, active_constraints)
 
-            assert csp_solver.solve_irrefutably(self.is_answer_key)
+            assert _solve_irrefutably(csp_solver, self.variables, self.is_answer_key)
 
             new_learnt_facts = []
             new_unlearnt_facts = []
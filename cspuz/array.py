@@ -1,7 +1,11 @@
 import collections.abc
 import functools
+import gc
+import itertools
+import operator
 from typing import (
     Any,
+    Dict,
     Generic,
     Iterable,
     Iterator,
@@ -21,7 +25,6 @@ from .expr import (
     BoolExprLike,
     BoolOp,
     Expr,
-    ExprLike,
     IntExpr,
     IntExprLike,
     IntOp,
@@ -34,14 +37,76 @@ IntArray1DLike = Union["IntArray1D", Iterable[IntExprLike]]
 BoolArray1DLike = Union["BoolArray1D", Iterable[BoolExprLike]]
 
 
+class _LazyNode:
+    # An elementwise operation which is not expanded yet (see `_elementwise`). Each operand is a
+    # scalar, a copy of the data of an array, or the node of a lazy array.
+    __slots__ = ("op", "operands", "size", "num_consumers", "result")
+
+    def __init__(self, op: Op, operands: List[Any], size: int) -> None:
+        self.op = op
+        self.operands = operands
+        self.size = size
+        # the number of elementwise operations taking this node as an operand
+        self.num_consumers = 0
+        # the per-cell expressions, once expanded
+        self.result: Optional[List[Expr]] = None
+
+
 class Array1D(Generic[T]):
     shape: Tuple[int]
-    data: List[T]
+    _data: Optional[List[T]]
+    # the elementwise operation computing this array, if it is not expanded yet
+    _lazy: Optional[_LazyNode] = None
+    # for a view created by slicing, the data of the sliced array, the offset and the stride
+    _view: Optional[Tuple[List[T], int, int]] = None
 
     def __init__(self, data: Iterable[T]):
         self.data = list(data)
         self.shape = (len(self.data),)
 
+    @property
+    def data(self) -> List[T]:
+        if self._data is None:
+            if self._view is not None:
+                base, offset, stride = self._view
+                self._data = _gather(base, offset, stride, self.shape[0])
+                self._view = None
+            else:
+                assert self._lazy is not None
+                self._data = cast(List[T], _expand(self._lazy))
+                self._lazy = None
+        return self._data
+
+    @data.setter
+    def data(self, data: List[T]) -> None:
+        self._data = data
+        self._lazy = None
+        self._view = None
+
+    def _layout(self) -> Tuple[List[T], int, int]:
+        # Returns the list holding the elements, the offset and the stride.
+        if self._view is not None:
+            return self._view
+        return self.data, 0, 1
+
+    def _getitem_impl(self, key: Union[int, slice]) -> Union[T, "Array1D[T]"]:
+        # The result of slicing is a view sharing the data of this array, which is copied only
+        # when the data of the view is needed.
+        base, offset, stride = self._layout()
+        if not isinstance(key, slice):
+            # `operator.index` also accepts integer-like keys such as those of numpy
+            p = operator.index(key)
+            size = self.shape[0]
+            if p < 0:
+                p += size
+            if not 0 <= p < size:
+                raise IndexError("list index out of range")
+            return base[offset + p * stride]
+        r = range(self.shape[0])[key]
+        return _make_view(
+            type(self), base, offset + r.start * stride, (len(r),), (r.step * stride,)
+        )
+
     def size(self) -> int:
         return self.shape[0]
 
@@ -59,6 +124,24 @@ class Array1D(Generic[T]):
         )
 
 
+def _gather(base: List[T], offset: int, stride: int, size: int) -> List[T]:
+    if size == 0:
+        return []
+    if stride > 0:
+        return base[offset : offset + stride * size : stride]
+    return [base[offset + stride * i] for i in range(size)]
+
+
+def _make_view(
+    cls: Any, base: List[Any], offset: int, shape: Tuple[int, ...], strides: Tuple[int, ...]
+) -> Any:
+    ret = cls.__new__(cls)
+    ret.shape = shape
+    ret._data = None
+    ret._view = (base, offset) + strides
+    return ret
+
+
 def _infer_shape(data: Sequence[Sequence[T]]) -> Tuple[int, int]:
     if len(data) == 0:
         raise ValueError("shape cannot be inferred for empty lists")
@@ -79,33 +162,18 @@ def _flatten(data: List[List[T]]) -> List[T]:
 
 
 def _parse_range(size: int, key: Union[int, slice]) -> Tuple[bool, int, int, int]:
-    if isinstance(key, int):
-        p = key
+    if not isinstance(key, slice):
+        p = operator.index(key)
         if p < 0:
             p += size
         if not 0 <= p < size:
             raise IndexError("index {} is out of bounds for the axis with size {}".format(p, size))
         return True, p, p + 1, 1
     else:
-        start = key.start
-        stop = key.stop
-        step = key.step or 1
-
-        if start is None:
-            start = 0 if step > 0 else size - 1
-        else:
-            if start < 0:
-                start += size
-            start = min(max(0, start), size)
-
-        if stop is None:
-            stop = size if step > 0 else -1
-        else:
-            if stop < 0:
-                stop += size
-            stop = min(max(0, stop), size)
-
-        return False, start, stop, step
+        # `range` normalizes the slice in the same way as lists (in particular, an explicit start
+        # is clamped to `size - 1` for a negative step).
+        r = range(size)[key]
+        return False, r.start, r.stop, r.step
 
 
 def _range_size(start: int, stop: int, step: int) -> int:
@@ -125,7 +193,13 @@ def _range_size(start: int, stop: int, step: int) -> int:
 
 class Array2D(Generic[T]):
     shape: Tuple[int, int]
-    data: List[T]
+    _data: Optional[List[T]]
+    # see `Array1D`
+    _lazy: Optional[_LazyNode] = None
+    # for a view, the data of the sliced array, the offset and the strides of the two axes
+    _view: Optional[Tuple[List[T], int, int, int]] = None
+    # the type of 1-D arrays obtained by indexing
+    _row_type: type = Array1D
 
     def __init__(
         self,
@@ -148,6 +222,35 @@ class Array2D(Generic[T]):
             self.shape = shape
             self.data = data_list
 
+    @property
+    def data(self) -> List[T]:
+        if self._data is None:
+            if self._view is not None:
+                base, offset, stride_y, stride_x = self._view
+                height, width = self.shape
+                data: List[T] = []
+                for y in range(height):
+                    data += _gather(base, offset + y * stride_y, stride_x, width)
+                self._data = data
+                self._view = None
+            else:
+                assert self._lazy is not None
+                self._data = cast(List[T], _expand(self._lazy))
+                self._lazy = None
+        return self._data
+
+    @data.setter
+    def data(self, data: List[T]) -> None:
+        self._data = data
+        self._lazy = None
+        self._view = None
+
+    def _layout(self) -> Tuple[List[T], int, int, int]:
+        # Returns the list holding the elements, the offset and the strides of the two axes.
+        if self._view is not None:
+            return self._view
+        return self.data, 0, self.shape[1], 1
+
     @overload
     def _getitem_impl(self, key: Tuple[int, int]) -> T: ...
 
@@ -180,9 +283,9 @@ class Array2D(Generic[T]):
                 if not isinstance(y, int) or not isinstance(x, int):
                     raise TypeError("tuple elements for indexing must be of int type")
                 data.append(self._getitem_impl((y, x)))
-            return Array1D(data)
+            return self._row_type(data)
 
-        if isinstance(key, (int, slice)):
+        if not isinstance(key, tuple):
             return self._getitem_impl(
                 cast(Union[Tuple[int, slice], Tuple[slice, slice]], (key, slice(None, None)))
             )
@@ -191,19 +294,24 @@ class Array2D(Generic[T]):
         y_size = _range_size(y_start, y_stop, y_step)
         x_size = _range_size(x_start, x_stop, x_step)
 
+        # The result of slicing is a view sharing the data of this array, which is copied only
+        # when the data of the view is needed.
+        base, offset, stride_y, stride_x = self._layout()
+        offset += y_start * stride_y + x_start * stride_x
         if y_fixed and x_fixed:
-            return self.data[y_start * self.shape[1] + x_start]
-
-        data = []
-        for i in range(y_size * x_size):
-            y = y_start + y_step * (i // x_size)
-            x = x_start + x_step * (i % x_size)
-            data.append(self.data[y * self.shape[1] + x])
-
-        if not (y_fixed or x_fixed):
-            return Array2D(data, (y_size, x_size))
+            return base[offset]
+        elif y_fixed:
+            return _make_view(self._row_type, base, offset, (x_size,), (x_step * stride_x,))
+        elif x_fixed:
+            return _make_view(self._row_type, base, offset, (y_size,), (y_step * stride_y,))
         else:
-            return Array1D(data)
+            return _make_view(
+                type(self),
+                base,
+                offset,
+                (y_size, x_size),
+                (y_step * stride_y, x_step * stride_x),
+            )
 
     def __iter__(self) -> Iterator[T]:
         return iter(self.data)
@@ -227,6 +335,10 @@ def _is_int_like(value: Any) -> bool:
     return isinstance(value, (IntExpr, int, IntArray1D, IntArray2D))
 
 
+def _is_int_constant(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
 ElementwiseOperands = List[
     Union[BoolExprLike, "BoolArray1D", "BoolArray2D", IntExprLike, "IntArray1D", "IntArray2D"]
 ]
@@ -276,6 +388,13 @@ def _elementwise(
     elif op == Op.NEG:
         if len(operands) != 1 or not _is_int_like(operands[0]):
             return NotImplemented
+    elif op == Op.MUL:
+        if (
+            len(operands) != 2
+            or not all(map(_is_int_like, operands))
+            or not any(map(_is_int_constant, operands))
+        ):
+            return NotImplemented
     elif op == Op.IF:
         if len(operands) != 3 or not (
             _is_bool_like(operands[0]) and _is_int_like(operands[1]) and _is_int_like(operands[2])
@@ -296,34 +415,113 @@ def _elementwise(
     if not (1 <= len(shape) <= 2):
         raise ValueError("number of dimensions must be 1 or 2")
 
-    size = functools.reduce(lambda x, y: x * y, shape, 1)
-
     bool_op = is_bool_op(op)
+    if len(shape) == 1:
+        cls: Any = BoolArray1D if bool_op else IntArray1D
+    else:
+        cls = BoolArray2D if bool_op else IntArray2D
 
-    res: List[Union[BoolExpr, IntExpr]] = []
-    for i in range(size):
-        expr_operands: List[ExprLike] = []
-        for j in range(len(operands)):
-            operand = operands[j]
-            if isinstance(operand, (Array1D, Array2D)):
-                expr_operands.append(operand.data[i])
+    # The result is not expanded into per-cell expressions until its `data` is needed (see
+    # `_expand`), so that chains of elementwise operations do not allocate intermediate arrays.
+    # The data of the other array operands is copied, so that later changes to these arrays do
+    # not affect the result.
+    node_operands: List[Any] = []
+    for operand in operands:
+        if isinstance(operand, (Array1D, Array2D)):
+            if operand._lazy is not None:
+                operand._lazy.num_consumers += 1
+                node_operands.append(operand._lazy)
             else:
-                expr_operands.append(operand)
-        if bool_op:
-            res.append(BoolExpr(op, expr_operands))
+                node_operands.append(list(operand.data))
         else:
-            res.append(IntExpr(op, expr_operands))
+            node_operands.append(operand)
+    ret = cls.__new__(cls)
+    ret.shape = shape
+    ret._data = None
+    ret._lazy = _LazyNode(op, node_operands, functools.reduce(lambda x, y: x * y, shape, 1))
+    return ret
 
-    if len(shape) == 1:
-        if bool_op:
-            return BoolArray1D(cast(List[BoolExpr], res))
-        else:
-            return IntArray1D(cast(List[IntExpr], res))
-    else:
-        if bool_op:
-            return BoolArray2D(cast(List[BoolExpr], res), cast(Tuple[int, int], shape))
-        else:
-            return IntArray2D(cast(List[IntExpr], res), cast(Tuple[int, int], shape))
+
+def _expand(node: _LazyNode) -> List[Expr]:
+    """Expand a lazy elementwise operation into per-cell expressions.
+
+    Lazy operands which are not consumed by any other operation are fused into `node`: their
+    per-cell expressions are built in the same pass, without expanding the intermediate arrays
+    one by one. The other lazy operands are expanded separately, so that the expressions shared
+    among consumers are not duplicated. The result of every expanded node (including the fused
+    ones) is kept in the node, so that the same expressions are returned if it is needed again.
+    """
+    if node.result is not None:
+        return node.result
+
+    # The fused operations are compiled into `steps` in post-order. Each step is a tuple of the
+    # node and the sources of the operands, where a source is a pair of its kind and value: 0 for
+    # a scalar, 1 for a list of per-cell expressions, and 2 for the index of an earlier step.
+    steps: List[Tuple[_LazyNode, List[Tuple[int, Any]]]] = []
+    step_index: Dict[int, int] = {}
+    stack: List[Tuple[_LazyNode, bool]] = [(node, False)]
+    while len(stack) > 0:
+        current, expanded = stack.pop()
+        if not expanded:
+            stack.append((current, True))
+            for operand in current.operands:
+                if _is_fusible(operand):
+                    stack.append((operand, False))
+            continue
+        sources: List[Tuple[int, Any]] = []
+        for operand in current.operands:
+            if isinstance(operand, _LazyNode):
+                if id(operand) in step_index:
+                    sources.append((2, step_index[id(operand)]))
+                else:
+                    sources.append((1, _expand(operand)))
+            elif isinstance(operand, list):
+                sources.append((1, operand))
+            else:
+                sources.append((0, operand))
+        step_index[id(current)] = len(steps)
+        steps.append((current, sources))
+
+    # Expressions are acyclic, so the cyclic garbage collector, which would be triggered many
+    # times while allocating them, is paused.
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for current, sources in steps:
+            columns: List[Iterable[Any]] = []
+            for kind, value in sources:
+                if kind == 0:
+                    columns.append(itertools.repeat(value, current.size))
+                elif kind == 1:
+                    columns.append(value)
+                else:
+                    columns.append(cast(List[Expr], steps[value][0].result))
+            current.result = _make_exprs(current.op, columns)
+            # the operands are not needed any more
+            current.operands = []
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return cast(List[Expr], node.result)
+
+
+def _make_exprs(op: Op, columns: List[Iterable[Any]]) -> List[Expr]:
+    # Returns the expressions applying `op` to each row of `columns`. The slots are set directly
+    # since the constructors, which only store the operator and the operands, would dominate the
+    # time of expansion.
+    expr_class: Any = BoolExpr if is_bool_op(op) else IntExpr
+    new = expr_class.__new__
+    ret = []
+    for operands in zip(*columns):
+        e = new(expr_class)
+        e.op = op
+        e.operands = operands
+        ret.append(e)
+    return ret
+
+
+def _is_fusible(operand: Any) -> bool:
+    return isinstance(operand, _LazyNode) and operand.result is None and operand.num_consumers <= 1
 
 
 BoolOperand1D = Union[BoolExprLike, "BoolArray1D"]
@@ -386,13 +584,10 @@ class BoolArray1D(Array1D[BoolExpr]):
     def __getitem__(self, key: slice) -> "BoolArray1D": ...
 
     def __getitem__(self, key: Union[int, slice]) -> Union[BoolExpr, "BoolArray1D"]:
-        if isinstance(key, int):
-            return self.data[key]
-        else:
-            return BoolArray1D(self.data[key])
+        return cast(Union[BoolExpr, "BoolArray1D"], self._getitem_impl(key))
 
     def __len__(self) -> int:
-        return len(self.data)
+        return self.shape[0]
 
     def __iter__(self) -> Iterator[BoolExpr]:
         return iter(self.data)
@@ -425,6 +620,12 @@ class IntArray1D(Array1D[IntExpr]):
     def __rsub__(self, other: IntOperand1D) -> "IntArray1D":
         return _elementwise(Op.SUB, self.shape, [other, self])
 
+    def __mul__(self, other: int) -> "IntArray1D":
+        return _elementwise(Op.MUL, self.shape, [self, other])
+
+    def __rmul__(self, other: int) -> "IntArray1D":
+        return _elementwise(Op.MUL, self.shape, [other, self])
+
     def __eq__(self, other: IntOperand1D) -> "BoolArray1D":  # type: ignore
         return _elementwise(Op.EQ, self.shape, [self, other])
 
@@ -450,10 +651,7 @@ class IntArray1D(Array1D[IntExpr]):
     def __getitem__(self, key: slice) -> "IntArray1D": ...
 
     def __getitem__(self, key: Union[int, slice]) -> Union[IntExpr, "IntArray1D"]:
-        if isinstance(key, int):
-            return self.data[key]
-        else:
-            return IntArray1D(self.data[key])
+        return cast(Union[IntExpr, "IntArray1D"], self._getitem_impl(key))
 
     def reshape(self, shape: Tuple[int, int]) -> "IntArray2D":
         return _reshape(self, shape)
@@ -467,6 +665,8 @@ IntOperand2D = Union[IntExprLike, "IntArray2D"]
 
 
 class BoolArray2D(Array2D[BoolExpr]):
+    _row_type = BoolArray1D
+
     @overload
     def __init__(self, data: Iterable[Iterable[BoolExpr]]): ...
 
@@ -548,13 +748,7 @@ class BoolArray2D(Array2D[BoolExpr]):
             Iterable[Tuple[int, int]],
         ],
     ) -> Union[BoolExpr, BoolArray1D, "BoolArray2D"]:
-        ret = super()._getitem_impl(key)
-        if isinstance(ret, Array1D):
-            return BoolArray1D(ret.data)
-        elif isinstance(ret, Array2D):
-            return BoolArray2D(ret.data, ret.shape)
-        else:
-            return ret
+        return cast(Union[BoolExpr, BoolArray1D, "BoolArray2D"], super()._getitem_impl(key))
 
     def flatten(self) -> BoolArray1D:
         return BoolArray1D(self.data)
@@ -607,6 +801,8 @@ class BoolArray2D(Array2D[BoolExpr]):
 
 
 class IntArray2D(Array2D[IntExpr]):
+    _row_type = IntArray1D
+
     @overload
     def __init__(self, data: Iterable[Iterable[IntExpr]]): ...
 
@@ -635,6 +831,12 @@ class IntArray2D(Array2D[IntExpr]):
     def __rsub__(self, other: IntOperand2D) -> "IntArray2D":
         return _elementwise(Op.SUB, self.shape, [other, self])
 
+    def __mul__(self, other: int) -> "IntArray2D":
+        return _elementwise(Op.MUL, self.shape, [self, other])
+
+    def __rmul__(self, other: int) -> "IntArray2D":
+        return _elementwise(Op.MUL, self.shape, [other, self])
+
     def __eq__(self, other: IntOperand2D) -> "BoolArray2D":  # type: ignore
         return _elementwise(Op.EQ, self.shape, [self, other])
 
@@ -676,13 +878,7 @@ class IntArray2D(Array2D[IntExpr]):
             Iterable[Tuple[int, int]],
         ],
     ) -> Union[IntExpr, IntArray1D, "IntArray2D"]:
-        ret = super()._getitem_impl(key)
-        if isinstance(ret, Array1D):
-            return IntArray1D(ret.data)
-        elif isinstance(ret, Array2D):
-            return IntArray2D(ret.data, ret.shape)
-        else:
-            return ret
+        return cast(Union[IntExpr, IntArray1D, "IntArray2D"], super()._getitem_impl(key))
 
     def flatten(self) -> IntArray1D:
         return IntArray1D(self.data)
@@ -0,0 +1,217 @@
+"""
+Pool of long-lived solver processes running in the server mode.
+
+A solver process in the server mode (e.g. `sugar_ext.sh --server`) reads problems from its stdin
+and writes the results to its stdout one by one. Each problem and result is framed by a line
+with the length of the payload in bytes, followed by the payload itself.
+"""
+
+import atexit
+import os
+import selectors
+import signal
+import subprocess
+import threading
+import time
+from typing import Dict, List, Optional
+
+
+class ServerError(RuntimeError):
+    pass
+
+
+class _ServerProcess:
+    def __init__(self, args: List[str]) -> None:
+        self.proc = subprocess.Popen(
+            args,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        # Requests are written through `_write`, which waits for the pipe to become writable
+        # until the deadline of the request.
+        assert self.proc.stdin is not None
+        os.set_blocking(self.proc.stdin.fileno(), False)
+        self._buffer = b""
+        # whether the connection to the process is lost
+        self.broken = False
+
+    def is_alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def kill(self) -> None:
+        # The solver may spawn child processes (e.g. a SAT solver), so the whole process group is
+        # killed.
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        self.proc.wait()
+        for f in (self.proc.stdin, self.proc.stdout):
+            if f is not None:
+                f.close()
+
+    def close(self) -> None:
+        # Closing stdin makes the server exit its loop.
+        try:
+            if self.proc.stdin is not None:
+                self.proc.stdin.close()
+            self.proc.wait(timeout=1)
+        except (OSError, subprocess.TimeoutExpired):
+            pass
+        if self.is_alive():
+            self.kill()
+        elif self.proc.stdout is not None:
+            self.proc.stdout.close()
+
+    def _write(self, data: bytes, deadline: Optional[float]) -> None:
+        # Writes `data` to stdin, which may block as long as the process does not read it.
+        assert self.proc.stdin is not None
+        fd = self.proc.stdin.fileno()
+        view = memoryview(data)
+        with selectors.DefaultSelector() as selector:
+            selector.register(fd, selectors.EVENT_WRITE)
+            while len(view) > 0:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise subprocess.TimeoutExpired(self.proc.args, 0)
+                if len(selector.select(remaining)) == 0:
+                    raise subprocess.TimeoutExpired(self.proc.args, 0)
+                try:
+                    written = os.write(fd, view)
+                except BlockingIOError:
+                    continue
+                except BrokenPipeError:
+                    self.broken = True
+                    raise ServerError("solver server terminated unexpectedly")
+                view = view[written:]
+
+    def _read_until(self, size: int, deadline: Optional[float]) -> None:
+        # Reads from stdout until `self._buffer` has `size` bytes (or a newline if `size` < 0).
+        assert self.proc.stdout is not None
+        fd = self.proc.stdout.fileno()
+        with selectors.DefaultSelector() as selector:
+            selector.register(fd, selectors.EVENT_READ)
+            while (len(self._buffer) < size) if size >= 0 else (b"\n" not in self._buffer):
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or len(selector.select(remaining)) == 0:
+                        raise subprocess.TimeoutExpired(self.proc.args, 0)
+                chunk = os.read(fd, 65536)
+                if len(chunk) == 0:
+                    self.broken = True
+                    raise ServerError("solver server terminated unexpectedly")
+                self._buffer += chunk
+
+    def request(self, payload: str, timeout: Optional[float]) -> str:
+        data = payload.encode("ascii")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._write(str(len(data)).encode("ascii") + b"\n", deadline)
+        self._write(data, deadline)
+
+        self._read_until(-1, deadline)
+        header, self._buffer = self._buffer.split(b"\n", 1)
+        size = int(header)
+        self._read_until(size, deadline)
+        result, self._buffer = self._buffer[:size], self._buffer[size:]
+        out = result.decode("utf-8")
+        if out.startswith("error"):
+            raise ServerError("solver server failed: " + out.strip())
+        return out
+
+
+class ServerPool:
+    """Pool of at most `size` warm server processes running the command `args`.
+
+    Processes are started lazily. A process is discarded (and replaced by a new one on demand)
+    when it terminates unexpectedly or a request to it times out.
+    """
+
+    def __init__(self, args: List[str], size: int) -> None:
+        self.args = args
+        self.size = size
+        self._idle: List[_ServerProcess] = []
+        self._num_processes = 0
+        self._cond = threading.Condition()
+
+    def _acquire(self) -> _ServerProcess:
+        with self._cond:
+            while True:
+                while len(self._idle) > 0:
+                    server = self._idle.pop()
+                    if server.is_alive():
+                        return server
+                    server.kill()
+                    self._num_processes -= 1
+                if self._num_processes < self.size:
+                    self._num_processes += 1
+                    break
+                self._cond.wait()
+        try:
+            return _ServerProcess(self.args)
+        except BaseException:
+            self._discard(None)
+            raise
+
+    def _release(self, server: _ServerProcess) -> None:
+        with self._cond:
+            self._idle.append(server)
+            self._cond.notify()
+
+    def _discard(self, server: Optional[_ServerProcess]) -> None:
+        if server is not None:
+            server.kill()
+        with self._cond:
+            self._num_processes -= 1
+            self._cond.notify()
+
+    def request(self, payload: str, timeout: Optional[float] = None) -> str:
+        server = self._acquire()
+        try:
+            out = server.request(payload, timeout)
+        except ServerError:
+            # the server may have reported an error for this problem without terminating
+            if server.broken:
+                self._discard(server)
+            else:
+                self._release(server)
+            raise
+        except BaseException:
+            # on timeout (or interruption), the state of the server is unknown
+            self._discard(server)
+            raise
+        self._release(server)
+        return out
+
+    def close(self) -> None:
+        with self._cond:
+            idle = self._idle
+            self._idle = []
+            self._num_processes -= len(idle)
+        for server in idle:
+            server.close()
+
+
+_pools: Dict[str, ServerPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_server_pool(path: str, size: int) -> ServerPool:
+    """Return the pool of server processes of the solver at `path`, creating it if necessary."""
+    with _pools_lock:
+        pool = _pools.get(path)
+        if pool is None or pool.size != size:
+            if pool is not None:
+                pool.close()
+            pool = ServerPool([path, "--server"], size)
+            _pools[path] = pool
+        return pool
+
+
+@atexit.register
+def _close_all_pools() -> None:
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
@@ -1,3 +1,7 @@
+import asyncio
+import os
+import sys
+import threading
 import warnings
 import subprocess
 import signal
@@ -11,24 +15,128 @@ except ImportError:
 
 
 def run_subprocess(args, input, timeout=None):
+    return run_subprocess_streaming(args, [input.encode("ascii")], timeout=timeout)
+
+
+def _write_chunks(stdin, chunks, errors):
+    try:
+        for chunk in chunks:
+            stdin.write(chunk)
+    except BrokenPipeError:
+        # the process exited without reading the whole input
+        pass
+    except Exception as e:
+        errors.append(e)
+    finally:
+        try:
+            stdin.close()
+        except BrokenPipeError:
+            pass
+
+
+def run_subprocess_streaming(args, chunks, timeout=None):
+    """Run `args` with the input given as an iterable of `bytes` and return the output.
+
+    The chunks are written to the standard input by another thread while the process is running,
+    so that the process can start reading the input before all the chunks are produced, and the
+    whole input is never materialized.
+    """
     if timeout and not _PSUTIL_AVAILABLE:
         warnings.warn("psutil not found; timeout is ignored")
-    if timeout and _PSUTIL_AVAILABLE:
-        proc = subprocess.Popen(
-            args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
+        timeout = None
+    proc = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    # `communicate` must not touch the standard input, which is owned by the writer thread
+    stdin = proc.stdin
+    proc.stdin = None
+    errors = []
+    writer = threading.Thread(target=_write_chunks, args=(stdin, chunks, errors), daemon=True)
+    writer.start()
+    try:
+        out, _ = proc.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        parent = psutil.Process(proc.pid)
+        children = parent.children(recursive=True)
+        children.append(parent)
+        for p in children:
+            p.send_signal(signal.SIGTERM)
+        raise
+    writer.join()
+    if len(errors) > 0:
+        raise errors[0]
+    return out.decode("utf-8")
+
+
+async def run_subprocess_async(args, chunks, timeout=None):
+    """Coroutine version of `run_subprocess_streaming` using `asyncio.create_subprocess_exec`.
+
+    On timeout or on cancellation, the whole process tree (e.g. a shell script and the JVM
+    launched by it) is killed. On POSIX, the solver is started in a new session so that its
+    process group can be signaled. Windows has no process groups, and the tree is killed by
+    `taskkill` instead. Unlike `run_subprocess_streaming`, this does not require psutil.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *args,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        start_new_session=sys.platform != "win32",
+    )
+
+    async def write_chunks():
+        try:
+            for chunk in chunks:
+                proc.stdin.write(chunk)
+                await proc.stdin.drain()
+            proc.stdin.close()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    async def communicate():
+        writer = asyncio.ensure_future(write_chunks())
         try:
-            out, _ = proc.communicate(input.encode("ascii"), timeout=timeout)
-            out = out.decode("utf-8")
-        except subprocess.TimeoutExpired:
-            parent = psutil.Process(proc.pid)
-            children = parent.children(recursive=True)
-            children.append(parent)
-            for p in children:
-                p.send_signal(signal.SIGTERM)
-            raise
+            out = await proc.stdout.read()
+            await writer
+        finally:
+            writer.cancel()
+        await proc.wait()
         return out
+
+    try:
+        out = await asyncio.wait_for(communicate(), timeout)
+    except asyncio.TimeoutError:
+        await _kill_process_tree(proc)
+        raise subprocess.TimeoutExpired(args, timeout)
+    except BaseException:
+        await _kill_process_tree(proc)
+        raise
+    return out.decode("utf-8")
+
+
+async def _kill_process_tree(proc):
+    if sys.platform == "win32":
+        if proc.returncode is None:
+            try:
+                killer = await asyncio.create_subprocess_exec(
+                    "taskkill",
+                    "/F",
+                    "/T",
+                    "/PID",
+                    str(proc.pid),
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                )
+                await killer.wait()
+            except OSError:
+                pass
+        try:
+            # the solver itself is killed even if `taskkill` is unavailable
+            proc.kill()
+        except ProcessLookupError:
+            pass
     else:
-        res = subprocess.run(args, input=input.encode("ascii"), stdout=subprocess.PIPE)
-        out = res.stdout.decode("utf-8")
-        return out
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    await proc.wait()
@@ -2,11 +2,61 @@ from typing import Optional
 
 
 class Backend:
+    """Base class of backends.
+
+    A backend object holds a session with a CSP solver: constraints can be added by
+    `add_constraint` after `solve` is called, and the next call of `solve` takes all the
+    constraints added so far into account. Backends are expected to reuse the work done for the
+    earlier calls of `solve` (e.g. the converted constraints and the CSP description) as much as
+    possible, so that repeated solving with a few additional constraints is cheap.
+    """
+
+    has_async_solve = False
+
+    def add_constraint(self, constraint):
+        raise NotImplementedError
+
+    def add_flat_model(self, model):
+        """Add the constraints of a `cspuz.flat.FlatModel`.
+
+        The ids of the variables of `model` must agree with those of the variables given to the
+        backend. By default, the constraints are restored as `Expr` objects and passed to
+        `add_constraint`; backends may override this to consume the flat form directly.
+        """
+        self.add_constraint(model.constraints(self.variables))
+
     def solve(self):
         raise NotImplementedError
 
     def solve_irrefutably(self, is_answer_key):
         raise NotImplementedError
 
+    async def solve_async(self):
+        """Coroutine version of `solve`.
+
+        This is available only if `has_async_solve` is `True`. For the other backends,
+        `Solver.solve_async` and `Solver.find_answer_async` run the whole session (including the
+        conversion of constraints) in a thread of the default executor, since such backends may
+        keep state which must not be shared among threads (e.g. z3 contexts).
+        """
+        raise NotImplementedError
+
+    async def solve_irrefutably_async(self, is_answer_key):
+        """Coroutine version of `solve_irrefutably`. See `solve_async` for availability."""
+        raise NotImplementedError
+
+    def serialize(self):
+        """Return a picklable representation of the constraints added so far.
+
+        An equivalent backend can be restored from the result by `deserialize`, possibly in
+        another process. This allows the conversion of constraints and the actual solving to take
+        place in different processes.
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def deserialize(cls, variables, data):
+        raise NotImplementedError
+
     def perf_stats(self) -> Optional[dict]:
         return None
@@ -2,18 +2,24 @@
 CSP backend using the Sugar CSP solver (http://bach.istc.kobe-u.ac.jp/sugar/).
 """
 
+import asyncio
+import itertools
 from typing import Optional
 
 from ..configuration import config
-from ..expr import Op, Expr, BoolVar, IntVar
+from ..expr import BoolExpr, BoolVar, Expr, IntExpr, IntVar, Op
+from ..flat import LITERAL_BOOL, LITERAL_INT, LITERAL_NONE
+from ..simplify import Simplifier
 
 from .backend import Backend
-from ._subproc import run_subprocess
+from ._server import get_server_pool
+from ._subproc import run_subprocess, run_subprocess_async, run_subprocess_streaming
 
 OP_TO_OPNAME = {
     Op.NEG: "-",
     Op.ADD: "+",
     Op.SUB: "-",
+    Op.MUL: "*",
     Op.EQ: "=",
     Op.NE: "!=",
     Op.LE: "<=",
@@ -33,6 +39,36 @@ OP_TO_OPNAME = {
 }
 
 
+# size of chunks in which the CSP description is written to solver processes
+_CHUNK_SIZE = 1 << 16
+
+
+def _encode_in_chunks(lines, is_first=True):
+    # Joins `lines` with newlines and yields the result encoded in chunks. Unless `is_first`, a
+    # newline is also put before the first line so that the result can follow another text.
+    buf = []
+    size = 0
+    for line in lines:
+        if not is_first:
+            buf.append("\n")
+        is_first = False
+        buf.append(line)
+        size += len(line) + 1
+        if size >= _CHUNK_SIZE:
+            yield "".join(buf).encode("ascii")
+            buf = []
+            size = 0
+    if len(buf) > 0:
+        yield "".join(buf).encode("ascii")
+
+
+def _tee_to_file(chunks, path):
+    with open(path, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+            yield chunk
+
+
 def _convert_variable(v):
     if isinstance(v, BoolVar):
         return "(bool b{})".format(v.id)
@@ -42,7 +78,11 @@ def _convert_variable(v):
         raise TypeError()
 
 
-def _convert_expr(e):
+_ATOMIC_OPS = (Op.BOOL_CONSTANT, Op.INT_CONSTANT)
+
+
+def _convert_atom(e):
+    # Returns the text for `e` if it is not a compound expression, or `None` otherwise.
     if e is None:
         return "*"
     if isinstance(e, bool):
@@ -60,11 +100,158 @@ def _convert_expr(e):
         return "true" if e.operands[0] else "false"
     elif e.op == Op.INT_CONSTANT:
         return str(e.operands[0])
-    else:
-        return "({} {})".format(OP_TO_OPNAME[e.op], " ".join(map(_convert_expr, e.operands)))
+    return None
+
+
+def _is_compound(e):
+    return isinstance(e, Expr) and not e.is_variable() and e.op not in _ATOMIC_OPS
+
+
+def _compound_text(op, parts):
+    if op == Op.COUNT_TRUE:
+        # Sugar-like solvers have no cardinality primitive for bool terms
+        if len(parts) == 0:
+            return "0"
+        return "(+ " + " ".join(["(if " + t + " 1 0)" for t in parts]) + ")"
+    if op == Op.GRAPH_EDGES:
+        # Spliced into the operands of graph constraints. The format has no way to declare a graph
+        # once, so this text (converted only once) is repeated in each constraint on the graph.
+        return " ".join(parts)
+    return "(" + OP_TO_OPNAME[op] + " " + " ".join(parts) + ")"
+
+
+def _convert_expr(e, memo=None, converted_nodes=None):
+    """Convert an expression into Sugar-like text.
+
+    The expression DAG is traversed with an explicit stack, so that deep expressions do not hit
+    the recursion limit. The text of every compound node is cached in `memo` (keyed by the node
+    identity), so that subexpressions shared among constraints are emitted only once. The nodes
+    cached in `memo` are appended to `converted_nodes`, which keeps them alive so that their ids
+    are not reused by other nodes.
+    """
+    if not _is_compound(e):
+        return _convert_atom(e)
+    if memo is None:
+        memo = {}
+        converted_nodes = []
+    cached = memo.get(id(e))
+    if cached is not None:
+        return cached
+
+    # Each frame holds a node, the iterator over its remaining operands and the texts of the
+    # operands processed so far. When an operand which is not converted yet is found, a new frame
+    # is pushed and the iteration over the operands of the current node is resumed later.
+    stack = [(e, iter(e.operands), [])]
+    text = None
+    while len(stack) > 0:
+        node, it, parts = stack[-1]
+        if text is not None:
+            parts.append(text)
+            text = None
+        for x in it:
+            t = type(x)
+            if t is BoolVar:
+                parts.append("b" + str(x.id))
+            elif t is IntVar:
+                parts.append("i" + str(x.id))
+            elif t is int:
+                parts.append(str(x))
+            elif (t is BoolExpr or t is IntExpr or _is_compound(x)) and x.op not in _ATOMIC_OPS:
+                cached = memo.get(id(x))
+                if cached is None:
+                    stack.append((x, iter(x.operands), []))
+                    break
+                parts.append(cached)
+            else:
+                parts.append(_convert_atom(x))
+        else:
+            stack.pop()
+            text = _compound_text(node.op, parts)
+            # texts are not paired with nodes in tuples, which would put a burden on the GC
+            memo[id(node)] = text
+            converted_nodes.append(node)
+    return text
+
+
+_CODE_TO_OP = {op.value: op for op in Op}
+
+
+def _convert_flat_model(model):
+    """Convert the constraints of a `FlatModel` into Sugar-like texts.
+
+    Since the nodes are stored in post-order, the text of each node is computed in a single pass
+    over the arrays from the texts of its operands, without restoring `Expr` objects.
+    """
+    num_variables = model.num_variables
+    codes = model.codes
+    offsets = model.offsets
+    args = model.args
+    is_int_var = model.is_int_var
+    texts = [("i" if is_int_var[i] else "b") + str(i) for i in range(num_variables)]
+    for i in range(len(codes)):
+        code = codes[i]
+        start = offsets[i]
+        if code == LITERAL_NONE:
+            texts.append("*")
+        elif code == LITERAL_BOOL or code == Op.BOOL_CONSTANT.value:
+            texts.append("true" if args[start] else "false")
+        elif code == LITERAL_INT or code == Op.INT_CONSTANT.value:
+            texts.append(str(args[start]))
+        else:
+            parts = [texts[r] for r in args[start : offsets[i + 1]]]
+            texts.append(_compound_text(_CODE_TO_OP[code], parts))
+    return [texts[r] for r in model.roots]
+
+
+# prefix of the names of auxiliary variables introduced by common-subexpression elimination
+_AUX_PREFIX = "cse"
+
+# operators which cannot appear inside another expression
+_TOP_LEVEL_OPS = (Op.ALLDIFF, Op.GRAPH_ACTIVE_VERTICES_CONNECTED, Op.GRAPH_DIVISION)
+
+
+def _is_cse_candidate(e):
+    if not isinstance(e, (BoolExpr, IntExpr)) or e.op in _TOP_LEVEL_OPS:
+        return False
+    if e.op in (Op.NOT, Op.NEG):
+        # replacing `(! b0)` by a variable does not shrink the description
+        return _is_compound(e.operands[0])
+    return True
+
+
+def _find_common_subexprs(exprs, threshold):
+    """Return the compound nodes in `exprs` referenced more than `threshold` times.
+
+    The pairs of such a node and the number of references to it are returned in post-order, that
+    is, every node comes after its descendants.
+    """
+    num_refs = {}
+    post_order = []
+    stack = [(e, False) for e in reversed(exprs) if _is_compound(e)]
+    while len(stack) > 0:
+        e, expanded = stack.pop()
+        if expanded:
+            post_order.append(e)
+            continue
+        if id(e) in num_refs:
+            num_refs[id(e)] += 1
+            continue
+        num_refs[id(e)] = 1
+        stack.append((e, True))
+        for x in reversed(e.operands):
+            if _is_compound(x):
+                stack.append((x, False))
+    return [
+        (e, num_refs[id(e)])
+        for e in post_order
+        if num_refs[id(e)] > threshold and _is_cse_candidate(e)
+    ]
 
 
 class SugarLikeBackend(Backend):
+    # Only the invocation of the solver is done asynchronously (see `_call_solver_async`).
+    has_async_solve = True
+
     def __init__(self, variables):
         self.variables = variables
         max_var_id = -1
@@ -76,23 +263,136 @@ class SugarLikeBackend(Backend):
         self.max_var_id = max_var_id
         self.converted_variables = list(map(_convert_variable, self.variables))
         self.converted_constraints = []
+        self._converted_exprs = {}
+        self._converted_nodes = []
+        self._num_aux_vars = 0
+        # the CSP description emitted so far, encoded in chunks of about `_CHUNK_SIZE` bytes.
+        # On later calls of `solve`, only the lines added since then are encoded and appended,
+        # and the chunks are written to solvers as they are.
+        self._description = []
+        self._num_described_variables = 0
+        self._num_described_constraints = 0
 
     def add_constraint(self, constraint):
-        if isinstance(constraint, list):
-            self.converted_constraints += map(_convert_expr, constraint)
-        else:
-            self.converted_constraints.append(_convert_expr(constraint))
+        if not isinstance(constraint, list):
+            constraint = [constraint]
+        if config.cse_threshold is not None:
+            self._eliminate_common_subexprs(constraint, config.cse_threshold)
+        memo = self._converted_exprs
+        nodes = self._converted_nodes
+        self.converted_constraints += [_convert_expr(e, memo, nodes) for e in constraint]
+
+    def add_flat_model(self, model):
+        if config.cse_threshold is not None:
+            # CSE works on `Expr` objects
+            super().add_flat_model(model)
+            return
+        self.converted_constraints += _convert_flat_model(model)
+
+    def _eliminate_common_subexprs(self, exprs, threshold):
+        # Replace each subexpression referenced more than `threshold` times by an auxiliary
+        # variable with a constraint defining it, unless this makes the description longer.
+        # Since the candidates are processed in post-order, the definition of a subexpression
+        # refers to the auxiliary variables for its descendants.
+        memo = self._converted_exprs
+        nodes = self._converted_nodes
+        simplifier = Simplifier()
+        for e, num_refs in _find_common_subexprs(exprs, threshold):
+            text = _convert_expr(e, memo, nodes)
+            if text.startswith(_AUX_PREFIX):
+                continue
+            name = "{}{}".format(_AUX_PREFIX, self._num_aux_vars)
+            if isinstance(e, BoolExpr):
+                declaration = "(bool {})".format(name)
+                definition = "(iff {} {})".format(name, text)
+            else:
+                try:
+                    lo, hi = simplifier.bounds(e)
+                except (TypeError, ValueError):
+                    continue
+                declaration = "(int {} {} {})".format(name, lo, hi)
+                definition = "(= {} {})".format(name, text)
+            if num_refs * len(name) + len(declaration) + len(definition) + 2 >= num_refs * len(
+                text
+            ):
+                continue
+            self._num_aux_vars += 1
+            self.converted_variables.append(declaration)
+            self.converted_constraints.append(definition)
+            memo[id(e)] = name
+
+    def _extend_description(self):
+        # Encodes the lines added after the last call and appends them to the description.
+        new_lines = (
+            self.converted_variables[self._num_described_variables :]
+            + self.converted_constraints[self._num_described_constraints :]
+        )
+        is_first = len(self._description) == 0
+        self._description += _encode_in_chunks(new_lines, is_first)
+        self._num_described_variables = len(self.converted_variables)
+        self._num_described_constraints = len(self.converted_constraints)
+
+    def _csp_description(self):
+        # Returns the CSP description of the variables and constraints added so far.
+        self._extend_description()
+        return b"".join(self._description).decode("ascii")
+
+    def serialize(self):
+        self._extend_description()
+        return list(self._description), self._num_aux_vars
+
+    @classmethod
+    def deserialize(cls, variables, data):
+        backend = cls(variables)
+        description, backend._num_aux_vars = data
+        backend._description = list(description)
+        backend._num_described_variables = len(backend.converted_variables)
+        return backend
+
+    def _description_chunks(self, extra_lines=()):
+        # Returns an iterator over the CSP description followed by `extra_lines`, encoded in
+        # chunks of about `_CHUNK_SIZE` bytes. The chunks of the description are reused across
+        # calls and only `extra_lines` are newly encoded.
+        self._extend_description()
+        is_first = len(self._description) == 0
+        chunks = itertools.chain(self._description, _encode_in_chunks(extra_lines, is_first))
+        if config.csp_dump_path is not None:
+            chunks = _tee_to_file(chunks, config.csp_dump_path)
+        return chunks
+
+    def _full_description(self, extra_lines=()):
+        return b"".join(self._description_chunks(extra_lines)).decode("ascii")
+
+    def _run_solver(self, extra_lines=()):
+        # Runs the solver on the CSP description followed by `extra_lines` and returns its output.
+        return self._call_solver(self._full_description(extra_lines))
+
+    async def _run_solver_async(self, extra_lines=()):
+        return await self._call_solver_async(self._full_description(extra_lines))
 
     def solve(self):
-        csp_description = "\n".join(self.converted_variables + self.converted_constraints)
-        out = self._call_solver(csp_description).split("\n")
-        if "UNSATISFIABLE" in out[0]:
+        return self._load_solution(self._run_solver())
+
+    async def solve_async(self):
+        return self._load_solution(await self._run_solver_async())
+
+    def solve_irrefutably(self, is_answer_key):
+        out = self._run_solver([self._answer_keys_line(is_answer_key)])
+        return self._load_irrefutable_solution(out)
+
+    async def solve_irrefutably_async(self, is_answer_key):
+        out = await self._run_solver_async([self._answer_keys_line(is_answer_key)])
+        return self._load_irrefutable_solution(out)
+
+    def _load_solution(self, out):
+        out_lines = out.split("\n")
+        if "UNSATISFIABLE" in out_lines[0]:
             for v in self.variables:
                 v.sol = None
             return False
 
         assignment = [None] * (self.max_var_id + 1)
-        for line in out[1:]:
+        for line in out_lines[1:]:
             if len(line) <= 2:
                 break
             var, val = line[2:].strip().split("\t")
@@ -102,12 +402,14 @@ class SugarLikeBackend(Backend):
                 converted_val = False
             else:
                 converted_val = int(val)
+            if var.startswith(_AUX_PREFIX):
+                continue
             assignment[int(var[1:])] = converted_val
         for v in self.variables:
             v.sol = assignment[v.id]
         return True
 
-    def solve_irrefutably(self, is_answer_key):
+    def _answer_keys_line(self, is_answer_key):
         answer_keys = []
         for i in range(len(self.variables)):
             if is_answer_key[i]:
@@ -117,19 +419,18 @@ class SugarLikeBackend(Backend):
                     answer_keys.append("i{}".format(self.variables[i].id))
                 else:
                     raise TypeError()
-        answer_keys_desc = "#" + " ".join(answer_keys)
-        csp_description = "\n".join(
-            self.converted_variables + self.converted_constraints + [answer_keys_desc]
-        )
-        out = self._call_solver(csp_description).split("\n")
+        return "#" + " ".join(answer_keys)
+
+    def _load_irrefutable_solution(self, out):
+        out_lines = out.split("\n")
         for v in self.variables:
             v.sol = None
 
-        if "unsat" in out[0]:
+        if "unsat" in out_lines[0]:
             return False
 
         assignment = [None] * (self.max_var_id + 1)
-        for line in out[1:]:
+        for line in out_lines[1:]:
             if len(line) <= 2:
                 break
             var, val = line.split(" ")
@@ -147,26 +448,57 @@ class SugarLikeBackend(Backend):
     def _call_solver(self, csp_description: str) -> str:
         raise NotImplementedError
 
+    async def _call_solver_async(self, csp_description: str) -> str:
+        # In-process solvers are run in the default executor. Backends invoking an external
+        # executable override this with `run_subprocess_async`.
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self._call_solver, csp_description
+        )
+
+
+class _SugarExecutableBackend(SugarLikeBackend):
+    # Backends running a Sugar-compatible executable given by `config.backend_path`. The CSP
+    # description is streamed into the standard input of the solver process.
+    _default_path = "sugar"
+
+    def _solver_args(self):
+        return [config.backend_path or self._default_path, "/dev/stdin"]
+
+    def _run_solver(self, extra_lines=()):
+        return run_subprocess_streaming(
+            self._solver_args(),
+            self._description_chunks(extra_lines),
+            timeout=config.solver_timeout,
+        )
+
+    async def _run_solver_async(self, extra_lines=()):
+        return await run_subprocess_async(
+            self._solver_args(),
+            self._description_chunks(extra_lines),
+            timeout=config.solver_timeout,
+        )
+
+    def _call_solver(self, csp_description: str) -> str:
+        return run_subprocess(self._solver_args(), csp_description, timeout=config.solver_timeout)
 
-class SugarBackend(SugarLikeBackend):
+
+class SugarBackend(_SugarExecutableBackend):
     def solve_irrefutably(self, is_answer_key):
         raise NotImplementedError
 
-    def _call_solver(self, csp_description: str) -> str:
-        sugar_path = config.backend_path or "sugar"
-        out = run_subprocess(
-            [sugar_path, "/dev/stdin"], csp_description, timeout=config.solver_timeout
-        )
-        return out
+    async def solve_irrefutably_async(self, is_answer_key):
+        raise NotImplementedError
+
 
+class SugarExtendedBackend(_SugarExecutableBackend):
+    pass
 
-class SugarExtendedBackend(SugarLikeBackend):
+
+class SugarServerBackend(SugarLikeBackend):
     def _call_solver(self, csp_description: str) -> str:
-        sugar_path = config.backend_path or "sugar"
-        out = run_subprocess(
-            [sugar_path, "/dev/stdin"], csp_description, timeout=config.solver_timeout
-        )
-        return out
+        sugar_path = config.backend_path or "sugar_ext.sh"
+        pool = get_server_pool(sugar_path, config.sugar_server_pool_size)
+        return pool.request(csp_description, timeout=config.solver_timeout)
 
 
 class CSugarBackend(SugarLikeBackend):
@@ -1,103 +1,384 @@
 import importlib
+import threading
 
 from .backend import Backend
+from ..configuration import config
 from ..expr import Op, Expr, BoolVar, IntVar
 
 z3 = None
+z3_propagator = None
 
+_thread_local = threading.local()
 
-def _convert_expr(e, variables_dict):
-    if isinstance(e, (bool, int)):
-        return e
+
+def _get_context():
+    # A z3 context must not be used from multiple threads at the same time. The main context is
+    # used in the main thread, and each of the other threads (e.g. workers of the executor used by
+    # `Solver.solve_async`) has its own context.
+    if threading.current_thread() is threading.main_thread():
+        return z3.main_ctx()
+    ctx = getattr(_thread_local, "ctx", None)
+    if ctx is None:
+        ctx = z3.Context()
+        _thread_local.ctx = ctx
+    return ctx
+
+
+def _convert_expr(e, variables_dict, ctx, memo=None):
+    if isinstance(e, bool):
+        return z3.BoolVal(e, ctx)
+    if isinstance(e, int):
+        return z3.IntVal(e, ctx)
     if not isinstance(e, Expr):
         raise TypeError()
     if isinstance(e, (BoolVar, IntVar)):
         return variables_dict[e.id]
-    else:
-        operands = list(map(lambda x: _convert_expr(x, variables_dict), e.operands))
-        if e.op == Op.NEG:
-            return -operands[0]
-        elif e.op == Op.ADD:
-            ret = operands[0]
-            for i in range(1, len(operands)):
-                ret = ret + operands[i]
-            return ret
-        elif e.op == Op.SUB:
-            ret = operands[0]
-            for i in range(1, len(operands)):
-                ret = ret - operands[i]
+    if e.op == Op.BOOL_CONSTANT:
+        return z3.BoolVal(e.operands[0], ctx)
+    if e.op == Op.INT_CONSTANT:
+        return z3.IntVal(e.operands[0], ctx)
+    if memo is not None:
+        cached = memo.get(id(e))
+        if cached is not None:
+            return cached[1]
+    ret = _convert_compound_expr(e, variables_dict, ctx, memo)
+    if memo is not None:
+        # keep `e` alive so that its id is not reused by another node
+        memo[id(e)] = (e, ret)
+    return ret
+
+
+_FLIPPED_COMPARISONS = {
+    Op.EQ: Op.EQ,
+    Op.NE: Op.NE,
+    Op.LE: Op.GE,
+    Op.LT: Op.GT,
+    Op.GE: Op.LE,
+    Op.GT: Op.LT,
+}
+
+
+def _int_constant(e):
+    if isinstance(e, int) and not isinstance(e, bool):
+        return e
+    if isinstance(e, Expr) and e.op == Op.INT_CONSTANT:
+        return e.operands[0]
+    return None
+
+
+def _convert_cardinality(e, variables_dict, ctx, memo):
+    # Converts a comparison between `COUNT_TRUE` and a constant into a pseudo-boolean constraint,
+    # or returns `None` if `e` is not of this form.
+    op = e.op
+    left, right = e.operands
+    k = _int_constant(right)
+    if not (isinstance(left, Expr) and left.op == Op.COUNT_TRUE and k is not None):
+        k = _int_constant(left)
+        if not (isinstance(right, Expr) and right.op == Op.COUNT_TRUE and k is not None):
+            return None
+        left = right
+        op = _FLIPPED_COMPARISONS[op]
+    if op == Op.LT:
+        op, k = Op.LE, k - 1
+    elif op == Op.GT:
+        op, k = Op.GE, k + 1
+
+    literals = [_convert_expr(x, variables_dict, ctx, memo) for x in left.operands]
+    n = len(literals)
+    if op == Op.LE and k < n:
+        return z3.AtMost(*literals, k) if k >= 0 else z3.BoolVal(False, ctx)
+    if op == Op.GE and k > 0:
+        return z3.AtLeast(*literals, k) if k <= n else z3.BoolVal(False, ctx)
+    if op in (Op.EQ, Op.NE) and 0 <= k <= n and n > 0:
+        ret = z3.PbEq([(x, 1) for x in literals], k)
+        return ret if op == Op.EQ else z3.Not(ret, ctx)
+    # the remaining cases are decided without the literals
+    if op == Op.LE:
+        return z3.BoolVal(k >= n, ctx)
+    if op == Op.GE:
+        return z3.BoolVal(k <= 0, ctx)
+    holds = n == 0 and k == 0
+    return z3.BoolVal(holds if op == Op.EQ else not holds, ctx)
+
+
+def _convert_compound_expr(e, variables_dict, ctx, memo):
+    if e.op in _FLIPPED_COMPARISONS:
+        ret = _convert_cardinality(e, variables_dict, ctx, memo)
+        if ret is not None:
             return ret
-        elif e.op == Op.EQ:
-            return operands[0] == operands[1]
-        elif e.op == Op.NE:
-            return operands[0] != operands[1]
-        elif e.op == Op.LE:
-            return operands[0] <= operands[1]
-        elif e.op == Op.LT:
-            return operands[0] < operands[1]
-        elif e.op == Op.GE:
-            return operands[0] >= operands[1]
-        elif e.op == Op.GT:
-            return operands[0] > operands[1]
-        elif e.op == Op.NOT:
-            return z3.Not(operands[0])
-        elif e.op == Op.AND:
-            return z3.And(operands)
-        elif e.op == Op.OR:
-            return z3.Or(operands)
-        elif e.op == Op.XOR:
-            return z3.Xor(operands[0], operands[1])
-        elif e.op == Op.IFF:
-            return operands[0] == operands[1]
-        elif e.op == Op.IMP:
-            return z3.Or(z3.Not(operands[0]), operands[1])
-        elif e.op == Op.IF:
-            return z3.If(operands[0], operands[1], operands[2])
-        elif e.op == Op.ALLDIFF:
-            return z3.Distinct(operands)
+    operands = list(map(lambda x: _convert_expr(x, variables_dict, ctx, memo), e.operands))
+    if e.op == Op.NEG:
+        return -operands[0]
+    elif e.op == Op.ADD:
+        return z3.Sum(operands)
+    elif e.op == Op.SUB:
+        ret = operands[0]
+        for i in range(1, len(operands)):
+            ret = ret - operands[i]
+        return ret
+    elif e.op == Op.MUL:
+        return operands[0] * operands[1]
+    elif e.op == Op.EQ:
+        return operands[0] == operands[1]
+    elif e.op == Op.NE:
+        return operands[0] != operands[1]
+    elif e.op == Op.LE:
+        return operands[0] <= operands[1]
+    elif e.op == Op.LT:
+        return operands[0] < operands[1]
+    elif e.op == Op.GE:
+        return operands[0] >= operands[1]
+    elif e.op == Op.GT:
+        return operands[0] > operands[1]
+    elif e.op == Op.NOT:
+        return z3.Not(operands[0], ctx)
+    elif e.op == Op.AND:
+        return z3.And(*operands, ctx)
+    elif e.op == Op.OR:
+        return z3.Or(*operands, ctx)
+    elif e.op == Op.XOR:
+        return z3.Xor(operands[0], operands[1], ctx)
+    elif e.op == Op.IFF:
+        return operands[0] == operands[1]
+    elif e.op == Op.IMP:
+        return z3.Or(z3.Not(operands[0], ctx), operands[1])
+    elif e.op == Op.IF:
+        return z3.If(operands[0], operands[1], operands[2], ctx)
+    elif e.op == Op.ALLDIFF:
+        return z3.Distinct(operands)
+    elif e.op == Op.COUNT_TRUE:
+        return z3.Sum([z3.If(x, 1, 0, ctx) for x in operands] + [z3.IntVal(0, ctx)])
+
+
+def _bool_constant(e):
+    if isinstance(e, bool):
+        return e
+    if isinstance(e, Expr) and e.op == Op.BOOL_CONSTANT:
+        return e.operands[0]
+    return None
 
 
 class Z3Backend(Backend):
+    """Backend using z3.
+
+    Native graph constraints (`GRAPH_ACTIVE_VERTICES_CONNECTED` and `GRAPH_DIVISION`) are checked
+    by a user propagator (see `cspuz.backend.z3_propagator`). `GRAPH_DIVISION` with group sizes
+    other than constants cannot be checked by the propagator, since it observes only boolean
+    terms, and is replaced by its encoding without the primitive instead. Native graph
+    constraints are emitted only if `config.use_graph_primitive` (or
+    `config.use_graph_division_primitive`) is enabled, which is not the default for z3.
+    """
+
     def __init__(self, variables):
         global z3
         if z3 is None:
             z3 = importlib.import_module("z3")
 
         self.variables = variables
+        self._ctx = _get_context()
         self.variables_dict = dict()
         id_last = 0
         for v in variables:
             if isinstance(v, BoolVar):
-                self.variables_dict[v.id] = z3.Bool("b" + str(id_last))
+                self.variables_dict[v.id] = z3.Bool("b" + str(id_last), self._ctx)
             elif isinstance(v, IntVar):
-                self.variables_dict[v.id] = z3.Int("i" + str(id_last))
+                self.variables_dict[v.id] = z3.Int("i" + str(id_last), self._ctx)
             id_last += 1
         self.converted_constraints = []
+        self._converted_exprs = {}
+        # the graph constraints checked by the propagator, and their specifications for
+        # `z3_propagator.make_constraints`
+        self._graph_constraints = []
+        self._graph_specs = []
+        self._num_aux_variables = 0
+        self._propagator = None
+        self._perf_stats = None
 
     def add_constraint(self, constraint):
-        if isinstance(constraint, list):
-            self.converted_constraints += map(
-                lambda e: _convert_expr(e, self.variables_dict), constraint
-            )
+        if not isinstance(constraint, list):
+            constraint = [constraint]
+        for e in constraint:
+            if isinstance(e, Expr) and e.op in (
+                Op.GRAPH_ACTIVE_VERTICES_CONNECTED,
+                Op.GRAPH_DIVISION,
+            ):
+                self._add_graph_constraint(e)
+            else:
+                self.converted_constraints.append(
+                    _convert_expr(e, self.variables_dict, self._ctx, self._converted_exprs)
+                )
+
+    def _graph_terms(self, exprs):
+        terms = []
+        values = []
+        for x in exprs:
+            value = _bool_constant(x)
+            if value is None:
+                terms.append(
+                    _convert_expr(x, self.variables_dict, self._ctx, self._converted_exprs)
+                )
+            else:
+                terms.append(None)
+            values.append(value)
+        return terms, values
+
+    def _add_graph_constraint(self, e):
+        from ..graph import Graph
+
+        n = e.operands[0]
+        edges = e.operands[2 + n].operands
+        graph = Graph(n)
+        graph.add_edges(zip(edges[0::2], edges[1::2]))
+        if e.op == Op.GRAPH_ACTIVE_VERTICES_CONNECTED:
+            terms, values = self._graph_terms(e.operands[2 : 2 + n])
+            self._graph_specs.append(("connected", graph, [], terms, values))
         else:
-            self.converted_constraints.append(_convert_expr(constraint, self.variables_dict))
+            sizes = [x if x is None else _int_constant(x) for x in e.operands[2 : 2 + n]]
+            if any(x is not None and size is None for x, size in zip(e.operands[2:], sizes)):
+                self._lower_graph_division(e, graph)
+                return
+            terms, values = self._graph_terms(e.operands[3 + n :])
+            self._graph_specs.append(("division", graph, sizes, terms, values))
+        self._graph_constraints.append(e)
 
-    def solve(self):
-        solver = z3.Solver()
+    def _lower_graph_division(self, e, graph):
+        # Adds the encoding of `GRAPH_DIVISION` without the primitive. The auxiliary variables
+        # are z3 constants named `a0`, `a1`, ..., which do not correspond to `variables`.
+        from .. import graph as graph_module
+        from ..solver import Solver
+
+        n = graph.num_vertices
+        scratch = Solver(intern_exprs=False)
+        scratch.variables = list(self.variables)
+        graph_module._division_connected_variable_groups_with_borders(
+            scratch,
+            graph,
+            e.operands[2 : 2 + n],
+            e.operands[3 + n :],
+            use_graph_primitive=False,
+        )
+        variables_dict = dict(self.variables_dict)
+        for v in scratch.variables[len(self.variables) :]:
+            name = "a" + str(self._num_aux_variables)
+            self._num_aux_variables += 1
+            if isinstance(v, BoolVar):
+                variables_dict[v.id] = z3.Bool(name, self._ctx)
+            else:
+                var_z3 = z3.Int(name, self._ctx)
+                variables_dict[v.id] = var_z3
+                self.converted_constraints += [v.lo <= var_z3, var_z3 <= v.hi]
+        for c in scratch.constraints:
+            self.converted_constraints.append(
+                _convert_expr(c, variables_dict, self._ctx, self._converted_exprs)
+            )
+
+    def serialize(self):
+        from ..flat import FlatModel
+
+        solver = z3.Solver(ctx=self._ctx)
+        solver.add(self.converted_constraints)
+        graph_constraints = FlatModel(self.variables, self._graph_constraints)
+        return solver.sexpr(), self._num_aux_variables, graph_constraints
+
+    @classmethod
+    def deserialize(cls, variables, data):
+        smt2, num_aux_variables, graph_constraints = data
+        backend = cls(variables)
+        # the declared constants are identical to those in `variables_dict` as they have the same
+        # names
+        backend.converted_constraints = list(z3.parse_smt2_string(smt2, ctx=backend._ctx))
+        backend._num_aux_variables = num_aux_variables
+        backend.add_constraint(graph_constraints.constraints(variables))
+        return backend
+
+    def _new_solver(self, *extra_constraints):
+        # A fresh z3 solver is created for each check, while the converted constraints are
+        # reused. Adding constraints to a solver after `check` (or checking with assumptions)
+        # makes z3 switch to its incremental engine, which is much slower on typical puzzle models
+        # than re-solving from scratch.
+        solver = z3.Solver(ctx=self._ctx)
         for var in self.variables:
             if isinstance(var, IntVar):
                 var_z3 = self.variables_dict[var.id]
                 solver.add(var.lo <= var_z3, var_z3 <= var.hi)
         solver.add(self.converted_constraints)
+        solver.add(extra_constraints)
+        if len(self._graph_specs) > 0:
+            global z3_propagator
+            if z3_propagator is None:
+                z3_propagator = importlib.import_module(".z3_propagator", __package__)
+            constraints = z3_propagator.make_constraints(self._graph_specs)
+            # kept alive until the next check, as z3 refers to it during the search
+            self._propagator = z3_propagator.GraphPropagator(solver, constraints)
+            if self._propagator.inconsistent:
+                solver.add(z3.BoolVal(False, self._ctx))
+        return solver
+
+    def _check(self, solver, *assumptions):
+        res = solver.check(*assumptions)
+        stats = solver.statistics()
+        if self._perf_stats is None:
+            self._perf_stats = {"num_checks": 0}
+        self._perf_stats["num_checks"] += 1
+        for key in stats.keys():
+            value = stats.get_key_value(key)
+            if "memory" in key:
+                self._perf_stats[key] = max(self._perf_stats.get(key, 0), value)
+            else:
+                self._perf_stats[key] = self._perf_stats.get(key, 0) + value
+        return res
 
-        if solver.check() == z3.unsat:
+    def _get_value(self, model, var):
+        value = model.eval(self.variables_dict[var.id], model_completion=True)
+        if isinstance(var, BoolVar):
+            return z3.is_true(value)
+        else:
+            return value.as_long()
+
+    def solve(self):
+        solver = self._new_solver()
+        if self._check(solver) == z3.unsat:
             return False
 
         model = solver.model()
         for var in self.variables:
-            var_z3 = self.variables_dict[var.id]
-            if isinstance(var, BoolVar):
-                var.sol = z3.is_true(model[var_z3])
-            elif isinstance(var, IntVar):
-                var.sol = model[var_z3].as_long()
+            var.sol = self._get_value(model, var)
         return True
+
+    def solve_irrefutably(self, is_answer_key):
+        for var in self.variables:
+            var.sol = None
+        solver = self._new_solver()
+        if self._check(solver) == z3.unsat:
+            return False
+
+        model = solver.model()
+        undecided = [var for var, is_key in zip(self.variables, is_answer_key) if is_key]
+        answer = {var.id: self._get_value(model, var) for var in undecided}
+        while len(undecided) > 0:
+            # Since `undecided` only shrinks, the latest refuting condition implies all the
+            # earlier ones and therefore it is sufficient to add only this one.
+            refuting_cond = z3.Or(
+                [self.variables_dict[var.id] != answer[var.id] for var in undecided]
+            )
+            if config.z3_incremental_irrefutable:
+                # The condition is added to the same solver, guarded by a fresh literal which is
+                # assumed only in this check, so that the solver keeps what it has learnt.
+                guard = z3.FreshBool("refute", self._ctx)
+                solver.add(z3.Implies(guard, refuting_cond))
+                res = self._check(solver, guard)
+            else:
+                solver = self._new_solver(refuting_cond)
+                res = self._check(solver)
+            if res == z3.unsat:
+                break
+            # every answer key whose value differs in the new model is refutable
+            model = solver.model()
+            undecided = [var for var in undecided if self._get_value(model, var) == answer[var.id]]
+
+        for var in undecided:
+            var.sol = answer[var.id]
+        return True
+
+    def perf_stats(self):
+        return self._perf_stats
@@ -0,0 +1,417 @@
+"""Native graph constraints for the z3 backend, implemented by a z3 user propagator.
+
+`GRAPH_ACTIVE_VERTICES_CONNECTED` and `GRAPH_DIVISION` are not expressible as z3 formulas of a
+reasonable size. Instead of encoding them, the boolean terms of the constraints (the activity of
+vertices and the borders on edges) are registered to a `z3.UserPropagateBase`, which is notified
+whenever z3 fixes the value of one of them and checks the constraints on the partial assignment:
+
+- For `GRAPH_ACTIVE_VERTICES_CONNECTED`, the vertices reachable from an active vertex without
+  passing inactive vertices are computed. An active vertex outside them is a conflict, and the
+  other undecided vertices are propagated to be inactive. Both are explained by the cut: the
+  inactive vertices adjacent to the reachable ones. When a vertex gets inactive, only the
+  vertices which it cuts off from the reachable ones are checked, since the other unreachable
+  vertices have been propagated already.
+- For `GRAPH_DIVISION`, the vertices joined by non-border edges are merged in a union-find (with
+  rollback on backtracking). A border edge inside a merged group, a group larger than the size of
+  one of its vertices, or two different sizes in a group is a conflict explained by the non-border
+  edges joining the vertices. A group surrounded by border edges with fewer vertices than its size
+  is a conflict explained by the surrounding border edges. When a group reaches its size, the
+  undecided edges leaving it are propagated to be borders.
+
+All the state is kept in a trail, which is rolled back on `pop`. This module imports z3 and is
+loaded only when a model with graph constraints is given to `Z3Backend`.
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import z3  # type: ignore
+
+from ..graph import Graph
+
+Term = Any  # a z3 boolean term, or `None` for constants
+
+
+class _Propagation(object):
+    # What the constraints report to: `GraphPropagator` during the search, or `_StaticCheck`
+    # before it.
+    def conflict(self, deps: List[Term]) -> None:
+        raise NotImplementedError
+
+    def propagate(self, e: Any, ids: List[Term]) -> Any:
+        raise NotImplementedError
+
+    def push_trail(self, undo: Callable[[Any], None], arg: Any) -> None:
+        raise NotImplementedError
+
+
+class _StaticCheck(_Propagation):
+    # Checks the constraints on the constant terms. The changes of the state are permanent.
+    def __init__(self) -> None:
+        self.failed = False
+
+    def conflict(self, deps: List[Term]) -> None:
+        self.failed = True
+
+    def propagate(self, e: Any, ids: List[Term]) -> Any:
+        pass
+
+    def push_trail(self, undo: Callable[[Any], None], arg: Any) -> None:
+        pass
+
+
+class _GraphConstraint(object):
+    # A graph constraint on the terms `terms`. `values[i]` is the current value of `terms[i]`
+    # (`None` if undecided). Constant terms are given as `None` in `terms` with their value in
+    # `values`.
+    def __init__(self, terms: List[Term], values: List[Optional[bool]]) -> None:
+        self.terms = terms
+        self.values = values
+
+    def deps(self, indices: Sequence[int]) -> List[Term]:
+        return [self.terms[i] for i in indices if self.terms[i] is not None]
+
+    def assign(self, prop: "_Propagation", i: int, value: bool) -> bool:
+        # Records the value of `terms[i]` and checks the constraint. Returns `False` on a
+        # conflict.
+        raise NotImplementedError
+
+    def check(self, prop: "_Propagation") -> bool:
+        # Checks the constraint without propagation. Returns `False` on a conflict.
+        raise NotImplementedError
+
+    def initialize(self, prop: "_Propagation") -> bool:
+        # Checks the constraint on the constant terms before the search.
+        return self.check(prop)
+
+    def reset_value(self, i: int) -> None:
+        self.values[i] = None
+
+
+class ActiveVerticesConnected(_GraphConstraint):
+    def __init__(self, graph: Graph, terms: List[Term], values: List[Optional[bool]]) -> None:
+        super().__init__(terms, values)
+        self.graph = graph
+        # an active vertex, from which the reachable vertices are computed
+        self.root: Optional[int] = None
+        for i, v in enumerate(values):
+            if v is True:
+                self.root = i
+                break
+
+    def _reachable(self) -> Tuple[List[bool], List[int]]:
+        # Returns whether each vertex is reachable from `root` without passing inactive vertices,
+        # and the inactive vertices adjacent to the reachable ones.
+        assert self.root is not None
+        graph = self.graph
+        values = self.values
+        reachable = [False] * graph.num_vertices
+        reachable[self.root] = True
+        cut = []
+        queue = [self.root]
+        i = 0
+        while i < len(queue):
+            for w in graph.neighbors(queue[i]):
+                if reachable[w]:
+                    continue
+                reachable[w] = True
+                if values[w] is False:
+                    cut.append(w)
+                else:
+                    queue.append(w)
+            i += 1
+        for w in cut:
+            reachable[w] = False
+        return reachable, cut
+
+    def _propagate(self, prop: "_Propagation", propagate: bool) -> bool:
+        if self.root is None:
+            return True
+        reachable, cut = self._reachable()
+        reason = self.deps([self.root] + cut)
+        for v in range(self.graph.num_vertices):
+            if reachable[v] or self.values[v] is False:
+                continue
+            if self.values[v] is True:
+                prop.conflict(reason + self.deps([v]))
+                return False
+            if propagate:
+                prop.propagate(z3.Not(self.terms[v]), reason)
+        return True
+
+    def _propagate_cut(self, prop: "_Propagation", v: int) -> bool:
+        # Checks the vertices which are cut off from `root` by making `v` inactive, i.e. those
+        # in the components of the neighbors of `v` which are not reachable any more.
+        assert self.root is not None
+        graph = self.graph
+        values = self.values
+        reachable, cut = self._reachable()
+        if not any(reachable[w] for w in graph.neighbors(v)):
+            # `v` was not reachable either, so its neighbors have been cut off already
+            return True
+        reason = self.deps([self.root] + cut)
+        # `reachable` also marks the vertices visited below
+        for w in graph.neighbors(v):
+            if reachable[w] or values[w] is False:
+                continue
+            reachable[w] = True
+            queue = [w]
+            i = 0
+            while i < len(queue):
+                x = queue[i]
+                if values[x] is True:
+                    prop.conflict(reason + self.deps([x]))
+                    return False
+                prop.propagate(z3.Not(self.terms[x]), reason)
+                for y in graph.neighbors(x):
+                    if not reachable[y] and values[y] is not False:
+                        reachable[y] = True
+                        queue.append(y)
+                i += 1
+        return True
+
+    def assign(self, prop: "_Propagation", i: int, value: bool) -> bool:
+        if value:
+            if self.root is not None:
+                # `i` is reachable, or it has been propagated to be inactive
+                return True
+            self.root = i
+            prop.push_trail(self._reset_root, None)
+            return self._propagate(prop, True)
+        if self.root is None:
+            return True
+        return self._propagate_cut(prop, i)
+
+    def check(self, prop: "_Propagation") -> bool:
+        return self._propagate(prop, False)
+
+    def _reset_root(self, _: Any) -> None:
+        self.root = None
+
+
+class Division(_GraphConstraint):
+    # `terms` are the borders of the edges of `graph`. `sizes` are the group sizes of vertices.
+    def __init__(
+        self,
+        graph: Graph,
+        sizes: List[Optional[int]],
+        terms: List[Term],
+        values: List[Optional[bool]],
+    ) -> None:
+        super().__init__(terms, values)
+        self.graph = graph
+        n = graph.num_vertices
+        self.parent = list(range(n))
+        self.members = [[v] for v in range(n)]
+        # a vertex of each group whose size is given, which determines the size of the group
+        self.sized = [v if sizes[v] is not None else None for v in range(n)]
+        self.sizes = sizes
+
+    def find(self, v: int) -> int:
+        while self.parent[v] != v:
+            v = self.parent[v]
+        return v
+
+    def _tree(self, src: int, dest: Optional[int] = None) -> List[int]:
+        # Returns the non-border edges on a path from `src` to `dest` (or, if `dest` is `None`,
+        # those spanning the group of `src`).
+        graph = self.graph
+        parent_edge = {src: -1}
+        queue = [src]
+        i = 0
+        while i < len(queue) and dest not in parent_edge:
+            v = queue[i]
+            for w, e in zip(graph.neighbors(v), graph.incident_edge_ids(v)):
+                if self.values[e] is False and w not in parent_edge:
+                    parent_edge[w] = e
+                    queue.append(w)
+            i += 1
+        if dest is None:
+            return [e for e in parent_edge.values() if e >= 0]
+        ret = []
+        v = dest
+        while v != src:
+            e = parent_edge[v]
+            ret.append(e)
+            a, b = graph[e]
+            v = a if b == v else b
+        return ret
+
+    def _check_small(self, prop: "_Propagation", v: int) -> bool:
+        # Checks that the vertices reachable from `v` without crossing borders are not fewer than
+        # the size of a vertex among them.
+        graph = self.graph
+        visited = {v}
+        queue = [v]
+        cut = []
+        required = 0
+        i = 0
+        while i < len(queue):
+            x = queue[i]
+            required = max(required, self.sizes[x] or 0)
+            for w, e in zip(graph.neighbors(x), graph.incident_edge_ids(x)):
+                if self.values[e] is True:
+                    cut.append(e)
+                elif w not in visited:
+                    visited.add(w)
+                    queue.append(w)
+            i += 1
+        if len(queue) < required:
+            prop.conflict(self.deps(cut))
+            return False
+        return True
+
+    def _conflict_on_group(self, prop: "_Propagation", root: int) -> bool:
+        # Checks the sizes of the group `root` after a merge.
+        sized = self.sized[root]
+        if sized is None:
+            return True
+        required = self.sizes[sized]
+        assert required is not None
+        size = len(self.members[root])
+        if size > required:
+            prop.conflict(self.deps(self._tree(sized)))
+            return False
+        if size == required:
+            reason = self.deps(self._tree(sized))
+            graph = self.graph
+            for v in self.members[root]:
+                for w, e in zip(graph.neighbors(v), graph.incident_edge_ids(v)):
+                    if self.values[e] is None and self.find(w) != root:
+                        prop.propagate(self.terms[e], reason)
+        return True
+
+    def _union(self, prop: "_Propagation", e: int) -> bool:
+        u, v = self.graph[e]
+        a = self.find(u)
+        b = self.find(v)
+        if a == b:
+            return True
+        if len(self.members[a]) < len(self.members[b]):
+            a, b = b, a
+        # merge `b` into `a`
+        sa = self.sized[a]
+        sb = self.sized[b]
+        if sa is not None and sb is not None and self.sizes[sa] != self.sizes[sb]:
+            prop.conflict(self.deps(self._tree(sa, sb)))
+            return False
+        graph = self.graph
+        for x in self.members[b]:
+            for w, f in zip(graph.neighbors(x), graph.incident_edge_ids(x)):
+                if self.values[f] is True and self.find(w) == a:
+                    prop.conflict(self.deps(self._tree(x, w) + [f]))
+                    return False
+        self.parent[b] = a
+        self.members[a] += self.members[b]
+        if sa is None:
+            self.sized[a] = sb
+        prop.push_trail(self._split, (a, b, sa))
+        return self._conflict_on_group(prop, a)
+
+    def initialize(self, prop: "_Propagation") -> bool:
+        for e in range(len(self.values)):
+            if self.values[e] is False and not self._union(prop, e):
+                return False
+        return self.check(prop)
+
+    def assign(self, prop: "_Propagation", i: int, value: bool) -> bool:
+        if not value:
+            return self._union(prop, i)
+        u, v = self.graph[i]
+        if self.find(u) == self.find(v):
+            prop.conflict(self.deps(self._tree(u, v) + [i]))
+            return False
+        return self._check_small(prop, u) and self._check_small(prop, v)
+
+    def check(self, prop: "_Propagation") -> bool:
+        for v in range(self.graph.num_vertices):
+            if self.find(v) == v and not self._check_small(prop, v):
+                return False
+        return True
+
+    def _split(self, token: Tuple[int, int, Optional[int]]) -> None:
+        # Undoes the merge of `b` into `a`.
+        a, b, sa = token
+        del self.members[a][-len(self.members[b]) :]
+        self.parent[b] = b
+        self.sized[a] = sa
+
+
+class GraphPropagator(z3.UserPropagateBase, _Propagation):
+    """User propagator checking the graph constraints `constraints` in `solver`.
+
+    Each of `constraints` must be created for this propagator, since their state is modified
+    during the search. If the constraints are violated by the constant terms, `inconsistent` is
+    set to `True` (and the search must not be started).
+    """
+
+    def __init__(self, solver: Any, constraints: List[_GraphConstraint]) -> None:
+        super().__init__(solver)
+        self.constraints = constraints
+        static = _StaticCheck()
+        for c in constraints:
+            if not c.initialize(static):
+                break
+        self.inconsistent = static.failed
+        # the occurrences of each registered term, keyed by the id of the term
+        self._watches: Dict[int, List[Tuple[_GraphConstraint, int]]] = {}
+        self._trail: List[Tuple[Callable[[Any], None], Any]] = []
+        self._levels: List[int] = []
+        self.add_fixed(self._on_fixed)
+        self.add_final(self._on_final)
+        for c in constraints:
+            for i, t in enumerate(c.terms):
+                if t is None:
+                    continue
+                key = t.get_id()
+                if key not in self._watches:
+                    self._watches[key] = []
+                    self.add(t)
+                self._watches[key].append((c, i))
+
+    def push(self) -> None:
+        self._levels.append(len(self._trail))
+
+    def pop(self, num_scopes: int) -> None:
+        target = self._levels[-num_scopes]
+        del self._levels[-num_scopes:]
+        while len(self._trail) > target:
+            undo, arg = self._trail.pop()
+            undo(arg)
+
+    def fresh(self, new_ctx: Any) -> Any:
+        raise NotImplementedError("graph constraints are not supported in this mode of z3")
+
+    def push_trail(self, undo: Callable[[Any], None], arg: Any) -> None:
+        # Records `undo`, which is called with `arg` on backtracking.
+        self._trail.append((undo, arg))
+
+    def _on_fixed(self, term: Any, value: Any) -> None:
+        is_true = z3.is_true(value)
+        for c, i in self._watches[term.get_id()]:
+            c.values[i] = is_true
+            self.push_trail(c.reset_value, i)
+        for c, i in self._watches[term.get_id()]:
+            if not c.assign(self, i, is_true):
+                return
+
+    def _on_final(self) -> None:
+        for c in self.constraints:
+            if not c.check(self):
+                return
+
+
+def make_constraints(
+    specs: List[Tuple[str, Graph, List[Optional[int]], List[Term], List[Optional[bool]]]],
+) -> List[_GraphConstraint]:
+    """Create the constraints for a new `GraphPropagator` from their specifications.
+
+    Each specification is a tuple `(kind, graph, sizes, terms, values)`, where `kind` is
+    `"connected"` or `"division"` and `sizes` is used only for the latter.
+    """
+    ret: List[_GraphConstraint] = []
+    for kind, graph, sizes, terms, values in specs:
+        if kind == "connected":
+            ret.append(ActiveVerticesConnected(graph, terms, list(values)))
+        else:
+            ret.append(Division(graph, sizes, terms, list(values)))
+    return ret
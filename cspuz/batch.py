@@ -0,0 +1,249 @@
+"""Solving many models in parallel with a pool of worker processes."""
+
+import multiprocessing
+import multiprocessing.connection
+import os
+import time
+import warnings
+from typing import Any, Callable, Dict, Generator, Iterable, List, Optional, Tuple, Union
+
+from .configuration import config
+from .flat import FlatModel
+from .refinement import new_backend
+from .solver import Solver, _get_backend, _solve_irrefutably
+
+# extra time given to a worker before it is killed, so that subprocess backends can terminate the
+# solver processes by themselves on timeout
+_KILL_GRACE_PERIOD = 1.0
+
+
+class BatchResult(object):
+    """Result of solving a model in `solve_many`.
+
+    Attributes:
+        index (int): The index of the model in the input.
+        solver (Solver): The model itself. The solution is written back into its variables.
+        is_sat (Optional[bool]): The return value of `Solver.solve` or `Solver.find_answer` for
+            the model, or `None` if solving the model failed.
+        error (Optional[str]): The reason of the failure (an exception raised during solving,
+            a timeout, or an unexpected termination of the worker), or `None` if succeeded.
+    """
+
+    index: int
+    solver: Solver
+    is_sat: Optional[bool]
+    error: Optional[str]
+
+    def __init__(
+        self, index: int, solver: Solver, is_sat: Optional[bool], error: Optional[str] = None
+    ) -> None:
+        self.index = index
+        self.solver = solver
+        self.is_sat = is_sat
+        self.error = error
+
+
+def _worker_main(conn: Any, config_values: Dict[str, Any]) -> None:
+    for key, value in config_values.items():
+        setattr(config, key, value)
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        backend_type, model, mode, data = task
+        try:
+            variables = model.make_variables()
+            is_answer_key = [x != 0 for x in model.is_answer_key]
+            csp_solver = backend_type.deserialize(variables, data)
+            if mode == "find_answer":
+                is_sat = csp_solver.solve()
+            else:
+                is_sat = _solve_irrefutably(csp_solver, variables, is_answer_key)
+            conn.send((is_sat, [v.sol for v in variables], csp_solver.perf_stats(), None))
+        except Exception as e:
+            conn.send((None, None, None, repr(e)))
+
+
+class _Worker:
+    def __init__(
+        self, context: Any, config_values: Dict[str, Any], target: Callable = _worker_main
+    ) -> None:
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=target, args=(child_conn, config_values), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.task: Optional[Tuple[int, Solver, Any]] = None
+        self.deadline: Optional[float] = None
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def shutdown(self) -> None:
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+def _prepare_task(
+    solver: Solver, backend_type: type, mode: str
+) -> Union[Tuple[Tuple[Any, ...], Any], bool, str]:
+    # Returns the task to be sent to a worker together with the key of the solve cache, or the
+    # result if it is known without solving.
+    if mode == "solve" and not any(solver.is_answer_key):
+        warnings.warn("no answer key is given")
+    try:
+        constraints = solver._constraints_for_backend()
+        if constraints is None:
+            return solver._set_inconsistent()
+        key, cached = solver._lookup_cache(constraints, mode)
+        if cached is not None:
+            return cached
+        csp_solver = new_backend(backend_type, solver.variables, constraints)
+        data = csp_solver.serialize()
+    except Exception as e:
+        return repr(e)
+    # only the declarations of the variables are needed, which are shipped in the flat form
+    model = FlatModel(solver.variables, [], solver.is_answer_key)
+    return (type(csp_solver), model, mode, data), key
+
+
+def solve_many(
+    models: Iterable[Solver],
+    backend: Union[None, str, type] = None,
+    workers: Optional[int] = None,
+    mode: str = "solve",
+    timeout: Optional[float] = None,
+) -> Generator[BatchResult, None, None]:
+    """Solve many models in parallel with a pool of worker processes.
+
+    Each model is converted into the input of the backend (e.g. a CSP description for Sugar-like
+    backends) in the calling process, and it is solved in one of the worker processes. The
+    solutions are written back into the variables of the models as `Solver.solve` (or
+    `Solver.find_answer` if `mode` is `"find_answer"`) does.
+
+    Models are taken from `models` lazily, so `models` can be a generator over a large corpus.
+    The solve cache (see `cspuz.cache`) is consulted before a model is sent to a worker.
+    Results are yielded in the order of completion, not in the order of `models`.
+
+    Args:
+        models (Iterable[Solver]): Models to be solved.
+        backend (Union[None, str, type]): The backend to be used. The backend must support
+            `serialize` and `deserialize`.
+        workers (Optional[int]): The number of worker processes. The number of CPUs is used by
+            default.
+        mode (str): `"solve"` or `"find_answer"`.
+        timeout (Optional[float]): Time limit in seconds for solving each model. A worker
+            exceeding the limit is killed and replaced by a new one.
+
+    Returns:
+        Generator[BatchResult, None, None]: The results of solving the models.
+    """
+    if mode not in ("solve", "find_answer"):
+        raise ValueError("mode must be 'solve' or 'find_answer'")
+    backend_type = _get_backend(backend)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 0:
+        raise ValueError("workers must be positive")
+
+    config_values = dict(vars(config))
+    if timeout is not None and config_values["solver_timeout"] is None:
+        config_values["solver_timeout"] = timeout
+    context = multiprocessing.get_context()
+
+    idle: List[_Worker] = []
+    busy: List[_Worker] = []
+    try:
+        for _ in range(workers):
+            idle.append(_Worker(context, config_values))
+
+        model_iter = enumerate(models)
+        exhausted = False
+        while True:
+            while len(idle) > 0 and not exhausted:
+                try:
+                    index, model = next(model_iter)
+                except StopIteration:
+                    exhausted = True
+                    break
+                task = _prepare_task(model, backend_type, mode)
+                if isinstance(task, bool):
+                    yield BatchResult(index, model, task)
+                    continue
+                if isinstance(task, str):
+                    yield BatchResult(index, model, None, task)
+                    continue
+                task, key = task
+                worker = idle.pop()
+                worker.conn.send(task)
+                worker.task = (index, model, key)
+                if timeout is not None:
+                    worker.deadline = time.monotonic() + timeout + _KILL_GRACE_PERIOD
+                busy.append(worker)
+
+            if len(busy) == 0:
+                break
+
+            wait_timeout = None
+            deadlines = [w.deadline for w in busy if w.deadline is not None]
+            if len(deadlines) > 0:
+                wait_timeout = max(0.0, min(deadlines) - time.monotonic())
+            multiprocessing.connection.wait(
+                [w.conn for w in busy] + [w.process.sentinel for w in busy], timeout=wait_timeout
+            )
+
+            finished = []
+            still_busy = []
+            for worker in busy:
+                assert worker.task is not None
+                index, model, key = worker.task
+                error = None
+                if worker.conn.poll():
+                    try:
+                        is_sat, sols, perf_stats, error = worker.conn.recv()
+                    except EOFError:
+                        error = "worker terminated unexpectedly"
+                    else:
+                        if error is None:
+                            for v, sol in zip(model.variables, sols):
+                                v.sol = sol
+                            model._perf_stats = perf_stats
+                            model._store_cache(key, is_sat)
+                        worker.task = None
+                        worker.deadline = None
+                        idle.append(worker)
+                        finished.append(BatchResult(index, model, is_sat, error))
+                        continue
+                elif not worker.process.is_alive():
+                    error = "worker terminated unexpectedly"
+                elif worker.deadline is not None and time.monotonic() >= worker.deadline:
+                    error = "timeout"
+                else:
+                    still_busy.append(worker)
+                    continue
+
+                # the worker is in an unknown state, so it is replaced by a new one
+                worker.kill()
+                idle.append(_Worker(context, config_values))
+                finished.append(BatchResult(index, model, None, error))
+            busy = still_busy
+            yield from finished
+    finally:
+        for worker in idle:
+            worker.shutdown()
+        for worker in busy:
+            worker.kill()
@@ -0,0 +1,122 @@
+"""Cache of solve results keyed by the content of the problem.
+
+Results of `Solver.find_answer` and `Solver.solve` are stored with the key computed from the
+canonical form of the model (see `cspuz.canonical`), which reflects the answer keys, and the solve
+mode. Since the canonical form does not depend on the numbering of variables, the solution is
+stored in the canonical order of variables. The cache has two tiers: a bounded in-memory LRU
+cache, and an optional sqlite database which can be shared among processes.
+
+The cache is enabled by `config.solve_cache_size` and `config.solve_cache_path`.
+"""
+
+import contextlib
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+from .configuration import config
+
+CacheEntry = Tuple[bool, List[Any]]
+
+
+def cache_key(canonical_digest: str, mode: str) -> str:
+    """Compute the cache key from the digest of the canonical form and the solve mode."""
+    return "{}:{}".format(mode, canonical_digest)
+
+
+class SolveCache(object):
+    """Two-tier cache of solve results.
+
+    Each entry is a pair of the result (`True` if satisfiable) and the values of `sol` of all the
+    variables in the canonical order.
+
+    Args:
+        max_entries (int): The maximum number of entries kept in memory.
+        path (Optional[str]): The path to the sqlite database. Entries are also written to (and
+            looked up from) the database if this is given.
+    """
+
+    def __init__(self, max_entries: int, path: Optional[str] = None) -> None:
+        self.max_entries = max_entries
+        self.path = path
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._table_created = False
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+
+        if self.path is None:
+            return None
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        is_sat, sols = json.loads(row[0])
+        entry = (is_sat, sols)
+        self._put_memory(key, entry)
+        return entry
+
+    def put(self, key: str, entry: CacheEntry) -> None:
+        self._put_memory(key, entry)
+        if self.path is not None:
+            value = json.dumps([entry[0], entry[1]])
+            with self._connect() as conn:
+                conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?)", (key, value))
+
+    def clear(self) -> None:
+        """Remove all the entries, including those in the database."""
+        with self._lock:
+            self._entries.clear()
+        if self.path is not None:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM results")
+
+    def _put_memory(self, key: str, entry: CacheEntry) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    @contextlib.contextmanager
+    def _connect(self) -> Any:
+        # A connection is opened for each operation, so that the cache can be used from multiple
+        # threads and from forked processes.
+        assert self.path is not None
+        conn = sqlite3.connect(self.path, timeout=60)
+        try:
+            with conn:
+                if not self._table_created:
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT)"
+                    )
+                    self._table_created = True
+                yield conn
+        finally:
+            conn.close()
+
+
+_cache: Optional[SolveCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_solve_cache() -> Optional[SolveCache]:
+    """Return the cache configured by `config`, or `None` if the cache is disabled."""
+    global _cache
+    size = config.solve_cache_size
+    path = config.solve_cache_path
+    if size <= 0 and path is None:
+        return None
+    with _cache_lock:
+        if _cache is None or _cache.max_entries != size or _cache.path != path:
+            _cache = SolveCache(size, path)
+        return _cache
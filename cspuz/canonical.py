@@ -0,0 +1,163 @@
+"""Canonical form of CSP models, invariant to the numbering of variables.
+
+Two models which are identical up to the order of variable creation and the order of constraints
+(and of operands of commutative operators) usually get the same canonical form, although this is
+not guaranteed in general since exact canonicalization is as hard as graph isomorphism. The
+canonical form is used as the key of the solve cache (see `cspuz.cache`).
+
+The canonicalization works as follows:
+
+1. Each constraint is rendered with variables replaced by their types and domains (and whether
+   they are answer keys), sorting the operands of commutative operators. Constraints are sorted
+   by the rendered text.
+2. Variables are renumbered in the order of first occurrence in the sorted constraints. Variables
+   not occurring in any constraint follow them.
+3. Constraints are rendered again with the new numbering and sorted, and the digest is computed
+   from the rendered constraints and the declarations of the renumbered variables.
+"""
+
+import hashlib
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from .expr import BoolExprLike, BoolVar, Expr, IntVar, Op
+
+_COMMUTATIVE_OPS = (
+    Op.ADD,
+    Op.MUL,
+    Op.EQ,
+    Op.NE,
+    Op.AND,
+    Op.OR,
+    Op.IFF,
+    Op.XOR,
+    Op.ALLDIFF,
+    Op.COUNT_TRUE,
+)
+
+# `a >= b` and `a > b` are rendered as `b <= a` and `b < a`, respectively.
+_FLIPPED_OPS = {Op.GE: Op.LE, Op.GT: Op.LT}
+
+
+def _is_compound(e: Any) -> bool:
+    return (
+        isinstance(e, Expr)
+        and not e.is_variable()
+        and e.op not in (Op.BOOL_CONSTANT, Op.INT_CONSTANT)
+    )
+
+
+def _constant_text(e: Any) -> str:
+    if e is None:
+        return "*"
+    if isinstance(e, Expr):
+        e = e.operands[0]
+    if isinstance(e, bool):
+        return "true" if e else "false"
+    return str(e)
+
+
+def _shape_text(e: Any) -> str:
+    if isinstance(e, BoolVar):
+        return "b"
+    if isinstance(e, IntVar):
+        return "i{},{}".format(e.lo, e.hi)
+    return _constant_text(e)
+
+
+def _render(
+    roots: Sequence[Any], leaf_text: Callable[[Any], str], memo: Dict[int, Tuple[str, List[Any]]]
+) -> List[str]:
+    # Renders each of `roots`, storing the text and the sorted operands of every compound node
+    # into `memo` (keyed by the id of the node).
+    ret = []
+    for root in roots:
+        if not _is_compound(root):
+            ret.append(leaf_text(root))
+            continue
+        stack = [root]
+        while len(stack) > 0:
+            e = stack[-1]
+            if id(e) in memo:
+                stack.pop()
+                continue
+            pending = [x for x in e.operands if _is_compound(x) and id(x) not in memo]
+            if len(pending) > 0:
+                stack += pending
+                continue
+            stack.pop()
+
+            op = e.op
+            operands = list(e.operands)
+            if op in _FLIPPED_OPS:
+                op = _FLIPPED_OPS[op]
+                operands.reverse()
+            texts = [memo[id(x)][0] if _is_compound(x) else leaf_text(x) for x in operands]
+            if op in _COMMUTATIVE_OPS:
+                order = sorted(range(len(operands)), key=texts.__getitem__)
+                operands = [operands[i] for i in order]
+                texts = [texts[i] for i in order]
+            memo[id(e)] = ("({} {})".format(op.name, " ".join(texts)), operands)
+        ret.append(memo[id(root)][0])
+    return ret
+
+
+def canonicalize(
+    variables: Sequence[Union[BoolVar, IntVar]],
+    constraints: Sequence[BoolExprLike],
+    is_answer_key: Optional[Sequence[bool]] = None,
+) -> Tuple[str, List[int]]:
+    """Compute the canonical form of a model.
+
+    Args:
+        variables (Sequence[Union[BoolVar, IntVar]]): The variables of the model. The id of each
+            variable must be its index in `variables`.
+        constraints (Sequence[BoolExprLike]): The constraints of the model.
+        is_answer_key (Optional[Sequence[bool]]): Whether each variable is an answer key. If
+            given, answer keys are distinguished from the other variables in the canonical form.
+
+    Returns:
+        Tuple[str, List[int]]: The digest of the canonical form, and the permutation `perm` of
+        variables such that `variables[perm[i]]` is the `i`-th variable in the canonical form.
+    """
+
+    def shape_text(e: Any) -> str:
+        if is_answer_key is not None and isinstance(e, (BoolVar, IntVar)) and is_answer_key[e.id]:
+            return _shape_text(e) + "k"
+        return _shape_text(e)
+
+    shape_memo: Dict[int, Tuple[str, List[Any]]] = {}
+    shapes = _render(constraints, shape_text, shape_memo)
+    constraint_order = sorted(range(len(constraints)), key=shapes.__getitem__)
+
+    new_index = [-1] * len(variables)
+    perm: List[int] = []
+    visited = set()
+    for i in constraint_order:
+        stack = [constraints[i]]
+        while len(stack) > 0:
+            e = stack.pop()
+            if isinstance(e, (BoolVar, IntVar)):
+                if new_index[e.id] < 0:
+                    new_index[e.id] = len(perm)
+                    perm.append(e.id)
+            elif _is_compound(e) and id(e) not in visited:
+                visited.add(id(e))
+                stack += reversed(shape_memo[id(e)][1])
+
+    unused = [i for i in range(len(variables)) if new_index[i] < 0]
+    for i in sorted(unused, key=lambda i: (shape_text(variables[i]), i)):
+        new_index[i] = len(perm)
+        perm.append(i)
+
+    def canonical_text(e: Any) -> str:
+        if isinstance(e, BoolVar):
+            return "b{}".format(new_index[e.id])
+        if isinstance(e, IntVar):
+            return "i{}".format(new_index[e.id])
+        return _constant_text(e)
+
+    lines = [shape_text(variables[i]) for i in perm]
+    lines.append("")
+    lines += sorted(_render(constraints, canonical_text, {}))
+    digest = hashlib.sha256("\n".join(lines).encode("utf-8")).hexdigest()
+    return digest, perm
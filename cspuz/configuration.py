@@ -1,6 +1,5 @@
 import os
-from typing import Optional, TypeVar, Union
-
+from typing import Any, List, Optional, TypeVar, Union
 
 T = TypeVar("T")
 
@@ -58,12 +57,15 @@ class Config(object):
     """
     Class for maintaining the solver configurations.
 
-    Currently, there are 5 different backends supported:
+    Currently, there are 7 different backends supported:
 
     - `sugar`
     Sugar CSP solver (https://cspsat.gitlab.io/sugar/).
     - `sugar_extended`
     Sugar CSP solver with an optimization for `solve_irrefutably` feature.
+    - `sugar_server`
+    Same as `sugar_extended`, but keeps solver processes (`sugar_ext.sh`
+    running in the server mode) alive and reuses them for later solves.
     - `z3`
     z3 SMT solver (https://pypi.org/project/z3-solver/).
     Prerequisite: `import z3` succeeds.
@@ -75,6 +77,9 @@ class Config(object):
     cspuz_core CSP solver (https://github.com/semiexp/cspuz_core) with Python
     interface.
     Prerequisite: `import cspuz_core` succeeds.
+    - `portfolio`
+    Runs the backends given by `portfolio` (see below) in parallel worker
+    processes and adopts the first answer.
     - `auto`
     Automatically decide the backend based on availability of the libraries.
     The priority is as follows:
@@ -92,11 +97,20 @@ class Config(object):
 
     `backend_path` specifies the path to the executable of the backend solver
     (e.g. `sugar` script, `sugar_ext.sh`, or a binary of Sugar-compatible
-    CSP solver like csugar) for `sugar` and `sugar_extended` backends.
+    CSP solver like csugar) for `sugar`, `sugar_extended` and `sugar_server`
+    backends.
+
+    `sugar_server_pool_size` is the maximum number of solver processes kept
+    alive by `sugar_server` backend. Processes are started on demand, so more
+    than one process is started only if solvers are used concurrently.
 
     `use_graph_primitive` controls whether native graph constraints are used.
     This feature is supported by csugar and cspuz_core CSP solver and is
-    enabled by default for `csugar` and `cspuz_core` backends.
+    enabled by default for `csugar` and `cspuz_core` backends. It is also
+    supported by `z3` backend, where native graph constraints are checked by
+    a user propagator written in Python. This is opt-in for `z3` (as well as
+    `use_graph_division_primitive`), since the propagator is often slower
+    than the ordinary encoding, e.g. on masyu and nurikabe.
     You can use this for `sugar` and `sugar_extended` backends to work with
     csugar or cspuz_core CLI, but cspuz does not check whether the backend
     actually supports native graph constraints.
@@ -105,6 +119,72 @@ class Config(object):
     `active_vertices_connected`). Therefore, it is strongly recommended to set
     `default_backend` correctly, rather than specifying the backend on calling
     `Solver.solve` or `Solver.solve_irrefutably`.
+
+    `use_lazy_connectivity` controls how connectivity constraints (like
+    `active_vertices_connected`) are translated when native graph constraints
+    are not used. If enabled, the connectivity is enforced lazily by solving
+    the problem without it and adding cuts separating disconnected components
+    of the returned assignment, until it is connected (see
+    `cspuz.refinement`). Otherwise (by default), connectivity is encoded by
+    ranks of vertices, which can be large on large boards. Like
+    `use_graph_primitive`, this affects the translation on the invocation of
+    graph constraints methods.
+
+    `use_expr_interning` controls whether `Solver` hash-conses the constraints
+    given to `Solver.ensure` by default, so that structurally equal
+    subexpressions are shared among constraints (see `cspuz.expr.ExprTable`).
+    This can be also specified for each `Solver` on its construction.
+
+    `use_simplification` controls whether constraints are simplified (constant
+    propagation, removal of trivially satisfied constraints and detection of
+    trivially violated constraints) before they are passed to the backend in
+    `Solver.find_answer` and `Solver.solve`. This is enabled by default.
+
+    `cse_threshold` enables common-subexpression elimination in Sugar-like
+    backends (all backends except `z3`): each non-trivial subexpression
+    referenced more than `cse_threshold` times is replaced by an auxiliary
+    variable in the CSP description, together with a constraint defining it.
+    Only subexpressions shared as Python objects are detected, so this works
+    best with `use_expr_interning`. This is disabled (`None`) by default.
+
+    `z3_incremental_irrefutable` controls how `z3` backend runs
+    `Solver.solve_irrefutably`. If enabled, the refuting conditions are added
+    to a single z3 solver and checked under assumptions, so that the solver
+    keeps what it has learnt across the checks. Otherwise (by default), a
+    fresh solver is created for each check, which is usually faster since z3
+    uses a slower engine for incremental solving.
+
+    `portfolio` is the list of members of `portfolio` backend. Each member
+    is a `cspuz.portfolio.PortfolioMember` or a string like
+    `cspuz_core:use_graph_primitive=False,cse_threshold=3`, which is a
+    backend name optionally followed by overrides of configurations for the
+    member. Native graph constraints are replaced by their ordinary encodings
+    for members with `use_graph_primitive` (or `use_graph_division_primitive`)
+    disabled. This can be given by `$CSPUZ_PORTFOLIO` as `;`-separated
+    strings. The number of wins of each member is available from
+    `cspuz.portfolio.win_counts`.
+
+    `csp_dump_path` is the path to a file into which Sugar-like backends
+    write the CSP description on each invocation of the solver (`None` by
+    default). This is useful for reproducing a problem outside cspuz.
+
+    `solve_cache_size` and `solve_cache_path` enable the cache of the results
+    of `Solver.find_answer` and `Solver.solve` (see `cspuz.cache`). Results
+    are looked up by the digest of the canonicalized model (see
+    `cspuz.canonical`), which reflects the answer keys, and the kind of
+    solving, so that models differing only in the numbering of variables
+    share an entry. Cached solutions are stored in the canonical order of
+    variables and mapped back to the variables of the solver through the
+    permutation computed by the canonicalization, and the backend is not
+    invoked on a hit. `solve_cache_size` is the maximum number of results
+    kept in memory (0 by default, i.e. disabled), and `solve_cache_path` is
+    the path to a sqlite database which stores the results persistently and
+    can be shared among processes (`None` by default).
+
+    `max_concurrent_solves` is the maximum number of `Solver.solve_async` and
+    `Solver.find_answer_async` running concurrently in an event loop. Further
+    calls wait until a running one finishes. This defaults to the number of
+    CPUs.
     """
 
     default_backend: str
@@ -112,6 +192,17 @@ class Config(object):
     csugar_binding: Optional[str]
     use_graph_primitive: bool
     use_graph_division_primitive: bool
+    use_lazy_connectivity: bool
+    use_expr_interning: bool
+    use_simplification: bool
+    cse_threshold: Optional[int]
+    z3_incremental_irrefutable: bool
+    sugar_server_pool_size: int
+    portfolio: List[Any]
+    csp_dump_path: Optional[str]
+    solve_cache_size: int
+    solve_cache_path: Optional[str]
+    max_concurrent_solves: int
     solver_timeout: Optional[float]
 
     def __init__(self, infer_from_env: bool = True) -> None:
@@ -141,6 +232,31 @@ class Config(object):
                 graph_division_primitive_default,
             )
         )
+        self.use_lazy_connectivity = _strtobool(
+            _get_default(infer_from_env, "CSPUZ_USE_LAZY_CONNECTIVITY", "False")
+        )
+        self.use_expr_interning = _strtobool(
+            _get_default(infer_from_env, "CSPUZ_USE_EXPR_INTERNING", "False")
+        )
+        self.use_simplification = _strtobool(
+            _get_default(infer_from_env, "CSPUZ_USE_SIMPLIFICATION", "True")
+        )
+        cse_threshold = _get_default(infer_from_env, "CSPUZ_CSE_THRESHOLD", None)
+        self.cse_threshold = int(cse_threshold) if cse_threshold is not None else None
+        self.z3_incremental_irrefutable = _strtobool(
+            _get_default(infer_from_env, "CSPUZ_Z3_INCREMENTAL_IRREFUTABLE", "False")
+        )
+        self.sugar_server_pool_size = int(
+            _get_default(infer_from_env, "CSPUZ_SUGAR_SERVER_POOL_SIZE", "1")
+        )
+        portfolio = _get_default(infer_from_env, "CSPUZ_PORTFOLIO", "")
+        self.portfolio = [m.strip() for m in portfolio.split(";") if m.strip() != ""]
+        self.csp_dump_path = _get_default(infer_from_env, "CSPUZ_CSP_DUMP_PATH", None)
+        self.solve_cache_size = int(_get_default(infer_from_env, "CSPUZ_SOLVE_CACHE_SIZE", "0"))
+        self.solve_cache_path = _get_default(infer_from_env, "CSPUZ_SOLVE_CACHE_PATH", None)
+        self.max_concurrent_solves = int(
+            _get_default(infer_from_env, "CSPUZ_MAX_CONCURRENT_SOLVES", str(os.cpu_count() or 1))
+        )
         self.solver_timeout = None
 
 
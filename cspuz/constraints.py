@@ -1,12 +1,23 @@
 from typing import Any, List, Union, overload
 
-from .array import BoolArray1D, BoolArray2D, IntArray1D, IntArray2D, _elementwise
+from .array import (
+    Array1D,
+    Array2D,
+    BoolArray1D,
+    BoolArray2D,
+    IntArray1D,
+    IntArray2D,
+    _elementwise,
+)
 from .expr import BoolExpr, BoolExprLike, IntExpr, IntExprLike, Op
 
 
 def flatten_iterator(*args: Any) -> Any:
     for arg in args:
-        if hasattr(arg, "__iter__"):
+        if isinstance(arg, (Array1D, Array2D)):
+            # the elements of arrays are not iterable
+            yield from arg.data
+        elif hasattr(arg, "__iter__"):
             for xs in arg:
                 for x in flatten_iterator(xs):
                     yield x
@@ -29,7 +40,7 @@ def alldifferent(*args: Any) -> BoolExpr:
 
 
 def count_true(*args: Any) -> IntExpr:
-    operands: List[Union[IntExpr, int]] = []
+    operands: List[BoolExpr] = []
     constant = 0
 
     for x in flatten_iterator(*args):
@@ -37,16 +48,20 @@ def count_true(*args: Any) -> IntExpr:
             if x is True:
                 constant += 1
         elif isinstance(x, BoolExpr):
-            operands.append(x.cond(1, 0))
+            operands.append(x)
         else:
             raise TypeError()
 
-    if constant > 0:
-        operands.append(constant)
     if len(operands) == 0:
-        return IntExpr(Op.INT_CONSTANT, [0])
+        if constant == 0:
+            return IntExpr(Op.INT_CONSTANT, [0])
+        return IntExpr(Op.ADD, [constant])
 
-    return IntExpr(Op.ADD, operands)  # type: ignore
+    # backends can encode comparisons on `COUNT_TRUE` as cardinality constraints
+    ret = IntExpr(Op.COUNT_TRUE, operands)
+    if constant > 0:
+        ret = IntExpr(Op.ADD, [ret, constant])
+    return ret
 
 
 def fold_or(*args: Any) -> BoolExpr:
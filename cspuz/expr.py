@@ -1,11 +1,13 @@
 from enum import Enum, auto
 from typing import (
     Any,
+    Dict,
     Iterable,
     List,
     Literal,
     Optional,
     TYPE_CHECKING,
+    Tuple,
     Union,
     cast,
     overload,
@@ -22,6 +24,7 @@ class Op(Enum):
     NEG = auto()  # -int : int
     ADD = auto()  # int + int : int
     SUB = auto()  # int - int : int
+    MUL = auto()  # int * (constant) int : int
     EQ = auto()  # int == int : bool
     NE = auto()  # int != int : bool
     LE = auto()  # int <= int : bool
@@ -35,9 +38,12 @@ class Op(Enum):
     XOR = auto()  # bool != bool : bool
     IMP = auto()  # bool (=>) bool : bool
     IF = auto()  # if (bool) { int } else { int } : int
+    COUNT_TRUE = auto()  # count_true(bool*) : int
     ALLDIFF = auto()  # alldifferent(int*) : bool
     GRAPH_ACTIVE_VERTICES_CONNECTED = auto()
     GRAPH_DIVISION = auto()
+    GRAPH_EDGES = auto()  # endpoints of the edges of a graph, shared by graph constraints
+    LAZY_ACTIVE_VERTICES_CONNECTED = auto()  # enforced by `cspuz.refinement`, not by backends
 
 
 BoolOp = Literal[
@@ -56,7 +62,7 @@ BoolOp = Literal[
     Op.IMP,
     Op.ALLDIFF,
 ]
-IntOp = Literal[Op.INT_CONSTANT, Op.NEG, Op.ADD, Op.SUB, Op.IF]
+IntOp = Literal[Op.INT_CONSTANT, Op.NEG, Op.ADD, Op.SUB, Op.MUL, Op.IF, Op.COUNT_TRUE]
 
 ExprLike = Union["Expr", int, bool]
 BoolExprLike = Union["BoolExpr", bool]
@@ -83,7 +89,7 @@ def is_bool_op(op: Op) -> bool:
 
 
 def is_int_op(op: Op) -> bool:
-    return op in [Op.INT_CONSTANT, Op.NEG, Op.ADD, Op.SUB, Op.IF]
+    return op in [Op.INT_CONSTANT, Op.NEG, Op.ADD, Op.SUB, Op.MUL, Op.IF, Op.COUNT_TRUE]
 
 
 def _is_bool_expr_like(value: Any) -> bool:
@@ -94,6 +100,14 @@ def _is_int_expr_like(value: Any) -> bool:
     return isinstance(value, (IntExpr, int)) and not isinstance(value, bool)
 
 
+def _is_int_constant(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+# operators whose chains are spliced into n-ary nodes by `cspuz.simplify.flatten_chains`
+_ASSOCIATIVE_OPS = (Op.AND, Op.OR, Op.ADD)
+
+
 def _make_bool_expr(op: BoolOp, operands: List[ExprLike]) -> "BoolExpr":
     # type checking
     if op in [Op.EQ, Op.NE, Op.LE, Op.LT, Op.GE, Op.GT]:
@@ -128,6 +142,14 @@ def _make_int_expr(op: IntOp, operands: List[ExprLike]) -> "IntExpr":
     elif op == Op.NEG:
         if len(operands) != 1 or not _is_int_expr_like(operands[0]):
             return NotImplemented
+    elif op == Op.MUL:
+        # only multiplication by constants is supported
+        if (
+            len(operands) != 2
+            or not all(map(_is_int_expr_like, operands))
+            or not any(map(_is_int_constant, operands))
+        ):
+            return NotImplemented
     elif op == Op.IF:
         if len(operands) != 3 or not (
             _is_bool_expr_like(operands[0])
@@ -135,6 +157,9 @@ def _make_int_expr(op: IntOp, operands: List[ExprLike]) -> "IntExpr":
             and _is_int_expr_like(operands[2])
         ):
             return NotImplemented
+    elif op == Op.COUNT_TRUE:
+        if not all(map(_is_bool_expr_like, operands)):
+            return NotImplemented
     else:
         raise ValueError(f"operator {op} does not return an int value")
 
@@ -142,9 +167,14 @@ def _make_int_expr(op: IntOp, operands: List[ExprLike]) -> "IntExpr":
 
 
 class Expr:
+    __slots__ = ("op", "operands")
+
+    op: Op
+    operands: Tuple[ExprLike, ...]
+
     def __init__(self, op: Op, operands: Iterable[ExprLike]):
-        self.op: Op = op
-        self.operands: List[ExprLike] = list(operands)
+        self.op = op
+        self.operands = tuple(operands)
 
     def is_variable(self) -> bool:
         return False
@@ -158,6 +188,8 @@ class Expr:
 
 
 class BoolExpr(Expr):
+    __slots__ = ()
+
     def __init__(self, op: Op, operands: Iterable[ExprLike]):
         super().__init__(op, operands)
 
@@ -259,7 +291,7 @@ class BoolExpr(Expr):
         return self
 
     def count_true(self) -> "IntExpr":
-        return self.cond(1, 0)
+        return _make_int_expr(Op.COUNT_TRUE, [self])
 
     @property
     def sol(self) -> Optional[bool]:
@@ -271,6 +303,8 @@ class BoolExpr(Expr):
 
 
 class IntExpr(Expr):
+    __slots__ = ()
+
     def __init__(self, op: Op, operands: Iterable[ExprLike]):
         super().__init__(op, operands)
 
@@ -289,6 +323,12 @@ class IntExpr(Expr):
     def __rsub__(self, other: IntExprLike) -> "IntExpr":
         return _make_int_expr(Op.SUB, [other, self])
 
+    def __mul__(self, other: int) -> "IntExpr":
+        return _make_int_expr(Op.MUL, [self, other])
+
+    def __rmul__(self, other: int) -> "IntExpr":
+        return _make_int_expr(Op.MUL, [other, self])
+
     def __eq__(self, other: IntExprLike) -> "BoolExpr":  # type: ignore
         return _make_bool_expr(Op.EQ, [self, other])
 
@@ -317,38 +357,121 @@ class IntExpr(Expr):
 
 
 class BoolVar(BoolExpr):
+    __slots__ = ("id", "_sol")
+
+    id: int
+    _sol: Optional[bool]
+
     def __init__(self, var_id: int):
-        super().__init__(Op.VAR, [])
-        self.id: int = var_id
-        self.__sol: Optional[bool] = None
+        super().__init__(Op.VAR, ())
+        self.id = var_id
+        self._sol = None
 
     def is_variable(self) -> bool:
         return True
 
     @property
     def sol(self) -> Optional[bool]:
-        return self.__sol
+        return self._sol
 
     @sol.setter
     def sol(self, value: Optional[bool]) -> None:
-        self.__sol = value
+        self._sol = value
 
 
 class IntVar(IntExpr):
+    __slots__ = ("id", "lo", "hi", "_sol")
+
+    id: int
+    lo: int
+    hi: int
+    _sol: Optional[int]
+
     def __init__(self, var_id: int, lo: int, hi: int):
-        super().__init__(Op.VAR, [])
-        self.id: int = var_id
-        self.lo: int = lo
-        self.hi: int = hi
-        self.__sol: Optional[int] = None
+        super().__init__(Op.VAR, ())
+        self.id = var_id
+        self.lo = lo
+        self.hi = hi
+        self._sol = None
 
     def is_variable(self) -> bool:
         return True
 
     @property
     def sol(self) -> Optional[int]:
-        return self.__sol
+        return self._sol
 
     @sol.setter
     def sol(self, value: Optional[int]) -> None:
-        self.__sol = value
+        self._sol = value
+
+
+def _operand_key(value: Any) -> Any:
+    # Canonical sub-expressions are kept alive by the table, so their ids are stable.
+    # Constants are tagged with their type so that `True` and `1` are not confused.
+    if isinstance(value, Expr):
+        return id(value)
+    elif value is None:
+        return None
+    else:
+        return (type(value), value)
+
+
+class ExprTable:
+    """Hash-consing table for expressions.
+
+    Structurally equal expressions (that is, expressions with the same operator and the same
+    operands) passed to :meth:`intern` are replaced by a single canonical node, so that shared
+    subterms are stored only once and backends can convert each distinct node only once.
+
+    Since the operands of a canonical node are canonical themselves, the key of a node consists of
+    its operator and the identities of its operands. Therefore, the structural hash of a node is
+    computed in time proportional to its arity rather than the size of the whole subtree.
+    """
+
+    _table: Dict[Tuple[Any, ...], "Expr"]
+
+    def __init__(self) -> None:
+        self._table = {}
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def intern(self, expr: ExprLike) -> ExprLike:
+        """Return the canonical node structurally equal to `expr`.
+
+        Variables and Python constants are returned as they are.
+        """
+        if not isinstance(expr, Expr) or expr.is_variable():
+            return expr
+
+        # The memo is valid only during this call since ids of non-canonical nodes may be reused
+        # once they are freed.
+        memo: Dict[int, ExprLike] = {}
+        stack: List[Tuple[Expr, bool]] = [(expr, False)]
+        while len(stack) > 0:
+            e, visited = stack.pop()
+            if id(e) in memo:
+                continue
+            if not visited:
+                stack.append((e, True))
+                for x in e.operands:
+                    if isinstance(x, Expr) and not x.is_variable() and id(x) not in memo:
+                        stack.append((x, False))
+                continue
+
+            operands = [
+                memo[id(x)] if isinstance(x, Expr) and not x.is_variable() else x
+                for x in e.operands
+            ]
+            key = (e.op,) + tuple(map(_operand_key, operands))
+            canonical = self._table.get(key)
+            if canonical is None:
+                if all(x is y for x, y in zip(operands, e.operands)):
+                    canonical = e
+                else:
+                    canonical = type(e)(e.op, operands)
+                self._table[key] = canonical
+            memo[id(e)] = canonical
+
+        return memo[id(expr)]
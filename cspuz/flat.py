@@ -0,0 +1,218 @@
+"""Array-backed flat representation of whole models.
+
+A `FlatModel` stores the variables and the constraints of a model in a few `array.array`s instead
+of a graph of `Expr` objects. It is much smaller than the object graph, and it is pickled as a
+handful of byte strings, so it is used to ship models to worker processes (`Analyzer.analyze`, the
+portfolio backend and `solve_many`). Backends can consume it directly by `Backend.add_flat_model`,
+which the workers of the portfolio backend use unless the model has to be rewritten as `Expr`s
+(e.g. for lowering native graph constraints). The workers of `Analyzer.analyze` restore the
+constraints as `Expr`s since they solve various subsets of them.
+
+Variables are referred to by their ids. The expression nodes are stored in post-order (every node
+comes after its operands), and subexpressions shared as Python objects are stored only once. An
+operand of a node is a reference `r`: it is the variable with id `r` if `r < num_variables`, and
+the node `r - num_variables` otherwise.
+"""
+
+from array import array
+from typing import Any, Dict, List, Optional, Sequence, TYPE_CHECKING, Union
+
+from .expr import BoolExpr, BoolExprLike, BoolVar, Expr, IntExpr, IntVar, Op, is_int_op
+
+if TYPE_CHECKING:
+    from .solver import Solver
+
+# Codes of nodes which are not `Expr`s. The other nodes have the value of their `Op` as the code.
+# The "operands" of these nodes and `Op.BOOL_CONSTANT` / `Op.INT_CONSTANT` nodes are the values
+# themselves rather than references.
+LITERAL_NONE = 0  # `None` (e.g. unspecified group sizes of `GRAPH_DIVISION`)
+LITERAL_BOOL = -1  # a bare `bool`
+LITERAL_INT = -2  # a bare `int`
+
+_CODE_TO_OP = {op.value: op for op in Op}
+
+
+def _is_compound(e: Any) -> bool:
+    return (
+        isinstance(e, Expr)
+        and not e.is_variable()
+        and e.op not in (Op.BOOL_CONSTANT, Op.INT_CONSTANT)
+    )
+
+
+class FlatModel(object):
+    """Flat representation of a model.
+
+    Args:
+        variables (Sequence[Union[BoolVar, IntVar]]): The variables of the model. The id of each
+            variable must be its index in `variables`.
+        constraints (Sequence[BoolExprLike]): The constraints of the model.
+        is_answer_key (Optional[Sequence[bool]]): Whether each variable is an answer key.
+
+    Attributes:
+        is_int_var (array): Whether each variable is an int variable (`0` or `1`).
+        var_lo (array): The lower bound of each int variable (`0` for bool variables).
+        var_hi (array): The upper bound of each int variable (`0` for bool variables).
+        is_answer_key (array): Whether each variable is an answer key (`0` or `1`).
+        codes (array): The code of each node.
+        offsets (array): The operands of the `i`-th node are `args[offsets[i]:offsets[i + 1]]`.
+        args (array): The operands of all the nodes.
+        roots (array): The references to the constraints.
+    """
+
+    def __init__(
+        self,
+        variables: Sequence[Union[BoolVar, IntVar]],
+        constraints: Sequence[BoolExprLike],
+        is_answer_key: Optional[Sequence[bool]] = None,
+    ) -> None:
+        num_variables = len(variables)
+        self.is_int_var = array("b", [0] * num_variables)
+        self.var_lo = array("q", [0] * num_variables)
+        self.var_hi = array("q", [0] * num_variables)
+        for v in variables:
+            if isinstance(v, IntVar):
+                self.is_int_var[v.id] = 1
+                self.var_lo[v.id] = v.lo
+                self.var_hi[v.id] = v.hi
+            elif not isinstance(v, BoolVar):
+                raise TypeError("each element in 'variables' must be BoolVar or IntVar")
+        if is_answer_key is None:
+            is_answer_key = [False] * num_variables
+        self.is_answer_key = array("b", map(int, is_answer_key))
+        self.codes = array("b")
+        self.offsets = array("q", [0])
+        self.args = array("q")
+        self.roots = array("q")
+
+        # references to the nodes added so far, keyed by the ids of `Expr`s and by the literals
+        refs: Dict[Any, int] = {}
+
+        def add_node(code: int, args: List[int]) -> int:
+            self.codes.append(code)
+            self.args.extend(args)
+            self.offsets.append(len(self.args))
+            return num_variables + len(self.codes) - 1
+
+        def atom_ref(x: Any) -> int:
+            if isinstance(x, (BoolVar, IntVar)):
+                return x.id
+            value: Any = None
+            if isinstance(x, Expr):
+                key: Any = id(x)
+                code = x.op.value
+                value = x.operands[0]
+            elif x is None:
+                key = None
+                code = LITERAL_NONE
+            elif isinstance(x, bool):
+                key = (bool, x)
+                code = LITERAL_BOOL
+                value = x
+            elif isinstance(x, int):
+                key = (int, x)
+                code = LITERAL_INT
+                value = x
+            else:
+                raise TypeError("unsupported operand type: '{}'".format(type(x).__name__))
+            ref = refs.get(key)
+            if ref is None:
+                ref = add_node(code, [] if x is None else [int(value)])
+                refs[key] = ref
+            return ref
+
+        for c in constraints:
+            if not _is_compound(c):
+                self.roots.append(atom_ref(c))
+                continue
+            stack: List[Any] = [c]
+            while len(stack) > 0:
+                e = stack[-1]
+                if id(e) in refs:
+                    stack.pop()
+                    continue
+                pending = [x for x in e.operands if _is_compound(x) and id(x) not in refs]
+                if len(pending) > 0:
+                    stack += pending
+                    continue
+                stack.pop()
+                operand_refs = [
+                    refs[id(x)] if _is_compound(x) else atom_ref(x) for x in e.operands
+                ]
+                refs[id(e)] = add_node(e.op.value, operand_refs)
+            self.roots.append(refs[id(c)])
+
+    @property
+    def num_variables(self) -> int:
+        return len(self.var_lo)
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.codes)
+
+    def make_variables(self) -> List[Union[BoolVar, IntVar]]:
+        """Create the variables of the model."""
+        ret: List[Union[BoolVar, IntVar]] = []
+        for i in range(self.num_variables):
+            if self.is_int_var[i]:
+                ret.append(IntVar(i, self.var_lo[i], self.var_hi[i]))
+            else:
+                ret.append(BoolVar(i))
+        return ret
+
+    def constraints(
+        self, variables: Optional[Sequence[Union[BoolVar, IntVar]]] = None
+    ) -> List[BoolExprLike]:
+        """Restore the constraints as `Expr` objects.
+
+        Args:
+            variables (Optional[Sequence[Union[BoolVar, IntVar]]]): The variables to which the
+                restored constraints refer. New variables are created by `make_variables` if not
+                given.
+
+        Returns:
+            List[BoolExprLike]: The constraints of the model. Shared subexpressions are restored
+            as shared objects.
+        """
+        if variables is None:
+            variables = self.make_variables()
+        elif len(variables) != self.num_variables:
+            raise ValueError("the number of variables does not match")
+        codes = self.codes
+        offsets = self.offsets
+        args = self.args
+        # the variables followed by the nodes, so that references are indices in this list
+        nodes: List[Any] = list(variables)
+        for i in range(len(codes)):
+            code = codes[i]
+            start = offsets[i]
+            if code == LITERAL_NONE:
+                nodes.append(None)
+            elif code == LITERAL_BOOL:
+                nodes.append(args[start] != 0)
+            elif code == LITERAL_INT:
+                nodes.append(args[start])
+            elif code == Op.BOOL_CONSTANT.value:
+                nodes.append(BoolExpr(Op.BOOL_CONSTANT, [args[start] != 0]))
+            elif code == Op.INT_CONSTANT.value:
+                nodes.append(IntExpr(Op.INT_CONSTANT, [args[start]]))
+            else:
+                op = _CODE_TO_OP[code]
+                operands = [nodes[r] for r in args[start : offsets[i + 1]]]
+                if op == Op.GRAPH_EDGES:
+                    nodes.append(Expr(op, operands))
+                elif is_int_op(op):
+                    nodes.append(IntExpr(op, operands))
+                else:
+                    nodes.append(BoolExpr(op, operands))
+        return [nodes[r] for r in self.roots]
+
+    def to_solver(self) -> "Solver":
+        """Restore the model as a `Solver`."""
+        from .solver import Solver
+
+        solver = Solver(intern_exprs=False)
+        solver.variables = self.make_variables()
+        solver.is_answer_key = [x != 0 for x in self.is_answer_key]
+        solver.constraints = self.constraints(solver.variables)
+        return solver
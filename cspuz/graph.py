@@ -30,43 +30,124 @@ For some constraints, the graph is automatically inferred from the input.
     (TODO: add formal definition)
 """
 
-from typing import Any, Iterator, List, Optional, Sequence, Tuple, Union, cast, overload
+import collections
+import functools
+import itertools
+from array import array
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+    cast,
+    overload,
+)
 
 from .array import Array2D, BoolArray1D, BoolArray2D, IntArray1D, IntArray2D, _infer_shape
 from .constraints import IntExpr, BoolExpr, Op, count_true, then
-from .expr import BoolExprLike, IntExprLike
+from .expr import BoolExprLike, BoolVar, IntExprLike
 from .grid_frame import BoolGridFrame, BoolInnerGridFrame
 from .configuration import config
 from .solver import Solver
 
 
 class Graph(object):
-    """Class for a undirected graph."""
+    """Class for a undirected graph.
+
+    The adjacency of vertices is stored in the compressed sparse row (CSR) form: the incident
+    edges of vertex `v` are at positions `offsets[v]` to `offsets[v + 1] - 1` of the arrays of
+    neighbors and edge ids. The arrays are built from :attr:`edges` when they are needed for the
+    first time after edges are added, so adding edges one by one is cheap.
+
+    A graph can be frozen by :meth:`freeze`. Frozen graphs cannot be modified any more, and thus
+    they can be shared safely. The grid graphs inferred by the constraints in this module are
+    frozen and cached (see :ref:`auto_inference_of_graph`).
+    """
 
     #: The number of vertices in the graph.
     num_vertices: int
 
-    #: List of edges represented by pairs of vertex indices.
-    edges: List[Tuple[int, int]]
-
-    #: List of incident edges for each vertex.
-    #:
-    #: Each element is a list of pairs of vertex. indices and edge indices.
-    incident_edges: List[List[Tuple[int, int]]]
+    _edges: List[Tuple[int, int]]
+    _frozen_edges: Optional[Tuple[Tuple[int, int], ...]]
+    _frozen: bool
+    _line_graph: Optional["Graph"]
+    _csr: Optional[Tuple["array[int]", "array[int]", "array[int]"]]
+    _incident_edges: Optional[Sequence[Sequence[Tuple[int, int]]]]
+    # the number of edges when `_csr` and `_incident_edges` were built
+    _num_indexed_edges: int
 
     def __init__(self, num_vertices: int) -> None:
         self.num_vertices = num_vertices
-        self.edges = []
-        self.incident_edges = [[] for i in range(self.num_vertices)]
+        self._edges = []
+        self._frozen_edges = None
+        self._frozen = False
+        self._line_graph = None
+        self._csr = None
+        self._incident_edges = None
+        self._num_indexed_edges = 0
 
     def __len__(self) -> int:
-        return len(self.edges)
+        return len(self._edges)
 
     def __iter__(self) -> Iterator[Tuple[int, int]]:
-        return iter(self.edges)
+        return iter(self._edges)
 
     def __getitem__(self, item: int) -> Tuple[int, int]:
-        return self.edges[item]
+        return self._edges[item]
+
+    @property
+    def edges(self) -> Sequence[Tuple[int, int]]:
+        """Edges represented by pairs of vertex indices.
+
+        For unfrozen graphs, this is a list which can be replaced or appended to, although
+        :meth:`add_edge` and :meth:`add_edges` are preferred since they check the vertex indices.
+        For frozen graphs, this is a tuple and cannot be replaced, so that the graphs shared by
+        caches cannot be modified through it.
+        """
+        if self._frozen_edges is not None:
+            return self._frozen_edges
+        return self._edges
+
+    @edges.setter
+    def edges(self, edges: List[Tuple[int, int]]) -> None:
+        if self._frozen:
+            raise AttributeError("cannot modify the edges of a frozen graph")
+        self._edges = edges
+        self._csr = None
+        self._incident_edges = None
+
+    @property
+    def is_frozen(self) -> bool:
+        """Whether the graph is frozen."""
+        return self._frozen
+
+    def freeze(self) -> "Graph":
+        """Make the graph immutable.
+
+        Returns:
+            Graph: This graph.
+        """
+        if not self._frozen:
+            self._frozen = True
+            self._frozen_edges = tuple(self._edges)
+            self._drop_stale_indices()
+            if self._incident_edges is not None:
+                self._incident_edges = tuple(tuple(incident) for incident in self._incident_edges)
+        return self
+
+    def _drop_stale_indices(self) -> None:
+        # Edges may be appended to `edges` of unfrozen graphs directly, so the structures built
+        # from the edges are dropped when the number of edges has changed since they were built.
+        if self._num_indexed_edges != len(self._edges):
+            self._csr = None
+            self._incident_edges = None
+            self._num_indexed_edges = len(self._edges)
 
     def add_edge(self, i: int, j: int) -> None:
         """Add an edge connecting vertices `i` and `j`.
@@ -74,11 +155,142 @@ class Graph(object):
         Args:
             i (int): the index of the first vertex
             j (int): the index of the second vertex
+
+        Raises:
+            ValueError: If the graph is frozen.
+            IndexError: If `i` or `j` is not a vertex of the graph.
+        """
+        if self._frozen:
+            raise ValueError("cannot add an edge to a frozen graph")
+        if not (0 <= i < self.num_vertices and 0 <= j < self.num_vertices):
+            raise IndexError("vertex index out of range")
+        self._edges.append((i, j))
+        self._csr = None
+        self._incident_edges = None
+
+    def add_edges(self, edges: Iterable[Tuple[int, int]]) -> None:
+        """Add edges at once.
+
+        This is equivalent to calling :meth:`add_edge` for each edge in `edges`.
+
+        Args:
+            edges (Iterable[Tuple[int, int]]): the pairs of the indices of endpoints
+
+        Raises:
+            ValueError: If the graph is frozen.
+            IndexError: If some endpoint is not a vertex of the graph.
+        """
+        if self._frozen:
+            raise ValueError("cannot add an edge to a frozen graph")
+        new_edges = [(i, j) for i, j in edges]
+        n = self.num_vertices
+        for i, j in new_edges:
+            if not (0 <= i < n and 0 <= j < n):
+                raise IndexError("vertex index out of range")
+        self._edges += new_edges
+        self._csr = None
+        self._incident_edges = None
+
+    def _adjacency(self) -> Tuple["array[int]", "array[int]", "array[int]"]:
+        # Returns the CSR arrays `(offsets, neighbors, edge_ids)`. The incident edges of each
+        # vertex are ordered by their ids.
+        self._drop_stale_indices()
+        if self._csr is not None:
+            return self._csr
+        # The `2 * e`-th and `2 * e + 1`-th half-edges are the edge `e` seen from its endpoints
+        # `edges[e][0]` and `edges[e][1]`, respectively. The half-edges are stably sorted by
+        # their sources, so that the incident edges of each vertex are ordered by their ids.
+        sources = [v for edge in self._edges for v in edge]
+        order = sorted(range(len(sources)), key=sources.__getitem__)
+        neighbors = array("q", [sources[h ^ 1] for h in order])
+        edge_ids = array("q", [h >> 1 for h in order])
+        counts = collections.Counter(sources)
+        offsets = array("q", [0])
+        offsets.extend(itertools.accumulate(counts[v] for v in range(self.num_vertices)))
+        self._csr = (offsets, neighbors, edge_ids)
+        return self._csr
+
+    @property
+    def incident_edges(self) -> Sequence[Sequence[Tuple[int, int]]]:
+        """List of incident edges for each vertex.
+
+        Each element is a list of pairs of vertex indices and edge indices. This is built from the
+        CSR arrays on the first access; :meth:`neighbors` and :meth:`incident_edge_ids` are
+        cheaper for the iteration over the incident edges of a vertex. For unfrozen graphs, this
+        can be replaced, while it is rebuilt once edges are added. For frozen graphs, this is a
+        tuple of tuples and cannot be replaced.
+        """
+        self._drop_stale_indices()
+        if self._incident_edges is None:
+            offsets, neighbors, edge_ids = self._adjacency()
+            pairs = list(zip(neighbors, edge_ids))
+            incident_edges = [pairs[offsets[v] : offsets[v + 1]] for v in range(self.num_vertices)]
+            if self._frozen:
+                self._incident_edges = tuple(tuple(incident) for incident in incident_edges)
+            else:
+                self._incident_edges = incident_edges
+        return self._incident_edges
+
+    @incident_edges.setter
+    def incident_edges(self, incident_edges: List[List[Tuple[int, int]]]) -> None:
+        if self._frozen:
+            raise AttributeError("cannot modify the incident edges of a frozen graph")
+        self._drop_stale_indices()
+        self._incident_edges = incident_edges
+
+    def degree(self, v: int) -> int:
+        """Return the number of edges incident to vertex `v`.
+
+        A self-loop is counted twice.
+        """
+        offsets = self._adjacency()[0]
+        return offsets[v + 1] - offsets[v]
+
+    def degrees(self) -> List[int]:
+        """Return the degree of each vertex."""
+        offsets = self._adjacency()[0]
+        return [y - x for x, y in zip(offsets, offsets[1:])]
+
+    def neighbors(self, v: int) -> Sequence[int]:
+        """Return the vertices adjacent to vertex `v`.
+
+        The neighbors are in the order of the ids of the edges to them, and a vertex adjacent via
+        multiple edges appears multiple times.
+        """
+        offsets, neighbors, _ = self._adjacency()
+        return neighbors[offsets[v] : offsets[v + 1]]
+
+    def incident_edge_ids(self, v: int) -> Sequence[int]:
+        """Return the ids of the edges incident to vertex `v`.
+
+        The `i`-th element corresponds to the `i`-th element of :meth:`neighbors`.
         """
-        edge_id = len(self.edges)
-        self.edges.append((i, j))
-        self.incident_edges[i].append((j, edge_id))
-        self.incident_edges[j].append((i, edge_id))
+        offsets, _, edge_ids = self._adjacency()
+        return edge_ids[offsets[v] : offsets[v + 1]]
+
+    def induced_subgraph(self, vertices: Sequence[int]) -> Tuple["Graph", List[int]]:
+        """Return the subgraph induced by `vertices`.
+
+        Args:
+            vertices (Sequence[int]): the vertices of the subgraph. The `i`-th vertex of the
+                subgraph corresponds to `vertices[i]`.
+
+        Returns:
+            Tuple[Graph, List[int]]: The subgraph, and the ids of the edges of this graph
+            corresponding to the edges of the subgraph. The edges of the subgraph are ordered by
+            their ids in this graph.
+        """
+        new_index = array("q", [-1]) * self.num_vertices
+        for i, v in enumerate(vertices):
+            new_index[v] = i
+        ret = Graph(len(vertices))
+        edge_ids = [
+            e for e, (i, j) in enumerate(self._edges) if new_index[i] >= 0 and new_index[j] >= 0
+        ]
+        ret._edges = [
+            (new_index[self._edges[e][0]], new_index[self._edges[e][1]]) for e in edge_ids
+        ]
+        return ret, edge_ids
 
     def line_graph(self) -> "Graph":
         """Return the "line graph" of this graph.
@@ -91,6 +303,9 @@ class Graph(object):
         numbered from 0 to (the number of edges) - 1 in the same order as the original graph.
         On the other hand, the order of edges in the returned graph is not guaranteed.
 
+        If this graph is frozen, the line graph is computed only once, and the same frozen graph
+        is returned on every call.
+
         Example:
             >>> g = Graph(4)
             >>> g.add_edge(0, 1)
@@ -101,20 +316,22 @@ class Graph(object):
             >>> len(lg)
             5
         """
-        n = self.num_vertices
+        if self._line_graph is not None:
+            return self._line_graph
+        offsets, _, edge_ids = self._adjacency()
         edges = set()
-        for v in range(n):
-            for i in range(len(self.incident_edges[v])):
+        for v in range(self.num_vertices):
+            incident = edge_ids[offsets[v] : offsets[v + 1]]
+            for i in range(len(incident)):
+                x = incident[i]
                 for j in range(i):
-                    x = self.incident_edges[v][i][1]
-                    y = self.incident_edges[v][j][1]
-                    if x < y:
-                        edges.add((x, y))
-                    else:
-                        edges.add((y, x))
+                    # the incident edges are sorted by their ids
+                    y = incident[j]
+                    edges.add((y, x))
         ret = Graph(len(self))
-        for x, y in edges:
-            ret.add_edge(x, y)
+        ret._edges = list(edges)
+        if self._frozen:
+            self._line_graph = ret.freeze()
         return ret
 
 
@@ -126,7 +343,7 @@ def _get_array_shape_2d(array: Union[Array2D, Sequence[Sequence[Any]]]) -> tuple
         return shape
 
 
-def _grid_graph(height: int, width: int) -> Graph:
+def _build_grid_graph(height: int, width: int) -> Graph:
     graph = Graph(height * width)
     for y in range(height):
         for x in range(width):
@@ -137,20 +354,78 @@ def _grid_graph(height: int, width: int) -> Graph:
     return graph
 
 
+def _build_grid_frame_graph(height: int, width: int) -> Graph:
+    # The graph of the intersections of a `height` x `width` grid frame. The edges are numbered
+    # in the same order as the edges in `_from_grid_frame`.
+    graph = Graph((height + 1) * (width + 1))
+    for y in range(height + 1):
+        for x in range(width + 1):
+            if y != height:
+                graph.add_edge(y * (width + 1) + x, (y + 1) * (width + 1) + x)
+            if x != width:
+                graph.add_edge(y * (width + 1) + x, y * (width + 1) + (x + 1))
+    return graph
+
+
+def _build_crossable_graph(height: int, width: int) -> Graph:
+    # The graph for `active_edges_connected_crossable`. Each cell has 3 vertices (passed once,
+    # passed twice horizontally and passed twice vertically), followed by a vertex for each
+    # vertical and horizontal edge between cells.
+    g = Graph(height * width * 3 + (height - 1) * width + height * (width - 1))
+    for y in range(height - 1):
+        for x in range(width):
+            eid = height * width * 3 + y * width + x
+            v0 = (y * width + x) * 3
+            v1 = ((y + 1) * width + x) * 3
+            g.add_edge(eid, v0)
+            g.add_edge(eid, v0 + 2)
+            g.add_edge(eid, v1)
+            g.add_edge(eid, v1 + 2)
+
+    for y in range(height):
+        for x in range(width - 1):
+            eid = height * width * 3 + (height - 1) * width + y * (width - 1) + x
+            v0 = (y * width + x) * 3
+            v1 = (y * width + x + 1) * 3
+            g.add_edge(eid, v0)
+            g.add_edge(eid, v0 + 1)
+            g.add_edge(eid, v1)
+            g.add_edge(eid, v1 + 1)
+    return g
+
+
+_TOPOLOGY_BUILDERS: Dict[str, Callable[[int, int], Graph]] = {
+    "grid": _build_grid_graph,
+    "grid_frame": _build_grid_frame_graph,
+    "crossable": _build_crossable_graph,
+}
+
+# the maximum number of topologies kept by `_topology`
+_TOPOLOGY_CACHE_SIZE = 64
+
+
+@functools.lru_cache(maxsize=_TOPOLOGY_CACHE_SIZE)
+def _topology(kind: str, height: int, width: int) -> Graph:
+    # Returns the frozen graph of the topology `kind` on a board of the given size. The graphs
+    # are cached since puzzle generators build many models on boards of the same size.
+    return _TOPOLOGY_BUILDERS[kind](height, width).freeze()
+
+
+def _grid_graph(height: int, width: int) -> Graph:
+    return _topology("grid", height, width)
+
+
 def _from_grid_frame(grid_frame: BoolGridFrame) -> tuple[Sequence[BoolExprLike], Graph]:
     height = grid_frame.height
     width = grid_frame.width
     edges = []
-    graph = Graph((height + 1) * (width + 1))
     for y in range(height + 1):
         for x in range(width + 1):
             if y != height:
                 edges.append(grid_frame[y * 2 + 1, x * 2])
-                graph.add_edge(y * (width + 1) + x, (y + 1) * (width + 1) + x)
             if x != width:
                 edges.append(grid_frame[y * 2, x * 2 + 1])
-                graph.add_edge(y * (width + 1) + x, y * (width + 1) + (x + 1))
-    return edges, graph
+    return edges, _topology("grid_frame", height, width)
 
 
 def _active_vertices_connected(
@@ -172,7 +447,30 @@ def _active_vertices_connected(
                 Op.GRAPH_ACTIVE_VERTICES_CONNECTED,
                 [graph.num_vertices, len(graph)]
                 + [is_active[i] for i in range(len(is_active))]  # type: ignore
-                + sum([[x, y] for x, y in graph.edges], []),  # type: ignore
+                + [solver.graph_edges(graph)],
+            )
+        )
+        return
+    if not acyclic and config.use_lazy_connectivity:
+        if len(is_active) != graph.num_vertices:
+            raise ValueError(
+                "is_active must have the same number of items as that of vertices in graph"
+            )
+        # `cspuz.refinement` evaluates the vertices on assignments, so they must be variables or
+        # constants
+        vertices: List[BoolExprLike] = []
+        for x in is_active:
+            if not isinstance(x, (bool, BoolVar)) and x.op != Op.BOOL_CONSTANT:
+                v = solver.bool_var()
+                solver.ensure(v == x)
+                x = v
+            vertices.append(x)
+        solver.ensure(
+            BoolExpr(
+                Op.LAZY_ACTIVE_VERTICES_CONNECTED,
+                [graph.num_vertices, len(graph)]
+                + vertices  # type: ignore
+                + [solver.graph_edges(graph)],
             )
         )
         return
@@ -183,9 +481,9 @@ def _active_vertices_connected(
     is_root = solver.bool_array(n)
 
     for i in range(n):
-        less_ranks = [((ranks[j] < ranks[i]) & is_active[j]) for j, _ in graph.incident_edges[i]]
+        less_ranks = [((ranks[j] < ranks[i]) & is_active[j]) for j in graph.neighbors(i)]
         if acyclic:
-            for j, _ in graph.incident_edges[i]:
+            for j in graph.neighbors(i):
                 if i < j:
                     solver.ensure(ranks[j] != ranks[i])
             solver.ensure(then(is_active[i], count_true(less_ranks + [is_root[i]]) == 1))
@@ -256,7 +554,7 @@ def active_vertices_connected(
         use_graph_primitive (Optional[bool], optional):
             Whether primitive graph operators are used to represent this constraint. If omitted,
             the default configuration is used. Such operators are available in `sugar`,
-            `sugar_extended`, `csugar` and `enigma_csp` backends, but depending on
+            `sugar_extended`, `csugar`, `enigma_csp` and `z3` backends, but depending on
             the configuration of the backend executable, they may not be supported.
 
     Raises:
@@ -420,7 +718,7 @@ def active_edges_acyclic(
 
     for i in range(n):
         less_ranks = []
-        for j, e in graph.incident_edges[i]:
+        for j, e in zip(graph.neighbors(i), graph.incident_edge_ids(i)):
             less_ranks.append((ranks[j] < ranks[i]) & is_active_edge[e])
             if i < j:
                 solver.ensure(ranks[i] != ranks[j])
@@ -465,7 +763,7 @@ def _division_connected(
 
     for i in range(n):
         less_ranks = []
-        for j, e in graph.incident_edges[i]:
+        for j, e in zip(graph.neighbors(i), graph.incident_edge_ids(i)):
             less_ranks.append(spanning_forest[e] & (rank[i] > rank[j]))
             if i < j:
                 solver.ensure(
@@ -605,11 +903,14 @@ def _division_connected_variable_groups(
 
     for i in range(n):
         solver.ensure(is_root[i].then(group_id[i] == i))
-        for j, e in graph.incident_edges[i]:
+        for j, e in zip(graph.neighbors(i), graph.incident_edge_ids(i)):
             solver.ensure(is_active_edge[e].then(rank[j] != rank[i]))
         solver.ensure(
             count_true(
-                [is_active_edge[e] & (rank[j] < rank[i]) for j, e in graph.incident_edges[i]]
+                [
+                    is_active_edge[e] & (rank[j] < rank[i])
+                    for j, e in zip(graph.neighbors(i), graph.incident_edge_ids(i))
+                ]
             )
             == is_root[i].cond(0, 1)
         )
@@ -625,7 +926,7 @@ def _division_connected_variable_groups(
                 sum(
                     [
                         (is_active_edge[e] & (rank[j] > rank[i])).cond(downstream_size[j], 0)
-                        for j, e in graph.incident_edges[i]
+                        for j, e in zip(graph.neighbors(i), graph.incident_edge_ids(i))
                     ]
                 )
                 + 1
@@ -781,7 +1082,7 @@ def _division_connected_variable_groups_with_borders(
                 Op.GRAPH_DIVISION,
                 [graph.num_vertices, len(graph)]
                 + [group_size[i] for i in range(len(group_size))]  # type: ignore
-                + sum([[x, y] for x, y in graph.edges], [])  # type: ignore
+                + [solver.graph_edges(graph)]
                 + [is_border[i] for i in range(len(is_border))],  # type: ignore
             )
         )
@@ -881,7 +1182,7 @@ def _active_edges_single_cycle(
 
     if use_graph_primitive:
         for i in range(n):
-            degree = count_true([is_active_edge[e] for j, e in graph.incident_edges[i]])
+            degree = count_true([is_active_edge[e] for e in graph.incident_edge_ids(i)])
             solver.ensure(degree == is_passed[i].cond(2, 0))
 
         line_graph = graph.line_graph()
@@ -893,14 +1194,14 @@ def _active_edges_single_cycle(
         is_root = solver.bool_array(n)
 
         for i in range(n):
-            degree = count_true([is_active_edge[e] for j, e in graph.incident_edges[i]])
+            degree = count_true([is_active_edge[e] for e in graph.incident_edge_ids(i)])
             solver.ensure(degree == is_passed[i].cond(2, 0))
             solver.ensure(
                 is_passed[i].then(
                     count_true(
                         [
                             is_active_edge[e] & (rank[j] >= rank[i])
-                            for j, e in graph.incident_edges[i]
+                            for j, e in zip(graph.neighbors(i), graph.incident_edge_ids(i))
                         ]
                     )
                     <= is_root[i].cond(2, 1)
@@ -1001,7 +1302,7 @@ def _active_edges_single_path(
 
     if use_graph_primitive:
         for i in range(n):
-            degree = count_true([is_active_edge[e] for j, e in graph.incident_edges[i]])
+            degree = count_true([is_active_edge[e] for e in graph.incident_edge_ids(i)])
             solver.ensure(is_passed[i].then((degree == 1) | (degree == 2)))
             solver.ensure((~is_passed[i]).then(degree == 0))
             is_endpoint.append(degree == 1)
@@ -1195,9 +1496,7 @@ def active_edges_connected_crossable(
     solver.ensure(is_passed_double_horizontal == is_cross)
     solver.ensure(is_passed_double_vertical == is_cross)
 
-    g = Graph(height * width * 3 + (height - 1) * width + height * (width - 1))
     gv = []
-
     for y in range(height):
         for x in range(width):
             gv.append(is_passed_single[y, x])
@@ -1211,26 +1510,7 @@ def active_edges_connected_crossable(
         for x in range(width - 1):
             gv.append(is_active_edge.horizontal[y, x])
 
-    for y in range(height - 1):
-        for x in range(width):
-            eid = height * width * 3 + y * width + x
-            v0 = (y * width + x) * 3
-            v1 = ((y + 1) * width + x) * 3
-            g.add_edge(eid, v0)
-            g.add_edge(eid, v0 + 2)
-            g.add_edge(eid, v1)
-            g.add_edge(eid, v1 + 2)
-
-    for y in range(height):
-        for x in range(width - 1):
-            eid = height * width * 3 + (height - 1) * width + y * (width - 1) + x
-            v0 = (y * width + x) * 3
-            v1 = (y * width + x + 1) * 3
-            g.add_edge(eid, v0)
-            g.add_edge(eid, v0 + 1)
-            g.add_edge(eid, v1)
-            g.add_edge(eid, v1 + 1)
-
+    g = _topology("crossable", height, width)
     active_vertices_connected(solver, gv, graph=g, use_graph_primitive=use_graph_primitive)
 
     return is_passed, is_cross
@@ -0,0 +1,345 @@
+"""Portfolio backend: racing several backends (or encodings) on the same model.
+
+The members of the portfolio are given by `config.portfolio`. Each member is a backend together
+with overrides of `config` for it, e.g. `cspuz_core:use_graph_primitive=False`. On each solve, the
+model is sent to one worker process per member and the first definitive answer is adopted; the
+workers still running are killed. Idle workers are kept alive and reused for later solves.
+
+The number of wins of each member is recorded and available from `win_counts`, so that members
+which never win can be pruned from the portfolio.
+"""
+
+import multiprocessing
+import multiprocessing.connection
+import subprocess
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union, cast
+
+from .backend.backend import Backend
+from .batch import _KILL_GRACE_PERIOD, _Worker
+from .configuration import Config, _strtobool, config
+from .expr import BoolExpr, BoolVar, Expr, IntVar, Op
+from .flat import FlatModel
+from .refinement import new_backend
+from .solver import Solver, _get_backend, _solve_irrefutably
+
+
+class PortfolioMember(object):
+    """A member of the portfolio backend.
+
+    Args:
+        backend (Union[str, type]): The backend (a name or a backend class) used by the member.
+        **config_overrides: Values of `config` attributes overridden for the member.
+    """
+
+    backend: Union[str, type]
+    config_overrides: Dict[str, Any]
+
+    def __init__(self, backend: Union[str, type], **config_overrides: Any) -> None:
+        if backend == "portfolio":
+            raise ValueError("portfolio cannot be a member of a portfolio")
+        for key in config_overrides:
+            if key not in Config.__annotations__:
+                raise ValueError(f"unknown config: {key}")
+        self.backend = backend
+        self.config_overrides = config_overrides
+
+    @property
+    def name(self) -> str:
+        if isinstance(self.backend, str):
+            backend_name = self.backend
+        else:
+            backend_name = self.backend.__name__
+        if len(self.config_overrides) == 0:
+            return backend_name
+        options = ",".join(f"{k}={v}" for k, v in sorted(self.config_overrides.items()))
+        return f"{backend_name}:{options}"
+
+    @staticmethod
+    def parse(spec: str) -> "PortfolioMember":
+        """Parse a member given as a string like `cspuz_core:use_graph_primitive=False`.
+
+        Multiple config overrides are separated by commas.
+        """
+        backend, _, options = spec.partition(":")
+        config_overrides = {}
+        if options != "":
+            for option in options.split(","):
+                key, sep, value = option.partition("=")
+                if sep == "":
+                    raise ValueError(f"invalid portfolio member: {spec}")
+                key = key.strip()
+                config_overrides[key] = _parse_config_value(key, value.strip())
+        return PortfolioMember(backend.strip(), **config_overrides)
+
+
+def _parse_config_value(key: str, value: str) -> Any:
+    ty = Config.__annotations__.get(key)
+    if ty is None:
+        raise ValueError(f"unknown config: {key}")
+    if value.lower() == "none" and ty in (Optional[str], Optional[int], Optional[float]):
+        return None
+    if ty is bool:
+        return _strtobool(value)
+    elif ty in (int, Optional[int]):
+        return int(value)
+    elif ty in (float, Optional[float]):
+        return float(value)
+    else:
+        return value
+
+
+def _get_members() -> List[PortfolioMember]:
+    members = [
+        m if isinstance(m, PortfolioMember) else PortfolioMember.parse(m) for m in config.portfolio
+    ]
+    if len(members) == 0:
+        raise ValueError("no portfolio member is given (see `config.portfolio`)")
+    return members
+
+
+def _lower_graph_primitives(
+    variables: List[Union[BoolVar, IntVar]], is_answer_key: List[bool], constraints: List[Any]
+) -> Tuple[List[Union[BoolVar, IntVar]], List[bool], List[Any]]:
+    # Replaces the native graph constraints disabled in `config` by their encodings without the
+    # primitives. New auxiliary variables are appended to `variables`.
+    lower_connected = not config.use_graph_primitive
+    lower_division = not config.use_graph_division_primitive
+    if not any(
+        isinstance(c, BoolExpr)
+        and (
+            (lower_connected and c.op == Op.GRAPH_ACTIVE_VERTICES_CONNECTED)
+            or (lower_division and c.op == Op.GRAPH_DIVISION)
+        )
+        for c in constraints
+    ):
+        return variables, is_answer_key, constraints
+
+    from . import graph
+
+    scratch = Solver(intern_exprs=False)
+    scratch.variables = list(variables)
+    scratch.is_answer_key = list(is_answer_key)
+    for c in constraints:
+        if isinstance(c, BoolExpr) and c.op in (
+            Op.GRAPH_ACTIVE_VERTICES_CONNECTED,
+            Op.GRAPH_DIVISION,
+        ):
+            n = cast(int, c.operands[0])
+            m = cast(int, c.operands[1])
+            edges = cast(Tuple[int, ...], cast(Expr, c.operands[2 + n]).operands)
+            g = graph.Graph(n)
+            for i in range(m):
+                g.add_edge(edges[2 * i], edges[2 * i + 1])
+            if lower_connected and c.op == Op.GRAPH_ACTIVE_VERTICES_CONNECTED:
+                is_active = c.operands[2 : 2 + n]
+                graph._active_vertices_connected(
+                    scratch, is_active, g, use_graph_primitive=False  # type: ignore
+                )
+                continue
+            if lower_division and c.op == Op.GRAPH_DIVISION:
+                group_size = c.operands[2 : 2 + n]
+                is_border = c.operands[3 + n :]
+                graph._division_connected_variable_groups_with_borders(
+                    scratch, g, group_size, is_border, use_graph_primitive=False  # type: ignore
+                )
+                continue
+        scratch.constraints.append(c)
+    return scratch.variables, scratch.is_answer_key, scratch.constraints
+
+
+def _needs_exprs(model: FlatModel) -> bool:
+    # Returns whether the constraints of `model` must be restored as `Expr`s rather than passed to
+    # `Backend.add_flat_model`: the native graph constraints disabled in `config` are lowered, and
+    # lazy constraints are enforced by `RefiningBackend`.
+    codes = {Op.LAZY_ACTIVE_VERTICES_CONNECTED.value}
+    if not config.use_graph_primitive:
+        codes.add(Op.GRAPH_ACTIVE_VERTICES_CONNECTED.value)
+    if not config.use_graph_division_primitive:
+        codes.add(Op.GRAPH_DIVISION.value)
+    return not codes.isdisjoint(model.codes)
+
+
+def _portfolio_worker_main(conn: Any, config_values: Dict[str, Any]) -> None:
+    for key, value in config_values.items():
+        setattr(config, key, value)
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        backend_type, model, is_answer_key, mode = task
+        try:
+            num_variables = model.num_variables
+            variables = model.make_variables()
+            if _needs_exprs(model):
+                constraints = model.constraints(variables)
+                variables, is_answer_key, constraints = _lower_graph_primitives(
+                    variables, is_answer_key, constraints
+                )
+                csp_solver = new_backend(backend_type, variables, constraints)
+            else:
+                csp_solver = backend_type(variables)
+                csp_solver.add_flat_model(model)
+            if mode == "find_answer":
+                is_sat = csp_solver.solve()
+            else:
+                is_sat = _solve_irrefutably(csp_solver, variables, is_answer_key)
+            sols = [v.sol for v in variables[:num_variables]]
+            conn.send((is_sat, sols, csp_solver.perf_stats(), None))
+        except Exception as e:
+            conn.send((None, None, None, repr(e)))
+
+
+class _WorkerPool(object):
+    # Idle workers for each portfolio member, together with the config they were started with.
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._idle: Dict[str, List[Tuple[Dict[str, Any], _Worker]]] = {}
+
+    def acquire(self, name: str, config_values: Dict[str, Any]) -> _Worker:
+        stale = []
+        worker = None
+        with self._lock:
+            idle = self._idle.get(name, [])
+            while len(idle) > 0:
+                worker_config, w = idle.pop()
+                if worker_config == config_values:
+                    worker = w
+                    break
+                stale.append(w)
+        for w in stale:
+            w.shutdown()
+        if worker is None:
+            worker = _Worker(
+                multiprocessing.get_context(), config_values, target=_portfolio_worker_main
+            )
+        return worker
+
+    def release(self, name: str, config_values: Dict[str, Any], worker: _Worker) -> None:
+        with self._lock:
+            self._idle.setdefault(name, []).append((config_values, worker))
+
+    def close(self) -> None:
+        with self._lock:
+            idle = self._idle
+            self._idle = {}
+        for workers in idle.values():
+            for _, w in workers:
+                w.shutdown()
+
+
+_pool = _WorkerPool()
+_win_counts: Dict[str, int] = {}
+_win_counts_lock = threading.Lock()
+
+
+def win_counts() -> Dict[str, int]:
+    """Return the number of wins of each portfolio member (by `PortfolioMember.name`)."""
+    with _win_counts_lock:
+        return dict(_win_counts)
+
+
+def reset_win_counts() -> None:
+    with _win_counts_lock:
+        _win_counts.clear()
+
+
+class PortfolioBackend(Backend):
+    def __init__(self, variables):
+        self.variables = variables
+        self.constraints = []
+        self._perf_stats = None
+
+    def add_constraint(self, constraint):
+        if isinstance(constraint, list):
+            self.constraints += constraint
+        else:
+            self.constraints.append(constraint)
+
+    def solve(self):
+        return self._race("find_answer", [False] * len(self.variables))
+
+    def solve_irrefutably(self, is_answer_key):
+        return self._race("solve", is_answer_key)
+
+    def perf_stats(self) -> Optional[dict]:
+        return self._perf_stats
+
+    def _race(self, mode, is_answer_key):
+        members = _get_members()
+        base_config = dict(vars(config))
+        timeout = config.solver_timeout
+        deadline = None
+        if timeout is not None:
+            deadline = time.monotonic() + timeout + _KILL_GRACE_PERIOD
+
+        # the model is sent to the workers in the flat representation, which is much cheaper to
+        # pickle than the expression graph
+        model = FlatModel(self.variables, self.constraints)
+        running = []
+        finished = []
+        errors = []
+        result = None
+        try:
+            for member in members:
+                config_values = dict(base_config, **member.config_overrides)
+                worker = _pool.acquire(member.name, config_values)
+                running.append((member, config_values, worker))
+                worker.conn.send((_get_backend(member.backend), model, is_answer_key, mode))
+
+            while result is None and len(running) > 0:
+                wait_timeout = None
+                if deadline is not None:
+                    wait_timeout = max(0.0, deadline - time.monotonic())
+                multiprocessing.connection.wait(
+                    [w.conn for _, _, w in running] + [w.process.sentinel for _, _, w in running],
+                    timeout=wait_timeout,
+                )
+
+                still_running = []
+                for member, config_values, worker in running:
+                    if worker.conn.poll():
+                        try:
+                            is_sat, sols, perf_stats, error = worker.conn.recv()
+                        except EOFError:
+                            error = "worker terminated unexpectedly"
+                        else:
+                            finished.append((member, config_values, worker))
+                            if error is None and result is None:
+                                result = (member, is_sat, sols, perf_stats)
+                            if error is not None:
+                                errors.append(f"{member.name}: {error}")
+                            continue
+                    elif worker.process.is_alive():
+                        still_running.append((member, config_values, worker))
+                        continue
+                    else:
+                        error = "worker terminated unexpectedly"
+                    worker.kill()
+                    errors.append(f"{member.name}: {error}")
+                running = still_running
+
+                if result is None and deadline is not None and time.monotonic() >= deadline:
+                    raise subprocess.TimeoutExpired("portfolio", timeout)  # type: ignore
+        finally:
+            # the losers are killed, as there is no way to interrupt solvers in progress
+            for _, _, worker in running:
+                worker.kill()
+            for member, config_values, worker in finished:
+                _pool.release(member.name, config_values, worker)
+
+        if result is None:
+            raise RuntimeError("all portfolio members failed: " + "; ".join(errors))
+
+        member, is_sat, sols, perf_stats = result
+        for v, sol in zip(self.variables, sols):
+            v.sol = sol
+        with _win_counts_lock:
+            _win_counts[member.name] = _win_counts.get(member.name, 0) + 1
+        self._perf_stats = dict(perf_stats or {}, portfolio_winner=member.name)
+        return is_sat
@@ -0,0 +1,204 @@
+"""Counterexample-guided refinement of connectivity constraints.
+
+For backends without native graph constraints, `graph.active_vertices_connected` and its variants
+encode connectivity by ranks of vertices, which needs an int variable with a domain of size `n`
+for each of the `n` vertices and blows up on large boards. If `config.use_lazy_connectivity` is
+enabled, they emit a `LAZY_ACTIVE_VERTICES_CONNECTED` constraint instead, which is not passed to
+backends. `RefiningBackend` enforces such constraints as follows:
+
+1. Solve the problem without them.
+2. Compute the connected components of the active vertices in the returned assignment. If there
+   is at most one component, the assignment is a solution.
+3. Otherwise, add a cut for each component `C`: "some vertex adjacent to `C` is active, some
+   vertex in `C` is inactive, or a vertex in another component (in the current assignment) is
+   inactive", and go back to 1.
+
+The cuts are implied by the connectivity, so they are kept for the later calls of `solve`. In
+particular, `solve_irrefutably` of backends is not used (the refuting loop of `Solver.solve` is
+used instead), so that every candidate assignment is checked. Puzzles whose walls are sparse
+typically need only a few rounds, with a model much smaller than the rank encoding.
+"""
+
+from typing import Any, List, Optional, Sequence, Tuple, Union, cast
+
+from .backend.backend import Backend
+from .expr import BoolExpr, BoolExprLike, BoolVar, Expr, IntVar, Op
+from .flat import FlatModel
+
+
+def is_lazy_constraint(constraint: Any) -> bool:
+    """Return whether `constraint` must be enforced by `RefiningBackend`."""
+    return isinstance(constraint, BoolExpr) and constraint.op == Op.LAZY_ACTIVE_VERTICES_CONNECTED
+
+
+def _value(x: BoolExprLike) -> bool:
+    if isinstance(x, BoolVar):
+        return x.sol is True
+    if isinstance(x, BoolExpr) and x.op == Op.BOOL_CONSTANT:
+        return cast(bool, x.operands[0])
+    if isinstance(x, bool):
+        return x
+    raise TypeError("vertices of lazy connectivity constraints must be BoolVar or constants")
+
+
+def _clause(positive: List[BoolExprLike], negative: List[BoolExprLike]) -> Optional[BoolExpr]:
+    # Returns the disjunction of `positive` and the negations of `negative`, or `None` if it is
+    # trivially satisfied. Constants are folded.
+    literals: List[BoolExprLike] = []
+    for x, sign in [(x, True) for x in positive] + [(x, False) for x in negative]:
+        if isinstance(x, BoolVar):
+            literals.append(x if sign else ~x)
+        elif _value(x) == sign:
+            return None
+    return BoolExpr(Op.OR, literals)
+
+
+class _Requirement(object):
+    # A `LAZY_ACTIVE_VERTICES_CONNECTED` constraint.
+    def __init__(self, constraint: BoolExpr) -> None:
+        from .graph import Graph
+
+        self.constraint = constraint
+        n = cast(int, constraint.operands[0])
+        self.is_active = cast(List[BoolExprLike], constraint.operands[2 : 2 + n])
+        edges = cast(Tuple[int, ...], cast(Expr, constraint.operands[2 + n]).operands)
+        self.graph = Graph(n)
+        self.graph.add_edges(zip(edges[0::2], edges[1::2]))
+
+    def cuts(self) -> List[BoolExpr]:
+        # Returns the cuts violated by the current assignment (empty if it is connected).
+        graph = self.graph
+        active = [_value(x) for x in self.is_active]
+        component = [-1] * graph.num_vertices
+        components: List[List[int]] = []
+        for s in range(graph.num_vertices):
+            if not active[s] or component[s] >= 0:
+                continue
+            component[s] = len(components)
+            members = [s]
+            i = 0
+            while i < len(members):
+                for w in graph.neighbors(members[i]):
+                    if active[w] and component[w] < 0:
+                        component[w] = len(components)
+                        members.append(w)
+                i += 1
+            components.append(members)
+        if len(components) <= 1:
+            return []
+
+        ret = []
+        for c, members in enumerate(components):
+            boundary = sorted(
+                {w for v in members for w in graph.neighbors(v) if component[w] != c}
+            )
+            # a vertex of another component, which must be inactive if `members` are isolated
+            other = components[(c + 1) % len(components)][0]
+            clause = _clause(
+                [self.is_active[w] for w in boundary],
+                [self.is_active[v] for v in members] + [self.is_active[other]],
+            )
+            if clause is not None:
+                ret.append(clause)
+        return ret
+
+
+class RefiningBackend(Backend):
+    """Backend enforcing lazy connectivity constraints on top of another backend.
+
+    Args:
+        backend (Backend): The backend to which the other constraints and the cuts are passed.
+
+    Attributes:
+        num_rounds (int): The number of times `backend` has been invoked.
+        num_cuts (int): The number of cuts added so far.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.variables = backend.variables
+        self.has_async_solve = backend.has_async_solve
+        self._requirements: List[_Requirement] = []
+        self.num_rounds = 0
+        self.num_cuts = 0
+
+    def add_constraint(self, constraint):
+        if not isinstance(constraint, list):
+            constraint = [constraint]
+        rest = []
+        for c in constraint:
+            if is_lazy_constraint(c):
+                self._requirements.append(_Requirement(c))
+            else:
+                rest.append(c)
+        if len(rest) > 0:
+            self.backend.add_constraint(rest)
+
+    def _cuts(self) -> List[BoolExpr]:
+        cuts = []
+        for requirement in self._requirements:
+            cuts += requirement.cuts()
+        self.num_rounds += 1
+        self.num_cuts += len(cuts)
+        return cuts
+
+    def solve(self):
+        while True:
+            if not self.backend.solve():
+                return False
+            cuts = self._cuts()
+            if len(cuts) == 0:
+                return True
+            self.backend.add_constraint(cuts)
+
+    async def solve_async(self):
+        while True:
+            if not await self.backend.solve_async():
+                return False
+            cuts = self._cuts()
+            if len(cuts) == 0:
+                return True
+            self.backend.add_constraint(cuts)
+
+    def solve_irrefutably(self, is_answer_key):
+        if len(self._requirements) > 0:
+            raise NotImplementedError
+        return self.backend.solve_irrefutably(is_answer_key)
+
+    async def solve_irrefutably_async(self, is_answer_key):
+        if len(self._requirements) > 0:
+            raise NotImplementedError
+        return await self.backend.solve_irrefutably_async(is_answer_key)
+
+    def serialize(self):
+        constraints = [r.constraint for r in self._requirements]
+        return type(self.backend), self.backend.serialize(), FlatModel(self.variables, constraints)
+
+    @classmethod
+    def deserialize(cls, variables, data):
+        backend_type, backend_data, model = data
+        ret = cls(backend_type.deserialize(variables, backend_data))
+        ret.add_constraint(model.constraints(variables))
+        return ret
+
+    def perf_stats(self) -> Optional[dict]:
+        stats = dict(self.backend.perf_stats() or {})
+        stats["refinement_rounds"] = self.num_rounds
+        stats["refinement_cuts"] = self.num_cuts
+        return stats
+
+
+def new_backend(
+    backend_type: type,
+    variables: Sequence[Union[BoolVar, IntVar]],
+    constraints: Sequence[BoolExprLike],
+) -> Backend:
+    """Create a backend of `backend_type` to which `constraints` are added.
+
+    The backend is wrapped by `RefiningBackend` if `constraints` contain lazy constraints.
+    """
+    csp_solver = backend_type(variables)
+    if any(is_lazy_constraint(c) for c in constraints):
+        csp_solver = RefiningBackend(csp_solver)
+    csp_solver.add_constraint(list(constraints))
+    return csp_solver
@@ -0,0 +1,589 @@
+"""Simplification of constraints before they are passed to backends.
+
+The simplification performs constant propagation through boolean and integer operators, removes
+constraints which are trivially satisfied, and detects constraints which are trivially violated.
+Comparisons are also decided when the ranges of the both sides do not overlap (e.g.
+`count_true(...) >= 0`).
+
+Linear integer expressions (built by `+`, `-` and multiplication by constants) are collapsed into
+the normal form `c_1 * x_1 + ... + c_n * x_n + k`, where duplicate terms are merged and opposite
+terms cancel out. For comparisons, the terms on the both sides are merged in the same way. The
+normal form is used only if it has fewer terms (or the same number of terms and fewer nodes) than
+the original expression, since smaller linear terms lead to smaller encodings in backends.
+
+Sharing of subexpressions is preserved: a node is rebuilt only if some of its operands are
+simplified, and each distinct node is processed only once.
+
+Chains of associative operators (`&`, `|` and `+`) are built as left-deep binary trees by the
+operators of expressions, which keeps building them linear-time. `flatten_chains` splices them
+into n-ary nodes before the constraints are passed to backends, so that backends do not have to
+deal with deep trees.
+"""
+
+import functools
+import math
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union, cast
+
+from .expr import _ASSOCIATIVE_OPS, BoolExpr, BoolExprLike, Expr, ExprLike, IntExpr, Op
+
+
+def _is_bool_const(x: ExprLike) -> bool:
+    return type(x) is bool
+
+
+def _is_int_const(x: ExprLike) -> bool:
+    return type(x) is int
+
+
+_COMPARATORS = {
+    Op.EQ: lambda x, y: x == y,
+    Op.NE: lambda x, y: x != y,
+    Op.LE: lambda x, y: x <= y,
+    Op.LT: lambda x, y: x < y,
+    Op.GE: lambda x, y: x >= y,
+    Op.GT: lambda x, y: x > y,
+}
+
+# `x (op) y` is equivalent to `-x (flipped op) -y`
+_FLIPPED_COMPARATORS = {
+    Op.EQ: Op.EQ,
+    Op.NE: Op.NE,
+    Op.LE: Op.GE,
+    Op.LT: Op.GT,
+    Op.GE: Op.LE,
+    Op.GT: Op.LT,
+}
+
+_OPAQUE_OPS = (
+    Op.GRAPH_ACTIVE_VERTICES_CONNECTED,
+    Op.GRAPH_DIVISION,
+    Op.LAZY_ACTIVE_VERTICES_CONNECTED,
+)
+
+_LINEAR_OPS = (Op.NEG, Op.ADD, Op.SUB, Op.MUL)
+
+
+class _LinearForm:
+    """Linear form `sum(c * x for x, c in terms.values()) + constant` of an int expression.
+
+    `terms` is keyed by the ids of the terms `x` and is ordered by their first occurrence.
+    `num_terms` and `num_nodes` are the number of occurrences of terms and the number of the other
+    nodes (operators and constants), respectively, in the expression which the form is computed
+    from. They are used to decide whether the normal form is smaller than the expression.
+    """
+
+    __slots__ = ("terms", "constant", "num_terms", "num_nodes")
+
+    terms: Dict[int, Tuple[ExprLike, int]]
+    constant: int
+    num_terms: int
+    num_nodes: int
+
+    def __init__(
+        self,
+        terms: Dict[int, Tuple[ExprLike, int]],
+        constant: int,
+        num_terms: int,
+        num_nodes: int,
+    ) -> None:
+        self.terms = terms
+        self.constant = constant
+        self.num_terms = num_terms
+        self.num_nodes = num_nodes
+
+
+def _combine_linear_forms(forms: List[Tuple[_LinearForm, int]]) -> _LinearForm:
+    # Returns the sum of `coef * form` for each `(form, coef)` in `forms`. The statistics of the
+    # result are just the sums of those of `forms`.
+    terms: Dict[int, Tuple[ExprLike, int]] = {}
+    constant = 0
+    num_terms = 0
+    num_nodes = 0
+    for form, coef in forms:
+        for key, (x, c) in form.terms.items():
+            if key in terms:
+                terms[key] = (x, terms[key][1] + c * coef)
+            else:
+                terms[key] = (x, c * coef)
+        constant += form.constant * coef
+        num_terms += form.num_terms
+        num_nodes += form.num_nodes
+    return _LinearForm(terms, constant, num_terms, num_nodes)
+
+
+def _build_linear_expr(
+    terms: Iterable[Tuple[ExprLike, int]], constant: int
+) -> Tuple[ExprLike, int, int]:
+    # Builds the expression `sum(c * x for x, c in terms) + constant`, omitting zero coefficients.
+    # Returns the expression together with its number of terms and number of the other nodes.
+    parts: List[ExprLike] = []
+    num_nodes = 0
+    for x, c in terms:
+        if c == 0:
+            continue
+        if c == 1:
+            parts.append(x)
+        else:
+            parts.append(IntExpr(Op.NEG, [x]) if c == -1 else IntExpr(Op.MUL, [x, c]))
+            num_nodes += 1
+    num_terms = len(parts)
+    if constant != 0 or num_terms == 0:
+        parts.append(constant)
+        num_nodes += 1
+    if len(parts) == 1:
+        return parts[0], num_terms, num_nodes
+    return IntExpr(Op.ADD, parts), num_terms, num_nodes + 1
+
+
+def _decide_comparison(
+    op: Op, range_left: Tuple[int, int], range_right: Tuple[int, int]
+) -> Optional[bool]:
+    # Decide the comparison `left (op) right` only from the ranges of the both sides.
+    lo0, hi0 = range_left
+    lo1, hi1 = range_right
+    if op == Op.EQ or op == Op.NE:
+        if hi0 < lo1 or hi1 < lo0:
+            return op == Op.NE
+        if lo0 == hi0 == lo1 == hi1:
+            return op == Op.EQ
+    elif op == Op.LT or op == Op.GE:
+        if hi0 < lo1:
+            return op == Op.LT
+        if lo0 >= hi1:
+            return op == Op.GE
+    elif op == Op.LE or op == Op.GT:
+        if hi0 <= lo1:
+            return op == Op.LE
+        if lo0 > hi1:
+            return op == Op.GT
+    return None
+
+
+class Simplifier:
+    """Simplifier of expressions.
+
+    A `Simplifier` object memoizes the simplified form and the range of each node, so that
+    subexpressions shared among constraints are processed only once. The memo keeps references
+    to the original nodes and therefore the object should not outlive a single simplification
+    of a model.
+    """
+
+    _memo: Dict[int, Tuple[Expr, ExprLike]]
+    _bounds: Dict[int, Tuple[Expr, Tuple[int, int]]]
+    _linear_forms: Dict[int, Tuple[Expr, _LinearForm]]
+
+    def __init__(self) -> None:
+        self._memo = {}
+        self._bounds = {}
+        self._linear_forms = {}
+
+    def bounds(self, e: ExprLike) -> Tuple[int, int]:
+        """Return the range `(lo, hi)` which the value of the int expression `e` lies in."""
+        if _is_int_const(e):
+            return e, e  # type: ignore
+        if not isinstance(e, Expr):
+            raise TypeError("int expression is expected")
+        if e.is_variable():
+            return e.lo, e.hi  # type: ignore
+        cached = self._bounds.get(id(e))
+        if cached is not None:
+            return cached[1]
+
+        if e.op == Op.INT_CONSTANT:
+            ret = (e.operands[0], e.operands[0])
+        elif e.op == Op.NEG:
+            lo, hi = self.bounds(e.operands[0])
+            ret = (-hi, -lo)
+        elif e.op == Op.ADD:
+            ret = (0, 0)
+            for x in e.operands:
+                lo, hi = self.bounds(x)
+                ret = (ret[0] + lo, ret[1] + hi)
+        elif e.op == Op.SUB:
+            lo0, hi0 = self.bounds(e.operands[0])
+            lo1, hi1 = self.bounds(e.operands[1])
+            ret = (lo0 - hi1, hi0 - lo1)
+        elif e.op == Op.MUL:
+            lo0, hi0 = self.bounds(e.operands[0])
+            lo1, hi1 = self.bounds(e.operands[1])
+            products = (lo0 * lo1, lo0 * hi1, hi0 * lo1, hi0 * hi1)
+            ret = (min(products), max(products))
+        elif e.op == Op.IF:
+            lo0, hi0 = self.bounds(e.operands[1])
+            lo1, hi1 = self.bounds(e.operands[2])
+            ret = (min(lo0, lo1), max(hi0, hi1))
+        elif e.op == Op.COUNT_TRUE:
+            lo = sum(1 for x in e.operands if x is True)
+            hi = len(e.operands) - sum(1 for x in e.operands if x is False)
+            ret = (lo, hi)
+        else:
+            raise ValueError(f"operator {e.op} does not return an int value")
+        self._bounds[id(e)] = (e, ret)  # type: ignore
+        return ret  # type: ignore
+
+    def simplify(self, expr: ExprLike) -> ExprLike:
+        """Return an expression equivalent to `expr` after simplification.
+
+        The result may be a Python `bool` or `int` constant if `expr` turns out to be constant.
+        """
+        if not isinstance(expr, Expr) or expr.is_variable():
+            return expr
+        cached = self._memo.get(id(expr))
+        if cached is not None:
+            return cached[1]
+
+        # post-order traversal with an explicit stack to support deep expressions
+        stack: List[Tuple[Expr, bool]] = [(expr, False)]
+        while len(stack) > 0:
+            e, visited = stack.pop()
+            if id(e) in self._memo:
+                continue
+            if e.op in _OPAQUE_OPS:
+                self._memo[id(e)] = (e, e)
+                continue
+            if not visited:
+                stack.append((e, True))
+                for x in e.operands:
+                    if isinstance(x, Expr) and not x.is_variable() and id(x) not in self._memo:
+                        stack.append((x, False))
+                continue
+
+            operands = [
+                self._memo[id(x)][1] if isinstance(x, Expr) and not x.is_variable() else x
+                for x in e.operands
+            ]
+            res = self._simplify_node(e, operands)
+            if res is None:
+                if all(x is y for x, y in zip(operands, e.operands)):
+                    res = e
+                elif isinstance(e, BoolExpr):
+                    res = BoolExpr(e.op, operands)
+                elif isinstance(e, IntExpr):
+                    res = IntExpr(e.op, operands)
+                else:
+                    res = Expr(e.op, operands)
+            self._memo[id(e)] = (e, res)
+
+        return self._memo[id(expr)][1]
+
+    def _simplify_node(self, e: Expr, operands: List[ExprLike]) -> Optional[ExprLike]:
+        # Returns the simplified form of `e` whose operands are already simplified to `operands`,
+        # or `None` if no simplification rule is applicable to `e` itself.
+        op = e.op
+        if op == Op.BOOL_CONSTANT:
+            return bool(operands[0])
+        elif op == Op.INT_CONSTANT:
+            return int(operands[0])  # type: ignore
+        elif op == Op.NOT:
+            x = operands[0]
+            if _is_bool_const(x):
+                return not x
+            if isinstance(x, Expr) and x.op == Op.NOT:
+                return x.operands[0]
+            return None
+        elif op in (Op.AND, Op.OR):
+            absorbing = op == Op.OR
+            rest = []
+            for x in operands:
+                if _is_bool_const(x):
+                    if x == absorbing:
+                        return absorbing
+                else:
+                    rest.append(x)
+            if len(rest) == 0:
+                return not absorbing
+            if len(rest) == 1:
+                return rest[0]
+            if len(rest) != len(operands):
+                return BoolExpr(op, rest)
+            return None
+        elif op == Op.IMP:
+            x, y = operands
+            if _is_bool_const(x):
+                return y if x else True
+            if _is_bool_const(y):
+                return True if y else BoolExpr(Op.NOT, [x])
+            return None
+        elif op in (Op.IFF, Op.XOR):
+            x, y = operands
+            if _is_bool_const(x) and _is_bool_const(y):
+                return (x == y) if op == Op.IFF else (x != y)
+            if _is_bool_const(y):
+                x, y = y, x
+            if _is_bool_const(x):
+                if (op == Op.IFF) == x:
+                    return y
+                else:
+                    return BoolExpr(Op.NOT, [y])
+            return None
+        elif op == Op.IF:
+            c, t, f = operands
+            if _is_bool_const(c):
+                return t if c else f
+            if t is f or (_is_int_const(t) and _is_int_const(f) and t == f):
+                return t
+            return None
+        elif op in _LINEAR_OPS:
+            return self._simplify_linear(e, operands)
+        elif op == Op.COUNT_TRUE:
+            rest = [x for x in operands if not _is_bool_const(x)]
+            if len(rest) == len(operands):
+                return None
+            constant = sum(1 for x in operands if x is True)
+            if len(rest) == 0:
+                return constant
+            if constant == 0:
+                return IntExpr(Op.COUNT_TRUE, rest)
+            res = IntExpr(Op.ADD, [IntExpr(Op.COUNT_TRUE, rest), constant])
+            return self._simplify_linear(res, list(res.operands))
+        elif op in _COMPARATORS:
+            x, y = operands
+            if _is_int_const(x) and _is_int_const(y):
+                return _COMPARATORS[op](x, y)
+            normalized = self._normalize_comparison(op, x, y)
+            if isinstance(normalized, bool):
+                return normalized
+            if normalized is not None:
+                op, x, y = normalized
+            decided = _decide_comparison(op, self.bounds(x), self.bounds(y))
+            if decided is None and normalized is not None:
+                return BoolExpr(op, [x, y])
+            return decided
+        elif op == Op.ALLDIFF:
+            if len(operands) <= 1:
+                return True
+            if all(map(_is_int_const, operands)):
+                return len(set(operands)) == len(operands)
+            return None
+        return None
+
+    def _linear_form(self, x: ExprLike) -> _LinearForm:
+        # Returns the linear form of a simplified int expression `x`.
+        if _is_int_const(x):
+            return _LinearForm({}, x, 0, 1)  # type: ignore
+        if isinstance(x, Expr) and not x.is_variable():
+            cached = self._linear_forms.get(id(x))
+            if cached is not None:
+                return cached[1]
+        return _LinearForm({id(x): (x, 1)}, 0, 1, 0)
+
+    def _simplify_linear(self, e: Expr, operands: List[ExprLike]) -> Optional[ExprLike]:
+        op = e.op
+        forms: List[Tuple[_LinearForm, int]]
+        if op == Op.NEG:
+            forms = [(self._linear_form(operands[0]), -1)]
+        elif op == Op.ADD:
+            forms = [(self._linear_form(x), 1) for x in operands]
+        elif op == Op.SUB:
+            forms = [(self._linear_form(operands[0]), 1), (self._linear_form(operands[1]), -1)]
+        else:
+            x, y = operands
+            if _is_int_const(x):
+                x, y = y, x
+            if not _is_int_const(y):
+                return None
+            forms = [(self._linear_form(x), y)]  # type: ignore
+        form = _combine_linear_forms(forms)
+        # the node itself (and the constant factor of `MUL`)
+        form.num_nodes += 2 if op == Op.MUL else 1
+
+        res, num_terms, num_nodes = _build_linear_expr(form.terms.values(), form.constant)
+        if _is_int_const(res):
+            return res
+        if (num_terms, num_nodes) < (form.num_terms, form.num_nodes):
+            form.num_terms = num_terms
+            form.num_nodes = num_nodes
+        elif all(x is y for x, y in zip(operands, e.operands)):
+            res = e
+        else:
+            res = IntExpr(op, operands)
+        if isinstance(res, Expr) and not res.is_variable():
+            self._linear_forms[id(res)] = (res, form)
+        return res
+
+    def _normalize_comparison(
+        self, op: Op, x: ExprLike, y: ExprLike
+    ) -> Union[None, bool, Tuple[Op, ExprLike, ExprLike]]:
+        # Rewrites the comparison `x (op) y` into `left (op') right` so that each term appears
+        # only on one side with a positive coefficient, the constant appears only on the right
+        # side and the coefficients are coprime. Returns the triple `(op', left, right)`, or a
+        # bool if the comparison turns out to be constant, or `None` if the rewriting does not
+        # make the comparison smaller.
+        form_x = self._linear_form(x)
+        form_y = self._linear_form(y)
+        form = _combine_linear_forms([(form_x, 1), (form_y, -1)])
+        # sum(c * t for t, c in terms) (op) k
+        terms = [(t, c) for t, c in form.terms.values() if c != 0]
+        k = -form.constant
+        if len(terms) == 0:
+            return _COMPARATORS[op](0, k)
+        if all(c < 0 for _, c in terms):
+            terms = [(t, -c) for t, c in terms]
+            k = -k
+            op = _FLIPPED_COMPARATORS[op]
+
+        g = functools.reduce(math.gcd, [abs(c) for _, c in terms])
+        if g > 1:
+            terms = [(t, c // g) for t, c in terms]
+            if op == Op.EQ or op == Op.NE:
+                if k % g != 0:
+                    return op == Op.NE
+                k //= g
+            elif op == Op.LE or op == Op.LT:
+                if op == Op.LT:
+                    op, k = Op.LE, k - 1
+                k = k // g
+            else:
+                if op == Op.GT:
+                    op, k = Op.GE, k + 1
+                k = -(-k // g)
+
+        positive = [(t, c) for t, c in terms if c > 0]
+        negative = [(t, -c) for t, c in terms if c < 0]
+        left, num_terms_left, num_nodes_left = _build_linear_expr(positive, 0)
+        right, num_terms_right, num_nodes_right = _build_linear_expr(negative, k)
+        if (num_terms_left + num_terms_right, num_nodes_left + num_nodes_right) < (
+            form.num_terms,
+            form.num_nodes,
+        ):
+            return op, left, right
+        return None
+
+
+def _is_compound(x: ExprLike) -> bool:
+    return isinstance(x, Expr) and not x.is_variable()
+
+
+def _rebuild(e: Expr, operands: List[ExprLike]) -> Expr:
+    if isinstance(e, BoolExpr):
+        return BoolExpr(e.op, operands)
+    elif isinstance(e, IntExpr):
+        return IntExpr(e.op, operands)
+    else:
+        return Expr(e.op, operands)
+
+
+def flatten_chains(exprs: Sequence[ExprLike]) -> List[ExprLike]:
+    """Splice chains of associative operators in `exprs` into n-ary nodes.
+
+    An operand of an `AND`, `OR` or `ADD` node which is a node of the same operator is replaced by
+    its operands, if the operand is referenced only once in `exprs` (counting references from the
+    nodes and from `exprs` itself). Nodes referenced more than once are kept as they are, so that
+    sharing of subexpressions is preserved. This runs in linear time in the size of `exprs`.
+
+    Args:
+        exprs (Sequence[ExprLike]): Expressions to be flattened.
+
+    Returns:
+        List[ExprLike]: The flattened expressions, in the same order as `exprs`. Nodes which
+        contain no chains to be spliced are returned as they are.
+    """
+    # the number of references to each compound node
+    num_refs: Dict[int, int] = {}
+    stack = [e for e in exprs if _is_compound(e)]
+    for e in stack:
+        num_refs[id(e)] = num_refs.get(id(e), 0) + 1
+    expanded = set()
+    while len(stack) > 0:
+        e = stack.pop()
+        if id(e) in expanded:
+            continue
+        expanded.add(id(e))
+        for x in cast(Expr, e).operands:
+            if _is_compound(x):
+                if id(x) in num_refs:
+                    num_refs[id(x)] += 1
+                else:
+                    num_refs[id(x)] = 1
+                    stack.append(x)
+
+    def spliced_operands(e: Expr) -> List[ExprLike]:
+        if e.op not in _ASSOCIATIVE_OPS:
+            return list(e.operands)
+        ret: List[ExprLike] = []
+        pending = list(reversed(e.operands))
+        while len(pending) > 0:
+            x = pending.pop()
+            if isinstance(x, Expr) and x.op == e.op and num_refs[id(x)] == 1:
+                pending.extend(reversed(x.operands))
+            else:
+                ret.append(x)
+        return ret
+
+    # post-order traversal over the nodes which are not spliced into their parents
+    memo: Dict[int, ExprLike] = {}
+    operands_of: Dict[int, List[ExprLike]] = {}
+    post_stack: List[Expr] = [cast(Expr, e) for e in exprs if _is_compound(e)]
+    while len(post_stack) > 0:
+        e = post_stack[-1]
+        if id(e) in memo:
+            post_stack.pop()
+            continue
+        operands = operands_of.get(id(e))
+        if operands is None:
+            operands = spliced_operands(e)
+            operands_of[id(e)] = operands
+            pending = [x for x in operands if _is_compound(x) and id(x) not in memo]
+            if len(pending) > 0:
+                post_stack += cast(List[Expr], pending)
+                continue
+        post_stack.pop()
+        new_operands = [memo[id(x)] if _is_compound(x) else x for x in operands]
+        del operands_of[id(e)]
+        if len(new_operands) == len(e.operands) and all(
+            x is y for x, y in zip(new_operands, e.operands)
+        ):
+            memo[id(e)] = e
+        else:
+            memo[id(e)] = _rebuild(e, new_operands)
+    return [memo[id(e)] if _is_compound(e) else e for e in exprs]
+
+
+def _count_nodes(exprs: Iterable[ExprLike]) -> int:
+    visited = set()
+    stack = [e for e in exprs if isinstance(e, Expr) and not e.is_variable()]
+    while len(stack) > 0:
+        e = stack.pop()
+        if id(e) in visited:
+            continue
+        visited.add(id(e))
+        if e.op in _OPAQUE_OPS:
+            continue
+        for x in e.operands:
+            if isinstance(x, Expr) and not x.is_variable() and id(x) not in visited:
+                stack.append(x)
+    return len(visited)
+
+
+def simplify_constraints(
+    constraints: Iterable[BoolExprLike],
+) -> Tuple[Optional[List[BoolExprLike]], int]:
+    """Simplify a sequence of constraints.
+
+    Args:
+        constraints (Iterable[BoolExprLike]): Constraints to be simplified.
+
+    Returns:
+        Tuple[Optional[List[BoolExprLike]], int]:
+            The list of simplified constraints from which trivially satisfied constraints are
+            removed, and the number of expression nodes removed by the simplification.
+            If some constraint is found to be trivially violated, `None` is returned instead of
+            the list.
+    """
+    constraints = list(constraints)
+    simplifier = Simplifier()
+    ret: List[BoolExprLike] = []
+    trivially_false = False
+    for c in constraints:
+        s = simplifier.simplify(c)
+        if s is True:
+            continue
+        if s is False:
+            trivially_false = True
+            continue
+        ret.append(s)  # type: ignore
+
+    num_removed = _count_nodes(constraints) - _count_nodes(ret)
+    if trivially_false:
+        return None, num_removed
+    return ret, num_removed
@@ -1,12 +1,34 @@
+import asyncio
 import functools
 import warnings
-from typing import Any, List, Optional, Tuple, Union, cast, overload
+import weakref
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterable,
+    List,
+    MutableMapping,
+    Optional,
+    Tuple,
+    Union,
+    cast,
+    overload,
+)
 
 from . import backend
+from .cache import cache_key, get_solve_cache
+from .canonical import canonicalize
 from .array import BoolArray1D, BoolArray2D, IntArray1D, IntArray2D
 from .configuration import config
-from .expr import BoolExpr, BoolExprLike, BoolVar, IntVar, Op
+from .expr import BoolExpr, BoolExprLike, BoolVar, Expr, ExprTable, IntVar, Op
+from .flat import FlatModel
+from .refinement import new_backend
 from .constraints import flatten_iterator
+from .simplify import flatten_chains, simplify_constraints
+
+if TYPE_CHECKING:
+    from .graph import Graph
 
 
 def _get_backend_by_name(backend_name: str) -> type:
@@ -14,6 +36,8 @@ def _get_backend_by_name(backend_name: str) -> type:
         return backend.sugar_like.SugarBackend
     elif backend_name == "sugar_extended":
         return backend.sugar_like.SugarExtendedBackend
+    elif backend_name == "sugar_server":
+        return backend.sugar_like.SugarServerBackend
     elif backend_name == "z3":
         return backend.z3.Z3Backend
     elif backend_name == "csugar":
@@ -22,6 +46,10 @@ def _get_backend_by_name(backend_name: str) -> type:
         return backend.sugar_like.EnigmaCSPBackend
     elif backend_name == "cspuz_core":
         return backend.sugar_like.CspuzCoreBackend
+    elif backend_name == "portfolio":
+        from .portfolio import PortfolioBackend
+
+        return PortfolioBackend
     else:
         raise ValueError("invalid backend {}".format(backend_name))
 
@@ -40,17 +68,131 @@ def _get_backend(backend: Union[None, str, type]) -> type:
         return backend
 
 
+def _refuting_constraint(
+    variables: List[Union[BoolVar, IntVar]],
+    is_answer_key: List[bool],
+    answer: List[Union[None, bool, int]],
+) -> BoolExpr:
+    difference_cond = []
+    for i in range(len(variables)):
+        a = answer[i]
+        if is_answer_key[i] and a is not None:
+            difference_cond.append(variables[i] != a)
+    return BoolExpr(Op.OR, difference_cond)
+
+
+def _solve_irrefutably(
+    csp_solver: backend.backend.Backend,
+    variables: List[Union[BoolVar, IntVar]],
+    is_answer_key: List[bool],
+) -> bool:
+    # Runs `solve_irrefutably` of `csp_solver`. If the backend does not support it, irrefutable
+    # assignments are computed by repeatedly adding a constraint refuting the current candidates.
+    try:
+        return csp_solver.solve_irrefutably(is_answer_key)
+    except NotImplementedError:
+        pass
+
+    if not csp_solver.solve():
+        # inconsistent problem
+        return False
+
+    n_var = len(variables)
+    answer: List[Union[None, bool, int]] = [None] * n_var
+    for i in range(n_var):
+        if is_answer_key[i]:
+            answer[i] = variables[i].sol
+
+    while True:
+        csp_solver.add_constraint(_refuting_constraint(variables, is_answer_key, answer))
+        if not csp_solver.solve():
+            break
+
+        for i in range(n_var):
+            if is_answer_key[i] and answer[i] is not None and answer[i] != variables[i].sol:
+                answer[i] = None
+
+    for i in range(n_var):
+        if is_answer_key[i]:
+            variables[i].sol = answer[i]
+    return True
+
+
+async def _solve_irrefutably_async(
+    csp_solver: backend.backend.Backend,
+    variables: List[Union[BoolVar, IntVar]],
+    is_answer_key: List[bool],
+) -> bool:
+    # Coroutine version of `_solve_irrefutably`.
+    try:
+        return await csp_solver.solve_irrefutably_async(is_answer_key)
+    except NotImplementedError:
+        pass
+
+    if not await csp_solver.solve_async():
+        return False
+
+    n_var = len(variables)
+    answer: List[Union[None, bool, int]] = [None] * n_var
+    for i in range(n_var):
+        if is_answer_key[i]:
+            answer[i] = variables[i].sol
+
+    while True:
+        csp_solver.add_constraint(_refuting_constraint(variables, is_answer_key, answer))
+        if not await csp_solver.solve_async():
+            break
+
+        for i in range(n_var):
+            if is_answer_key[i] and answer[i] is not None and answer[i] != variables[i].sol:
+                answer[i] = None
+
+    for i in range(n_var):
+        if is_answer_key[i]:
+            variables[i].sol = answer[i]
+    return True
+
+
+_async_semaphores: MutableMapping[asyncio.AbstractEventLoop, Tuple[int, asyncio.Semaphore]] = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _get_async_semaphore() -> asyncio.Semaphore:
+    # Returns the semaphore bounding the number of concurrent `*_async` solves in the running
+    # event loop. A semaphore is created for each event loop, and it is recreated if
+    # `config.max_concurrent_solves` is changed.
+    loop = asyncio.get_running_loop()
+    limit = config.max_concurrent_solves
+    entry = _async_semaphores.get(loop)
+    if entry is None or entry[0] != limit:
+        entry = (limit, asyncio.Semaphore(limit))
+        _async_semaphores[loop] = entry
+    return entry[1]
+
+
 class Solver(object):
     variables: List[Union[BoolVar, IntVar]]
     is_answer_key: List[bool]
     constraints: List[BoolExprLike]
     _perf_stats: Optional[dict]
+    _simplify_stats: Optional[dict]
+    _expr_table: Optional[ExprTable]
+    _cache_stats: Dict[str, int]
+    # keyed by frozen graphs or by tuples of edges
+    _graph_edges: Dict[Any, Expr]
 
-    def __init__(self) -> None:
+    def __init__(self, intern_exprs: Optional[bool] = None) -> None:
         self.variables = []
         self.is_answer_key = []
         self.constraints = []
         self._perf_stats = None
+        self._simplify_stats = None
+        if intern_exprs is None:
+            intern_exprs = config.use_expr_interning
+        self._expr_table = ExprTable() if intern_exprs else None
+        self._cache_stats = {"hits": 0, "misses": 0}
+        self._graph_edges = {}
 
     def bool_var(self) -> BoolVar:
         v = BoolVar(len(self.variables))
@@ -108,10 +250,43 @@ class Solver(object):
     def ensure(self, *constraint: Any) -> None:
         for x in flatten_iterator(*constraint):
             if isinstance(x, (BoolExpr, bool)):
+                if self._expr_table is not None:
+                    x = self._expr_table.intern(x)
                 self.constraints.append(x)
             else:
                 raise TypeError("each element in 'constraint' must be BoolExpr-like")
 
+    def graph_edges(self, graph: Union["Graph", Iterable[Tuple[int, int]]]) -> Expr:
+        """Declare the topology of a graph used by native graph constraints.
+
+        The result is a `GRAPH_EDGES` node listing the endpoints of the edges of `graph`, which
+        is referred to by `GRAPH_ACTIVE_VERTICES_CONNECTED` and `GRAPH_DIVISION` constraints. The
+        same node is returned for the same frozen graph, which is looked up by identity without
+        touching its edges, and for the same list of edges otherwise. Thus constraints on the
+        same graph share the node, and backends convert the edge list only once. Note that the
+        text format of Sugar-like backends cannot declare a graph once and refer to it, so the
+        converted edge list is still written in each graph constraint there. The graph
+        constraints in `cspuz.graph` call this automatically.
+
+        Args:
+            graph (Union[Graph, Iterable[Tuple[int, int]]]): The graph, or its edges.
+
+        Returns:
+            Expr: The node representing the edges.
+        """
+        from .graph import Graph
+
+        key: Any
+        if isinstance(graph, Graph) and graph.is_frozen:
+            key = graph
+        else:
+            key = tuple(graph)
+        ret = self._graph_edges.get(key)
+        if ret is None:
+            ret = Expr(Op.GRAPH_EDGES, [v for edge in graph for v in edge])
+            self._graph_edges[key] = ret
+        return ret
+
     def add_answer_key(self, *variable: Any) -> None:
         for x in flatten_iterator(*variable):
             if isinstance(x, (BoolVar, IntVar)):
@@ -121,60 +296,167 @@ class Solver(object):
             else:
                 raise TypeError("each element in 'variable' must be BoolVar or IntVar")
 
+    def flat_model(self) -> FlatModel:
+        """Return the model compiled into the flat representation (see `cspuz.flat`).
+
+        The result is independent of this solver: later changes to the model are not reflected,
+        and `FlatModel.to_solver` restores the model with new variables.
+        """
+        return FlatModel(self.variables, self.constraints, self.is_answer_key)
+
+    def _constraints_for_backend(self) -> Optional[List[BoolExprLike]]:
+        # Returns the constraints to be passed to backends, or `None` if the problem is found to be
+        # inconsistent without invoking backends.
+        flattened = cast(List[BoolExprLike], flatten_chains(self.constraints))
+        if not config.use_simplification:
+            self._simplify_stats = None
+            return flattened
+
+        constraints, num_removed = simplify_constraints(flattened)
+        self._simplify_stats = {
+            "removed_nodes": num_removed,
+            "trivially_false": constraints is None,
+        }
+        return constraints
+
+    def _set_inconsistent(self) -> bool:
+        for v in self.variables:
+            v.sol = None
+        self._perf_stats = None
+        return False
+
+    def _lookup_cache(
+        self, constraints: List[BoolExprLike], mode: str
+    ) -> Tuple[Optional[Tuple[str, List[int]]], Optional[bool]]:
+        # Looks up the result in the solve cache. Returns the cache key with the permutation of
+        # variables into the canonical order (`None` if the cache is disabled), and the cached
+        # result (`None` on a miss). On a hit, the cached solution is written into the variables.
+        cache = get_solve_cache()
+        if cache is None:
+            return None, None
+        digest, perm = canonicalize(
+            self.variables, constraints, self.is_answer_key if mode == "solve" else None
+        )
+        key = cache_key(digest, mode)
+        entry = cache.get(key)
+        if entry is None:
+            self._cache_stats["misses"] += 1
+            return (key, perm), None
+        self._cache_stats["hits"] += 1
+        is_sat, sols = entry
+        for i, sol in zip(perm, sols):
+            self.variables[i].sol = sol
+        self._perf_stats = None
+        return (key, perm), is_sat
+
+    def _store_cache(self, key: Optional[Tuple[str, List[int]]], is_sat: bool) -> None:
+        if key is None:
+            return
+        cache = get_solve_cache()
+        if cache is not None:
+            cache_key, perm = key
+            cache.put(cache_key, (is_sat, [self.variables[i].sol for i in perm]))
+
     def find_answer(self, backend: Union[None, str, type] = None) -> bool:
+        constraints = self._constraints_for_backend()
+        if constraints is None:
+            return self._set_inconsistent()
+        key, cached = self._lookup_cache(constraints, "find_answer")
+        if cached is not None:
+            return cached
         backend_type = _get_backend(backend)
-        csp_solver = backend_type(self.variables)  # type: ignore
-        csp_solver.add_constraint(self.constraints)
+        csp_solver = new_backend(backend_type, self.variables, constraints)
         res = csp_solver.solve()
         self._perf_stats = csp_solver.perf_stats()
+        self._store_cache(key, res)
         return res
 
     def solve(self, backend: Union[None, str, type] = None) -> bool:
         if not any(self.is_answer_key):
             warnings.warn("no answer key is given")
+        constraints = self._constraints_for_backend()
+        if constraints is None:
+            return self._set_inconsistent()
+        key, cached = self._lookup_cache(constraints, "solve")
+        if cached is not None:
+            return cached
         backend_type = _get_backend(backend)
-        csp_solver = backend_type(self.variables)  # type: ignore
-        csp_solver.add_constraint(self.constraints)
-
-        try:
-            return csp_solver.solve_irrefutably(self.is_answer_key)
-        except NotImplementedError:
-            pass
-
-        if not csp_solver.solve():
-            # inconsistent problem
-            return False
-
-        n_var = len(self.variables)
-        answer: List[Union[None, bool, int]] = [None] * n_var
-        for i in range(n_var):
-            if self.is_answer_key[i]:
-                answer[i] = self.variables[i].sol
-
-        while True:
-            difference_cond = []
-            for i in range(n_var):
-                a = answer[i]
-                if self.is_answer_key[i] and a is not None:
-                    difference_cond.append(self.variables[i] != a)
-            csp_solver.add_constraint(BoolExpr(Op.OR, difference_cond))
-            if not csp_solver.solve():
-                break
-
-            for i in range(n_var):
-                if (
-                    self.is_answer_key[i]
-                    and answer[i] is not None
-                    and answer[i] != self.variables[i].sol
-                ):
-                    answer[i] = None
+        csp_solver = new_backend(backend_type, self.variables, constraints)
 
+        res = _solve_irrefutably(csp_solver, self.variables, self.is_answer_key)
         self._perf_stats = csp_solver.perf_stats()
+        self._store_cache(key, res)
+        return res
 
-        for i in range(n_var):
-            if self.is_answer_key[i]:
-                self.variables[i].sol = answer[i]
-        return True
+    async def find_answer_async(self, backend: Union[None, str, type] = None) -> bool:
+        """Coroutine version of `find_answer`.
+
+        Backends invoking a solver executable (`sugar`, `sugar_extended`) wait for the solver
+        process asynchronously. Other Sugar-like backends run the solver in the default executor
+        of the event loop, and the remaining backends (e.g. `z3`) run the whole `find_answer` in
+        the executor. The number of concurrent solves in an event loop is bounded by
+        `config.max_concurrent_solves`. On timeout (`config.solver_timeout`) or cancellation, the
+        whole process tree of the solver is killed.
+        """
+        backend_type = _get_backend(backend)
+        async with _get_async_semaphore():
+            if not backend_type.has_async_solve:  # type: ignore
+                return await asyncio.get_running_loop().run_in_executor(
+                    None, self.find_answer, backend_type
+                )
+            constraints = self._constraints_for_backend()
+            if constraints is None:
+                return self._set_inconsistent()
+            key, cached = self._lookup_cache(constraints, "find_answer")
+            if cached is not None:
+                return cached
+            csp_solver = new_backend(backend_type, self.variables, constraints)
+            res = await csp_solver.solve_async()
+            self._perf_stats = csp_solver.perf_stats()
+            self._store_cache(key, res)
+            return res
+
+    async def solve_async(self, backend: Union[None, str, type] = None) -> bool:
+        """Coroutine version of `solve`. See `find_answer_async` for details."""
+        backend_type = _get_backend(backend)
+        async with _get_async_semaphore():
+            if not backend_type.has_async_solve:  # type: ignore
+                return await asyncio.get_running_loop().run_in_executor(
+                    None, self.solve, backend_type
+                )
+            if not any(self.is_answer_key):
+                warnings.warn("no answer key is given")
+            constraints = self._constraints_for_backend()
+            if constraints is None:
+                return self._set_inconsistent()
+            key, cached = self._lookup_cache(constraints, "solve")
+            if cached is not None:
+                return cached
+            csp_solver = new_backend(backend_type, self.variables, constraints)
+
+            res = await _solve_irrefutably_async(csp_solver, self.variables, self.is_answer_key)
+            self._perf_stats = csp_solver.perf_stats()
+            self._store_cache(key, res)
+            return res
 
     def perf_stats(self) -> Optional[dict]:
         return self._perf_stats
+
+    def cache_stats(self) -> Dict[str, int]:
+        """Return the numbers of hits and misses of the solve cache (see `cspuz.cache`).
+
+        The result is a dict with keys `hits` and `misses`, counted over all the calls of
+        `find_answer` and `solve` (including their async versions) on this solver.
+        """
+        return dict(self._cache_stats)
+
+    def simplify_stats(self) -> Optional[dict]:
+        """Return statistics of the simplification in the last call of `find_answer` or `solve`.
+
+        The result is `None` if the simplification is disabled. Otherwise, it is a dict with the
+        following keys:
+
+        - `removed_nodes`: the number of expression nodes removed by the simplification.
+        - `trivially_false`: whether some constraint is found to be trivially violated.
+        """
+        return self._simplify_stats
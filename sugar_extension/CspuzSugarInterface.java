@@ -57,10 +57,10 @@ class CspuzSugarInterface {
     CSP csp;
     String satFile, mapFile, outFile;
     String[] answerKeys;
+    PrintStream out = System.out;
 
-    void loadProblem() throws IOException {
+    void loadProblem(BufferedReader reader) throws IOException {
         ArrayList<String> lines = new ArrayList<String>();
-        BufferedReader reader = new BufferedReader(new InputStreamReader(System.in));
         String line;
         answerKeys = null;
         while ((line = reader.readLine()) != null) {
@@ -116,6 +116,13 @@ class CspuzSugarInterface {
         mapFile = tempFile("temp", ".map").getAbsolutePath();
         outFile = tempFile("temp", ".out").getAbsolutePath();
     }
+    private void cleanupTempFiles() {
+        for (String name : new String[] { satFile, mapFile, outFile }) {
+            if (name != null) {
+                new File(name).delete();
+            }
+        }
+    }
     boolean solveCSP() throws IOException, SugarException {
         // CSP -> SAT
         csp = new CSP();
@@ -146,29 +153,29 @@ class CspuzSugarInterface {
         
         return encoder.decode(outFile);
     }
-    void run() throws IOException, SugarException {
-        loadProblem();
+    void run(BufferedReader reader) throws IOException, SugarException {
+        loadProblem(reader);
         setupTempFiles();
         boolean isSat = solveCSP();
 
         if (answerKeys == null) {
             // answer finder mode
             if (isSat) {
-                System.out.println("s SATISFIABLE");
+                out.println("s SATISFIABLE");
                 for (String name : intVars) {
-                    System.out.println("a " + name + "\t" + csp.getIntegerVariable(name).getValue());
+                    out.println("a " + name + "\t" + csp.getIntegerVariable(name).getValue());
                 }
                 for (String name : boolVars) {
-                    System.out.println("a " + name + "\t" + csp.getBooleanVariable(name).getValue());
+                    out.println("a " + name + "\t" + csp.getBooleanVariable(name).getValue());
                 }
-                System.out.println("a");
+                out.println("a");
             } else {
-                System.out.println("s UNSATISFIABLE");
+                out.println("s UNSATISFIABLE");
             }
         } else {
             // deduction mode
             if (!isSat) {
-                System.out.println("unsat");
+                out.println("unsat");
                 return;
             }
             boolean[] notRefutedInt = new boolean[isAnswerKeyInt.length];
@@ -212,21 +219,75 @@ class CspuzSugarInterface {
                     }
                 }
             }
-            System.out.println("sat");
+            out.println("sat");
             for (int i = 0; i < isAnswerKeyInt.length; ++i) {
                 if (isAnswerKeyInt[i] && notRefutedInt[i]) {
-                    System.out.println(intVars.get(i) + " " + answerInt[i]);
+                    out.println(intVars.get(i) + " " + answerInt[i]);
                 }
             }
             for (int i = 0; i < isAnswerKeyBool.length; ++i) {
                 if (isAnswerKeyBool[i] && notRefutedBool[i]) {
-                    System.out.println(boolVars.get(i) + " " + answerBool[i]);
+                    out.println(boolVars.get(i) + " " + answerBool[i]);
                 }
             }
         }
     }
+    // Reads a line terminated by '\n' from `in`. Returns null on EOF.
+    private static String readLine(InputStream in) throws IOException {
+        StringBuilder builder = new StringBuilder();
+        while (true) {
+            int c = in.read();
+            if (c < 0) {
+                return builder.length() == 0 ? null : builder.toString();
+            }
+            if (c == '\n') {
+                return builder.toString();
+            }
+            builder.append((char)c);
+        }
+    }
+    private static void writeFrame(OutputStream out, byte[] payload) throws IOException {
+        out.write((payload.length + "\n").getBytes("US-ASCII"));
+        out.write(payload);
+        out.flush();
+    }
+    // Server mode: solves problems given from stdin one by one, so that the startup cost of JVM is
+    // paid only once. Each problem and its result are framed by a line with the length of the
+    // payload in bytes, followed by the payload itself. If solving a problem fails, the result is
+    // a single line starting with "error".
+    static void serve() throws IOException {
+        DataInputStream in = new DataInputStream(new BufferedInputStream(System.in));
+        OutputStream rawOut = new BufferedOutputStream(new FileOutputStream(FileDescriptor.out));
+        while (true) {
+            String header = readLine(in);
+            if (header == null) {
+                break;
+            }
+            byte[] payload = new byte[Integer.parseInt(header.trim())];
+            in.readFully(payload);
+
+            ByteArrayOutputStream result = new ByteArrayOutputStream();
+            CspuzSugarInterface inf = new CspuzSugarInterface();
+            inf.out = new PrintStream(result, false, "US-ASCII");
+            try {
+                inf.run(new BufferedReader(new StringReader(new String(payload, "US-ASCII"))));
+                inf.out.flush();
+            } catch (Exception e) {
+                e.printStackTrace();
+                result.reset();
+                result.write(("error " + e.toString().replace('\n', ' ') + "\n").getBytes("US-ASCII"));
+            } finally {
+                inf.cleanupTempFiles();
+            }
+            writeFrame(rawOut, result.toByteArray());
+        }
+    }
     public static void main(String[] args) throws IOException, SugarException {
+        if (args.length >= 1 && args[0].equals("--server")) {
+            serve();
+            return;
+        }
         CspuzSugarInterface inf = new CspuzSugarInterface();
-        inf.run();
+        inf.run(new BufferedReader(new InputStreamReader(System.in)));
     }
 }
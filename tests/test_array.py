@@ -4,7 +4,8 @@ from typing import Any, List, Tuple, Union
 import cspuz
 from cspuz import Solver
 from cspuz.array import BoolArray1D, BoolArray2D, IntArray1D, IntArray2D
-from cspuz.expr import BoolExpr, IntExpr
+from cspuz.expr import BoolExpr, Expr, IntExpr, Op
+from cspuz.simplify import flatten_chains
 
 from tests.util import check_equality_expr
 
@@ -434,6 +435,15 @@ class TestArrayOperators:
         for i in range(7):
             assert check_equality_expr(res[i], -(x[i]))
 
+    def test_mul_ivar1d(self, solver: Solver) -> None:
+        x = solver.int_array(7, 0, 5)
+        res = 3 * x
+        assert isinstance(res, IntArray1D)
+        for i in range(7):
+            assert check_equality_expr(res[i], 3 * x[i])
+        with pytest.raises(TypeError):
+            x * x  # type: ignore
+
     def test_neg_ivar2d(self, solver: Solver) -> None:
         x = solver.int_array((3, 4), 0, 5)
         res = -x
@@ -539,6 +549,14 @@ class TestArrayOperators:
         with pytest.raises(ValueError, match=r".*shape mismatch.*"):
             apply_binary_operator(x, op, y)
 
+    def test_add_chain_ivar2d_flattened(self, solver: Solver) -> None:
+        x = solver.int_array((2, 3), 0, 5)
+        y = solver.int_array((2, 3), 0, 5)
+        res = flatten_chains(list(x + y + 1))
+        for i in range(2):
+            for j in range(3):
+                assert check_equality_expr(res[i * 3 + j], Expr(Op.ADD, [x[i, j], y[i, j], 1]))
+
     def test_invert_bvar1d(self, solver: Solver) -> None:
         x = solver.bool_array(7)
         res = ~x
@@ -556,6 +574,14 @@ class TestArrayOperators:
             for j in range(4):
                 assert check_equality_expr(res[i, j], ~(x[i, j]))
 
+    def test_and_chain_bvar1d_flattened(self, solver: Solver) -> None:
+        x = solver.bool_array(4)
+        y = solver.bool_array(4)
+        z = solver.bool_var()
+        res = flatten_chains(list(x & y & z))
+        for i in range(4):
+            assert check_equality_expr(res[i], Expr(Op.AND, [x[i], y[i], z]))
+
     @pytest.mark.parametrize("op", ["&", "|", "^", "==", "!=", "then"])
     @pytest.mark.parametrize("bool_operand", [False, True])
     def test_operator_bvar1d_bvar(self, solver: Solver, op: str, bool_operand: bool) -> None:
@@ -721,3 +747,167 @@ class TestArrayOperators:
                         else:
                             pz = z
                     assert check_equality_expr(res[i, j], px.cond(py, pz))  # type: ignore
+
+
+def test_elementwise_is_lazy() -> None:
+    solver = Solver()
+    x = solver.int_array((3, 4), 0, 5)
+    b = solver.bool_array((3, 4))
+
+    y = x + 1
+    z = b.cond(0, y)
+    res = x == z
+    assert y._data is None and z._data is None and res._data is None
+
+    # `y` and `z` are fused into `res`, and are never expanded
+    assert check_equality_expr(res[1, 2], x[1, 2] == b[1, 2].cond(0, x[1, 2] + 1))
+    assert y._data is None and z._data is None
+    assert res._lazy is None
+
+
+def test_elementwise_shared_operand() -> None:
+    solver = Solver()
+    x = solver.int_array(5, 0, 5)
+    y = x + 1
+    a = y >= 2
+    c = y <= 4
+    # `y` has two consumers, so its cells are shared rather than duplicated
+    assert a[3].operands[0] is y[3]
+    assert c[3].operands[0] is y[3]
+
+
+def test_elementwise_operands_are_copied() -> None:
+    solver = Solver()
+    x = solver.int_array(3, 0, 5)
+    y = solver.int_array(3, 0, 5)
+    x0 = x[0]
+    a = x + 1
+    b = a * 2
+    # later changes to the operands do not affect lazy results
+    x.data[0] = y[0]
+    a.data = list(y)
+    assert a[0] is y[0]
+    assert check_equality_expr(b[0], (x0 + 1) * 2)
+
+
+def test_fused_operand_is_expanded_once() -> None:
+    solver = Solver()
+    x = solver.int_array(3, 0, 5)
+    y = x + 1
+    z = -y
+    res = z >= 2
+    assert check_equality_expr(res[1], -(x[1] + 1) >= 2)
+    # `y` and `z` are fused into `res`, and their cells are reused rather than rebuilt
+    assert z[1] is res[1].operands[0]
+    assert y[1] is z[1].operands[0]
+
+
+def test_ensure_lazy_array() -> None:
+    solver = Solver()
+    x = solver.int_array((3, 3), 0, 3)
+    has_number = solver.bool_array((3, 3))
+    solver.ensure(x[1:, :] == has_number[:-1, :].cond(0, x[:-1, :] + 1))
+    assert len(solver.constraints) == 6
+    assert check_equality_expr(
+        solver.constraints[4], x[2, 1] == has_number[1, 1].cond(0, x[1, 1] + 1)
+    )
+
+
+def test_long_chain_of_elementwise_operations() -> None:
+    solver = Solver()
+    x = solver.int_array(3, 0, 5)
+    y = x
+    for _ in range(5000):
+        y = -y
+    e: Any = y[0]
+    for _ in range(5000):
+        assert e.op == Op.NEG
+        e = e.operands[0]
+    assert e is x[0]
+
+
+def test_slices_are_views() -> None:
+    solver = Solver()
+    x = solver.int_array((6, 7), 0, 5)
+    data = [[x[y, i] for i in range(7)] for y in range(6)]
+
+    view = x[1:, ::-2]
+    assert isinstance(view, IntArray2D)
+    assert view._data is None
+    view2 = view[::2, 1:]
+    row = view2[1]
+    col = view2[:, 0]
+    assert isinstance(row, IntArray1D)
+    assert row._data is None and col._data is None
+
+    expected = [r[::-2][1:] for r in data[1:][::2]]
+    assert view2.shape == (len(expected), len(expected[0]))
+    assert view2[1, 2] is expected[1][2]
+    assert view2[-1, -1] is expected[-1][-1]
+    assert row[-1] is expected[1][-1]
+    assert list(row[::-1]) == expected[1][::-1]
+    assert list(col) == [r[0] for r in expected]
+    assert list(view2) == sum(expected, [])
+    assert view2._data is not None
+    with pytest.raises(IndexError):
+        row[len(expected[1])]
+
+    # views of lazy arrays
+    y = (x + 1)[2:4, 3]
+    assert check_equality_expr(y[1], x[3, 3] + 1)
+
+
+@pytest.mark.parametrize(
+    "key",
+    [
+        slice(3, 0, -2),
+        slice(5, None, -1),
+        slice(1, -10, -1),
+        slice(-1, 0, -1),
+        slice(-10, None, -1),
+        slice(None, 0, -3),
+    ],
+)
+def test_negative_step_slices_of_views(key: slice) -> None:
+    solver = Solver()
+    x = solver.int_array((4, 5), 0, 9)
+    data = [[x[y, i] for i in range(5)] for y in range(4)]
+
+    view = x[:, 1:3]
+    actual = view[:, key]
+    expected = [r[1:3][key] for r in data]
+    assert actual.shape == (4, len(expected[0]))
+    assert list(actual) == sum(expected, [])
+    assert list(x[1][1:3][key]) == expected[1]
+    assert list(view[1:3][key, 0]) == [r[1] for r in data[1:3][key]]
+
+
+def test_integer_like_keys() -> None:
+    class Index:
+        # integer-like objects such as `numpy.int64`
+        def __init__(self, value: int) -> None:
+            self.value = value
+
+        def __index__(self) -> int:
+            return self.value
+
+    def idx(value: int) -> Any:
+        return Index(value)
+
+    solver = Solver()
+    x = solver.int_array((4, 5), 0, 9)
+    assert x[idx(1), idx(-2)] is x[1, 3]
+    assert list(x[idx(2)]) == list(x[2])
+    assert x[2][idx(3)] is x[2, 3]
+    assert list(x[:, idx(4)]) == [x[i, 4] for i in range(4)]
+    with pytest.raises(IndexError):
+        x[idx(4), 0]
+
+
+def test_elementwise_on_views() -> None:
+    solver = Solver()
+    b = solver.bool_array((4, 5))
+    res = b[1:, :] & b[:-1, :]
+    assert isinstance(res, BoolArray2D)
+    assert res.shape == (3, 5)
+    assert check_equality_expr(res[2, 3], b[3, 3] & b[2, 3])
@@ -0,0 +1,151 @@
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Iterator, List
+
+import pytest
+
+import cspuz
+from cspuz import Solver
+from cspuz.backend._subproc import run_subprocess_async
+from tests.util import make_model, write_executable_script
+
+# A fake Sugar-compatible executable: it answers that b0 is true for every problem, unless the
+# problem contains a disjunction (the constraint refuting the previous answer in the fallback of
+# `solve_async`). If the problem contains "sleep", it waits in a child process, writing its pid to
+# the file given in the problem.
+FAKE_SOLVER = """
+import subprocess
+import sys
+
+problem = sys.stdin.read()
+if "sleep" in problem:
+    child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    with open(problem.split()[1], "w") as f:
+        f.write(str(child.pid))
+    child.wait()
+if "||" in problem:
+    print("s UNSATISFIABLE")
+elif "#" in problem:
+    print("sat")
+    print("b0 true")
+else:
+    print("s SATISFIABLE")
+    print("a b0\\ttrue")
+    print("a")
+"""
+
+
+def is_alive(pid: int) -> bool:
+    if sys.platform == "win32":
+        # `os.kill` terminates the process on Windows
+        res = subprocess.run(
+            ["tasklist", "/FI", f"PID eq {pid}", "/NH"], capture_output=True, text=True
+        )
+        return str(pid) in res.stdout.split()
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+@pytest.fixture
+def solver_path(tmp_path: Path) -> Iterator[str]:
+    path = write_executable_script(tmp_path / "fake_solver", FAKE_SOLVER)
+
+    backend_path = cspuz.config.backend_path
+    cspuz.config.backend_path = path
+    yield path
+    cspuz.config.backend_path = backend_path
+
+
+def test_solve_async_z3() -> None:
+    async def run() -> List[bool]:
+        models = [make_model(n) for n in range(5)]
+        res = await asyncio.gather(*[m.solve_async(backend="z3") for m in models])
+        assert [v.sol for v in models[3].variables] == [0, 1, 1, 1]
+        assert [v.sol for v in models[1].variables] == [0, None, None, None]
+        return res
+
+    assert asyncio.run(run()) == [True, True, True, True, False]
+
+
+def test_find_answer_async_z3() -> None:
+    model = make_model(2)
+    assert asyncio.run(model.find_answer_async(backend="z3"))
+    assert sum(v.sol for v in model.variables) == 2  # type: ignore
+
+
+@pytest.mark.parametrize("backend", ["sugar", "sugar_extended"])
+def test_solve_async_subprocess(solver_path: str, backend: str) -> None:
+    solver = Solver()
+    x = solver.bool_var()
+    solver.ensure(x)
+    assert asyncio.run(solver.find_answer_async(backend=backend))
+    assert x.sol is True
+    solver.add_answer_key(x)
+    assert asyncio.run(solver.solve_async(backend=backend))
+    assert x.sol is True
+
+
+def test_timeout_kills_process_tree(solver_path: str, tmp_path: Path) -> None:
+    pid_file = tmp_path / "pid"
+    start = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        asyncio.run(
+            run_subprocess_async(
+                [solver_path, "/dev/stdin"], [f"sleep {pid_file}".encode()], timeout=1.0
+            )
+        )
+    assert time.monotonic() - start < 10
+
+    child_pid = int(pid_file.read_text())
+    for _ in range(50):
+        if not is_alive(child_pid):
+            break
+        time.sleep(0.1)
+    else:
+        pytest.fail("child process is still alive")
+
+
+def test_concurrency_is_bounded() -> None:
+    running = 0
+    max_running = 0
+
+    class RecordingBackend(cspuz.backend.z3.Z3Backend):
+        def solve_irrefutably(self, is_answer_key: List[bool]) -> bool:
+            nonlocal running, max_running
+            running += 1
+            max_running = max(max_running, running)
+            time.sleep(0.1)
+            running -= 1
+            return super().solve_irrefutably(is_answer_key)
+
+    async def run() -> None:
+        models = [make_model(n) for n in range(6)]
+        await asyncio.gather(*[m.solve_async(backend=RecordingBackend) for m in models])
+
+    max_concurrent_solves = cspuz.config.max_concurrent_solves
+    cspuz.config.max_concurrent_solves = 2
+    try:
+        asyncio.run(run())
+    finally:
+        cspuz.config.max_concurrent_solves = max_concurrent_solves
+    assert max_running == 2
+
+
+def test_z3_in_multiple_threads() -> None:
+    async def run() -> List[bool]:
+        models = [make_model(n % 5) for n in range(40)]
+        return await asyncio.gather(*[m.solve_async(backend="z3") for m in models])
+
+    max_concurrent_solves = cspuz.config.max_concurrent_solves
+    cspuz.config.max_concurrent_solves = 8
+    try:
+        assert asyncio.run(run()) == [True, True, True, True, False] * 8
+    finally:
+        cspuz.config.max_concurrent_solves = max_concurrent_solves
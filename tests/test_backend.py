@@ -1,6 +1,7 @@
 import pytest
 
 import cspuz
+from cspuz.solver import _get_default_backend
 
 
 # TODO: test sugar, sugar_extended, csugar and enigma_csp
@@ -42,3 +43,20 @@ def test_solve(solver: cspuz.Solver) -> None:
     assert solver.solve()
     assert x.sol is None
     assert y.sol is True
+
+
+def test_add_constraint_after_solve(solver: cspuz.Solver) -> None:
+    x = solver.bool_var()
+    y = solver.int_var(0, 3)
+
+    csp_solver = _get_default_backend()(solver.variables)
+    csp_solver.add_constraint([x.then(y >= 2)])
+    assert csp_solver.solve()
+
+    csp_solver.add_constraint(x)
+    assert csp_solver.solve()
+    assert x.sol is True
+    assert y.sol is not None and y.sol >= 2
+
+    csp_solver.add_constraint([y != 2, y != 3])
+    assert not csp_solver.solve()
@@ -0,0 +1,103 @@
+import os
+import time
+from typing import Iterator, List
+
+import pytest
+
+import cspuz
+from cspuz import Solver, solve_many
+from cspuz.backend.z3 import Z3Backend
+from tests.util import make_model
+
+
+class SleepingBackend(Z3Backend):
+    def solve_irrefutably(self, is_answer_key: List[bool]) -> bool:
+        time.sleep(30)
+        return super().solve_irrefutably(is_answer_key)
+
+
+# The following backends fail on models with more than 4 variables.
+class CrashingBackend(Z3Backend):
+    def solve_irrefutably(self, is_answer_key: List[bool]) -> bool:
+        if len(self.variables) > 4:
+            os._exit(1)
+        return super().solve_irrefutably(is_answer_key)
+
+
+class FailingBackend(Z3Backend):
+    def solve_irrefutably(self, is_answer_key: List[bool]) -> bool:
+        if len(self.variables) > 4:
+            raise RuntimeError("failed")
+        return super().solve_irrefutably(is_answer_key)
+
+
+def test_solve_many() -> None:
+    models = [make_model(n) for n in range(5)]
+    results = list(solve_many(models, backend="z3", workers=2))
+
+    assert sorted(r.index for r in results) == list(range(5))
+    for r in results:
+        assert r.solver is models[r.index]
+        assert r.error is None
+    is_sat = [r.is_sat for r in sorted(results, key=lambda r: r.index)]
+    assert is_sat == [True, True, True, True, False]
+
+    x = models[3].variables
+    assert [v.sol for v in x] == [0, 1, 1, 1]
+    x = models[1].variables
+    assert [v.sol for v in x] == [0, None, None, None]
+
+
+def test_find_answer_mode() -> None:
+    models = [make_model(2), make_model(4)]
+    results = list(solve_many(models, backend="z3", workers=1, mode="find_answer"))
+    assert sorted((r.index, r.is_sat) for r in results) == [(0, True), (1, False)]
+    assert sum(v.sol for v in models[0].variables) == 2  # type: ignore
+
+
+def test_trivially_false_model() -> None:
+    solver = Solver()
+    x = solver.bool_var()
+    solver.ensure(x, cspuz.count_true(x) >= 2)
+    solver.add_answer_key(x)
+    results = list(solve_many([solver], backend="z3", workers=1))
+    assert len(results) == 1
+    assert results[0].is_sat is False
+    assert x.sol is None
+
+
+def test_models_are_taken_lazily() -> None:
+    taken: List[int] = []
+
+    def models() -> Iterator[Solver]:
+        for n in range(4):
+            taken.append(n)
+            yield make_model(n)
+
+    results = solve_many(models(), backend="z3", workers=1)
+    next(results)
+    assert len(taken) < 4
+    results.close()
+
+
+def test_timeout() -> None:
+    models = [make_model(1), make_model(2)]
+    start = time.monotonic()
+    results = list(solve_many(models, backend=SleepingBackend, workers=2, timeout=0.5))
+    assert time.monotonic() - start < 10
+    assert len(results) == 2
+    for r in results:
+        assert r.is_sat is None
+        assert r.error == "timeout"
+
+
+@pytest.mark.parametrize("backend_type", [CrashingBackend, FailingBackend])
+def test_failure_isolation(backend_type: type) -> None:
+    failing_model = make_model(2)
+    failing_model.bool_var()
+    models = [make_model(1), failing_model, make_model(3)]
+    results = sorted(solve_many(models, backend=backend_type, workers=1), key=lambda r: r.index)
+    assert [r.index for r in results] == [0, 1, 2]
+    assert [r.is_sat for r in results] == [True, None, True]
+    assert results[1].error is not None
+    assert [v.sol for v in models[2].variables] == [0, 1, 1, 1]
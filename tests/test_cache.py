@@ -0,0 +1,133 @@
+from pathlib import Path
+from typing import Iterator, List
+
+import pytest
+
+import cspuz
+from cspuz import Solver, solve_many
+from cspuz.backend.z3 import Z3Backend
+from cspuz.cache import SolveCache, get_solve_cache
+from tests.util import make_model
+
+
+class CountingBackend(Z3Backend):
+    num_solves = 0
+
+    def solve(self) -> bool:
+        CountingBackend.num_solves += 1
+        return super().solve()
+
+    def solve_irrefutably(self, is_answer_key: List[bool]) -> bool:
+        CountingBackend.num_solves += 1
+        return super().solve_irrefutably(is_answer_key)
+
+
+@pytest.fixture
+def enable_cache(tmp_path: Path) -> Iterator[None]:
+    size = cspuz.config.solve_cache_size
+    path = cspuz.config.solve_cache_path
+    cspuz.config.solve_cache_size = 16
+    cspuz.config.solve_cache_path = str(tmp_path / "cache.sqlite")
+    CountingBackend.num_solves = 0
+    yield
+    cspuz.config.solve_cache_size = size
+    cspuz.config.solve_cache_path = path
+
+
+def test_cache_is_disabled_by_default() -> None:
+    assert get_solve_cache() is None
+    model = make_model(2)
+    assert model.solve(backend="z3")
+    assert model.cache_stats() == {"hits": 0, "misses": 0}
+
+
+def test_solve_hit(enable_cache: None) -> None:
+    model = make_model(3)
+    assert model.solve(backend=CountingBackend)
+    assert model.cache_stats() == {"hits": 0, "misses": 1}
+    for v in model.variables:
+        v.sol = None
+
+    assert model.solve(backend=CountingBackend)
+    assert model.cache_stats() == {"hits": 1, "misses": 1}
+    assert [v.sol for v in model.variables] == [0, 1, 1, 1]
+    assert CountingBackend.num_solves == 1
+
+    # the cache is keyed by the content of the problem
+    model2 = make_model(3)
+    assert model2.solve(backend=CountingBackend)
+    assert model2.cache_stats() == {"hits": 1, "misses": 0}
+    assert [v.sol for v in model2.variables] == [0, 1, 1, 1]
+    assert CountingBackend.num_solves == 1
+
+
+def test_unsat_hit(enable_cache: None) -> None:
+    assert not make_model(4).find_answer(backend=CountingBackend)
+    model = make_model(4)
+    assert not model.find_answer(backend=CountingBackend)
+    assert model.cache_stats() == {"hits": 1, "misses": 0}
+    assert CountingBackend.num_solves == 1
+
+
+def test_key_depends_on_mode_and_answer_keys(enable_cache: None) -> None:
+    model = make_model(1)
+    assert model.find_answer(backend=CountingBackend)
+    assert model.solve(backend=CountingBackend)
+    assert [v.sol for v in model.variables] == [0, None, None, None]
+
+    model2 = make_model(1)
+    model2.is_answer_key[1] = False
+    assert model2.solve(backend=CountingBackend)
+    assert model2.cache_stats() == {"hits": 0, "misses": 1}
+    assert CountingBackend.num_solves == 3
+
+
+def test_hit_with_different_numbering(enable_cache: None) -> None:
+    model = make_model(3)
+    assert model.solve(backend=CountingBackend)
+
+    # same as `make_model(3)`, but the variables are created in the reverse order
+    model2 = Solver()
+    x = list(reversed(model2.int_array(4, 0, 1)))
+    model2.ensure(x[0] == 0, sum(x) == 3)
+    model2.add_answer_key(x)
+    assert model2.solve(backend=CountingBackend)
+    assert model2.cache_stats() == {"hits": 1, "misses": 0}
+    assert [v.sol for v in x] == [0, 1, 1, 1]
+    assert CountingBackend.num_solves == 1
+
+
+def test_lru_eviction() -> None:
+    cache = SolveCache(2)
+    cache.put("a", (True, [1]))
+    cache.put("b", (True, [2]))
+    assert cache.get("a") == (True, [1])
+    cache.put("c", (False, [None]))
+    assert cache.get("b") is None
+    assert cache.get("a") == (True, [1])
+    assert cache.get("c") == (False, [None])
+
+
+def test_sqlite_tier_is_shared(tmp_path: Path) -> None:
+    path = str(tmp_path / "cache.sqlite")
+    cache1 = SolveCache(0, path)
+    cache2 = SolveCache(1, path)
+    cache1.put("a", (True, [True, 3, None]))
+    assert cache2.get("a") == (True, [True, 3, None])
+    assert cache2.get("b") is None
+    cache2.clear()
+    assert cache1.get("a") is None
+
+
+def test_solve_many_uses_cache(enable_cache: None) -> None:
+    assert make_model(2).solve(backend="z3")
+    models = [make_model(2), make_model(3)]
+    results = sorted(solve_many(models, backend="z3", workers=1), key=lambda r: r.index)
+    assert [r.is_sat for r in results] == [True, True]
+    assert models[0].cache_stats() == {"hits": 1, "misses": 0}
+    assert models[1].cache_stats() == {"hits": 0, "misses": 1}
+    assert [v.sol for v in models[1].variables] == [0, 1, 1, 1]
+
+    model = make_model(3)
+    assert model.solve(backend="z3")
+    assert model.cache_stats() == {"hits": 1, "misses": 0}
@@ -0,0 +1,94 @@
+from typing import List, Tuple
+
+from cspuz import Solver, alldifferent, count_true
+from cspuz.canonical import canonicalize
+from cspuz.expr import BoolExpr, Op
+
+
+def build(order: List[int], flip: bool = False) -> Tuple[Solver, List[int]]:
+    # x[i] are created in the order of `order`. Returns the model and the index of x[i] in
+    # `solver.variables` for each i.
+    solver = Solver()
+    x = {}
+    for i in order:
+        x[i] = solver.int_var(0, 3)
+    b = solver.bool_var()
+    constraints = [
+        alldifferent(x[0], x[1], x[2]),
+        b.then(x[0] + x[1] >= 2) if not flip else b.then(2 <= x[1] + x[0]),
+        (x[2] == 3) | b,
+    ]
+    if flip:
+        constraints.reverse()
+    solver.ensure(*constraints)
+    return solver, [x[i].id for i in range(3)]
+
+
+def test_invariant_to_numbering_and_order() -> None:
+    solver1, ids1 = build([0, 1, 2])
+    solver2, ids2 = build([2, 0, 1], flip=True)
+    digest1, perm1 = canonicalize(solver1.variables, solver1.constraints)
+    digest2, perm2 = canonicalize(solver2.variables, solver2.constraints)
+    assert digest1 == digest2
+
+    # the permutations map corresponding variables to the same canonical position
+    assert perm1.index(ids1[2]) == perm2.index(ids2[2])
+    assert sorted(perm1) == list(range(4))
+    assert sorted(perm2) == list(range(4))
+
+
+def test_different_models() -> None:
+    solver1, _ = build([0, 1, 2])
+    digest1, _ = canonicalize(solver1.variables, solver1.constraints)
+
+    solver2, _ = build([0, 1, 2])
+    solver2.constraints[2] = solver2.variables[2] == 2
+    digest2, _ = canonicalize(solver2.variables, solver2.constraints)
+    assert digest1 != digest2
+
+    solver3 = Solver()
+    x = solver3.int_array(3, 0, 4)
+    b = solver3.bool_var()
+    solver3.ensure(alldifferent(x), b.then(x[0] + x[1] >= 2), (x[2] == 3) | b)
+    digest3, _ = canonicalize(solver3.variables, solver3.constraints)
+    assert digest1 != digest3
+
+
+def test_answer_keys() -> None:
+    solver = Solver()
+    x = solver.bool_array(3)
+    solver.ensure(count_true(x) == 1)
+    digest0, _ = canonicalize(solver.variables, solver.constraints)
+    keys = [True, False, False]
+    digest1, _ = canonicalize(solver.variables, solver.constraints, keys)
+    digest2, _ = canonicalize(solver.variables, solver.constraints, [False, False, True])
+    assert digest0 != digest1
+    assert digest1 == digest2
+
+
+def test_unused_variables() -> None:
+    solver1 = Solver()
+    a = solver1.bool_var()
+    solver1.int_var(0, 5)
+    solver1.ensure(a)
+
+    solver2 = Solver()
+    solver2.int_var(0, 5)
+    a = solver2.bool_var()
+    solver2.ensure(a)
+
+    digest1, perm1 = canonicalize(solver1.variables, solver1.constraints)
+    digest2, perm2 = canonicalize(solver2.variables, solver2.constraints)
+    assert digest1 == digest2
+    assert perm1 == [0, 1]
+    assert perm2 == [1, 0]
+
+
+def test_deep_expression() -> None:
+    solver = Solver()
+    x = solver.bool_var()
+    e: BoolExpr = x
+    for _ in range(5000):
+        e = BoolExpr(Op.NOT, [e])
+    digest, perm = canonicalize(solver.variables, [e])
+    assert perm == [0]
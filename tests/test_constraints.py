@@ -75,10 +75,16 @@ def test_count_true(solver: cspuz.Solver) -> None:
     b = solver.bool_var()
     actual = cspuz.count_true(False, [a, True], b)
     vars = [a[0, 0], a[0, 1], a[1, 0], a[1, 1], b]
-    exprs = list(map(lambda x: Expr(Op.IF, [x, 1, 0]), vars)) + [1]
-    assert check_equality_expr(actual, Expr(Op.ADD, exprs))
+    assert check_equality_expr(actual, Expr(Op.ADD, [Expr(Op.COUNT_TRUE, vars), 1]))
 
 
 def test_count_true_empty() -> None:
     actual = cspuz.count_true()
     assert check_equality_expr(actual, Expr(Op.INT_CONSTANT, [0]))
+
+
+def test_count_true_without_constants(solver: cspuz.Solver) -> None:
+    a = solver.bool_array(3)
+    actual = cspuz.count_true(a, False)
+    assert check_equality_expr(actual, Expr(Op.COUNT_TRUE, [a[0], a[1], a[2]]))
+    assert check_equality_expr(a.count_true(), actual)
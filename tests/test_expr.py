@@ -3,7 +3,7 @@ from typing import Any
 
 import cspuz
 from cspuz import Solver
-from cspuz.expr import BoolVar, Expr, IntVar, Op
+from cspuz.expr import BoolVar, Expr, ExprTable, IntVar, Op
 
 from tests.util import check_equality_expr
 
@@ -104,7 +104,7 @@ class TestExprConstruction:
         assert check_equality_expr(cspuz.fold_and([bx, by]), Expr(Op.AND, [bx, by]))
 
     def test_count_true(self, bx: BoolVar) -> None:
-        assert check_equality_expr(bx.count_true(), Expr(Op.IF, [bx, 1, 0]))
+        assert check_equality_expr(bx.count_true(), Expr(Op.COUNT_TRUE, [bx]))
 
     def test_neg_var(self, ix: IntVar) -> None:
         assert check_equality_expr(-ix, Expr(Op.NEG, [ix]))
@@ -127,6 +127,12 @@ class TestExprConstruction:
     def test_sub_int_var(self, ix: IntVar) -> None:
         assert check_equality_expr(2 - ix, Expr(Op.SUB, [2, ix]))
 
+    def test_mul_var_int(self, ix: IntVar) -> None:
+        assert check_equality_expr(ix * 2, Expr(Op.MUL, [ix, 2]))
+
+    def test_mul_int_var(self, ix: IntVar) -> None:
+        assert check_equality_expr(2 * ix, Expr(Op.MUL, [2, ix]))
+
     def test_ieq_var_var(self, ix: IntVar, iy: IntVar) -> None:
         assert check_equality_expr(ix == iy, Expr(Op.EQ, [ix, iy]))
 
@@ -261,6 +267,21 @@ class TestExprConstruction:
         with pytest.raises(TypeError):
             self.input(solver, lhs) - self.input(solver, rhs)
 
+    @pytest.mark.parametrize(
+        "lhs,rhs",
+        [
+            ("ivar", "ivar"),
+            ("bvar", "ivar"),
+            ("ivar", "bvar"),
+            ("bvar", 2),
+            (2, "bvar"),
+            ("ivar", True),
+        ],
+    )
+    def test_type_error_mul(self, solver: Solver, lhs: Any, rhs: Any) -> None:
+        with pytest.raises(TypeError):
+            self.input(solver, lhs) * self.input(solver, rhs)
+
     @pytest.mark.parametrize(
         "lhs,rhs",
         [
@@ -454,6 +475,13 @@ class TestExprValue:
         solver.ensure(x - y == expected)
         assert solver.find_answer()
 
+    @pytest.mark.parametrize("x_val,expected", [(0, 0), (1, 3), (-2, -6)])
+    def test_mul(self, solver: Solver, x_val: int, expected: int) -> None:
+        x = solver.int_var(-2, 2)
+        solver.ensure(x == x_val)
+        solver.ensure(x * 3 == expected)
+        assert solver.find_answer()
+
     @pytest.mark.parametrize("x_val,y_val,is_sat", [(0, 0, True), (1, 2, False), (-2, -2, True)])
     def test_ieq(self, solver: Solver, x_val: int, y_val: int, is_sat: int) -> None:
         x = solver.int_var(-2, 2)
@@ -507,3 +535,65 @@ class TestExprValue:
         solver.ensure(y == y_val)
         solver.ensure(x < y)
         assert solver.find_answer() == is_sat
+
+
+class TestExprTable:
+    @pytest.fixture
+    def solver(self) -> Solver:
+        return Solver(intern_exprs=True)
+
+    def test_intern_shares_structurally_equal_nodes(self) -> None:
+        table = ExprTable()
+        solver = Solver()
+        x = solver.bool_var()
+        y = solver.bool_var()
+        a = table.intern((x & y) | ~x)
+        b = table.intern((x & y) | ~x)
+        assert a is b
+        assert isinstance(a, Expr)
+        assert check_equality_expr(a, Expr(Op.OR, [Expr(Op.AND, [x, y]), Expr(Op.NOT, [x])]))
+
+    def test_intern_distinguishes_constants(self) -> None:
+        table = ExprTable()
+        solver = Solver()
+        x = solver.bool_var()
+        i = solver.int_var(0, 2)
+        assert table.intern(x & True) is not table.intern(x & False)
+        assert table.intern(i == 1) is not table.intern(i == 2)
+        assert table.intern(x.cond(1, 0)) is not table.intern(x.cond(True, 0))  # type: ignore
+
+    def test_intern_variables_and_constants(self) -> None:
+        table = ExprTable()
+        solver = Solver()
+        x = solver.bool_var()
+        assert table.intern(x) is x
+        assert table.intern(True) is True
+        assert len(table) == 0
+
+    def test_solver_interning(self, solver: Solver) -> None:
+        x = solver.bool_var()
+        y = solver.bool_var()
+        z = solver.bool_var()
+        solver.ensure((x & y) | z)
+        solver.ensure((x & y) | ~z)
+        c0 = solver.constraints[0]
+        c1 = solver.constraints[1]
+        assert isinstance(c0, Expr) and isinstance(c1, Expr)
+        assert c0.operands[0] is c1.operands[0]
+
+    def test_solver_interning_disabled(self) -> None:
+        solver = Solver(intern_exprs=False)
+        x = solver.bool_var()
+        y = solver.bool_var()
+        solver.ensure(x & y)
+        solver.ensure(x & y)
+        assert solver.constraints[0] is not solver.constraints[1]
+
+    def test_solve_with_interning(self, solver: Solver) -> None:
+        x = solver.bool_array(4)
+        solver.ensure((x[0] & x[1]).then(x[2]))
+        solver.ensure((x[0] & x[1]) | x[3])
+        solver.ensure(x[0], x[1], ~x[3])
+        solver.add_answer_key(x)
+        assert solver.solve(backend="z3")
+        assert [v.sol for v in x] == [True, True, True, False]
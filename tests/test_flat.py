@@ -0,0 +1,124 @@
+import pickle
+import sys
+
+import pytest
+
+import cspuz
+from cspuz import Solver, graph
+from cspuz.analyzer import Analyzer
+from cspuz.backend.sugar_like import SugarLikeBackend, _convert_expr
+from cspuz.expr import BoolExpr, IntExpr, Op
+
+
+def make_model() -> Solver:
+    solver = Solver()
+    x = solver.int_array(4, -1, 3)
+    b = solver.bool_array(4)
+    shared = x[0] + x[1]
+    solver.ensure(
+        (shared >= 2) | b[0],
+        (shared != x[2]).then(b[1]),
+        cspuz.alldifferent(x[1], x[2], 0),
+        cspuz.count_true(b) == b[3].cond(2, x[3]),
+        ~b[2],
+        b[3],
+        True,
+        BoolExpr(Op.BOOL_CONSTANT, [False]) | (-x[3] < IntExpr(Op.INT_CONSTANT, [5])),
+    )
+    solver.add_answer_key(x[0], b[1])
+    return solver
+
+
+def sugar_texts(constraints: list) -> list:
+    return [_convert_expr(c) for c in constraints]
+
+
+def test_round_trip() -> None:
+    solver = make_model()
+    model = solver.flat_model()
+    assert model.num_variables == 8
+
+    restored = model.to_solver()
+    assert [type(v) for v in restored.variables] == [type(v) for v in solver.variables]
+    assert [(v.lo, v.hi) for v in restored.variables[:4]] == [(-1, 3)] * 4  # type: ignore
+    assert restored.is_answer_key == solver.is_answer_key
+    assert sugar_texts(restored.constraints) == sugar_texts(solver.constraints)
+
+    # the restored constraints refer to the given variables
+    constraints = model.constraints(solver.variables)
+    assert constraints[5] is solver.variables[7]
+    with pytest.raises(ValueError):
+        model.constraints(solver.variables[:4])
+
+
+def test_shared_subexpressions() -> None:
+    solver = make_model()
+    model = solver.flat_model()
+    constraints = model.constraints()
+    shared1 = constraints[0].operands[0].operands[0]  # type: ignore
+    shared2 = constraints[1].operands[0].operands[1]  # type: ignore
+    assert shared1.op == Op.ADD  # type: ignore
+    assert shared1 is shared2
+
+
+def test_pickle() -> None:
+    solver = Solver()
+    x = solver.int_array((20, 20), 0, 5)
+    solver.ensure(x[:, :-1] != x[:, 1:], x[:-1, :] < x[1:, :] + 1)
+    model = solver.flat_model()
+
+    data = pickle.dumps(model)
+    assert len(data) < len(pickle.dumps((solver.variables, solver.constraints)))
+    restored = pickle.loads(data)
+    assert sugar_texts(restored.constraints()) == sugar_texts(solver.constraints)
+
+
+def test_deep_expression() -> None:
+    solver = Solver()
+    x = solver.bool_var()
+    e: BoolExpr = x
+    for _ in range(5000):
+        e = BoolExpr(Op.NOT, [e])
+    solver.ensure(e)
+    model = solver.flat_model()
+    assert model.num_nodes == 5000
+    restored = model.constraints()[0]
+    assert isinstance(restored, BoolExpr) and restored.op == Op.NOT
+
+
+def test_sugar_emission() -> None:
+    solver = make_model()
+    group_size = [None, 2, None, solver.int_var(1, 4)]
+    is_border = solver.bool_array(4)
+    g = graph.Graph(4)
+    for i in range(4):
+        g.add_edge(i, (i + 1) % 4)
+    graph.division_connected_variable_groups_with_borders(
+        solver,
+        graph=g,
+        group_size=group_size,
+        is_border=is_border,
+        use_graph_primitive=True,
+    )
+
+    backend1 = SugarLikeBackend(solver.variables)
+    backend1.add_constraint(solver.constraints)
+    backend2 = SugarLikeBackend(solver.variables)
+    backend2.add_flat_model(solver.flat_model())
+    assert backend2._csp_description() == backend1._csp_description()
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="requires fork")
+def test_analyzer_with_workers() -> None:
+    solver = Analyzer()
+    x = solver.bool_array(3)
+    solver.add_answer_key(x, name="x")
+    solver.ensure(cspuz.count_true(x) == 1)
+    solver.ensure(x[0] | x[1], name="a")
+    solver.ensure(~x[1], name="b")
+
+    res1 = solver.analyze(n_workers=-1, backend="z3")
+    res2 = solver.analyze(n_workers=2, backend="z3")
+    assert res1 == res2
+    assert res1 is not None
+    assert res1[-1] == ([("x.0", True)], [], ["x.2", "x.1"])
@@ -1,22 +1,35 @@
+from typing import Iterator
+
 import pytest
 
 import cspuz
 from cspuz import graph, BoolGridFrame, Solver
+from cspuz.backend.sugar_like import _convert_expr
+from cspuz.backend.z3 import Z3Backend
+from cspuz.expr import Op
 from cspuz.graph import Graph
+from cspuz.refinement import RefiningBackend, new_backend
 
 
 @pytest.fixture(
     autouse=True,
     params=[
-        ("z3", False, False),
-        ("cspuz_core", True, True),
+        ("z3", False, False, False),
+        ("cspuz_core", True, True, False),
+        ("z3", False, False, True),
+        ("z3", True, True, False),
     ],
 )
-def default_backend(request: pytest.FixtureRequest) -> None:
-    default_backend, use_graph_primitive, use_graph_division_primitive = request.param
+def default_backend(request: pytest.FixtureRequest) -> Iterator[None]:
+    default_backend, use_graph_primitive, use_graph_division_primitive, use_lazy_connectivity = (
+        request.param
+    )
     cspuz.config.default_backend = default_backend
     cspuz.config.use_graph_primitive = use_graph_primitive
     cspuz.config.use_graph_division_primitive = use_graph_division_primitive
+    cspuz.config.use_lazy_connectivity = use_lazy_connectivity
+    yield
+    cspuz.config.use_lazy_connectivity = False
 
 
 @pytest.fixture
@@ -53,6 +66,89 @@ def test_graph_getitem(default_graph: Graph) -> None:
     assert default_graph[4] == (2, 5)
 
 
+def test_adjacency(default_graph: Graph) -> None:
+    assert default_graph.incident_edges[4] == [(1, 3), (3, 5), (5, 7), (7, 8)]
+    assert list(default_graph.neighbors(4)) == [1, 3, 5, 7]
+    assert list(default_graph.incident_edge_ids(4)) == [3, 5, 7, 8]
+    assert default_graph.degree(2) == 2
+    assert default_graph.degrees() == [2, 3, 2, 3, 4, 2, 2, 2]
+
+    default_graph.add_edges([(2, 2), (6, 7)])
+    assert list(default_graph.neighbors(2)) == [1, 5, 2, 2]
+    assert default_graph.incident_edges[7] == [(4, 8), (6, 9), (6, 11)]
+    with pytest.raises(IndexError):
+        default_graph.add_edge(0, 8)
+
+
+def test_induced_subgraph(default_graph: Graph) -> None:
+    subgraph, edge_ids = default_graph.induced_subgraph([4, 3, 6, 7])
+    assert subgraph.num_vertices == 4
+    assert subgraph.edges == [(1, 0), (1, 2), (0, 3), (2, 3)]
+    assert edge_ids == [5, 6, 8, 9]
+
+
+def test_frozen_graph(default_graph: Graph) -> None:
+    line_graph = default_graph.line_graph()
+    assert default_graph.line_graph() is not line_graph
+    assert not default_graph.is_frozen
+
+    assert default_graph.freeze() is default_graph
+    with pytest.raises(ValueError):
+        default_graph.add_edge(0, 7)
+    frozen_line_graph = default_graph.line_graph()
+    assert sorted(frozen_line_graph.edges) == sorted(line_graph.edges)
+    assert frozen_line_graph.is_frozen
+    assert default_graph.line_graph() is frozen_line_graph
+
+    # the edges of frozen graphs cannot be modified through `edges`
+    assert isinstance(default_graph.edges, tuple)
+    assert isinstance(frozen_line_graph.edges, tuple)
+    with pytest.raises(AttributeError):
+        default_graph.edges.append((0, 7))  # type: ignore
+    with pytest.raises(AttributeError):
+        default_graph.edges = []
+    assert len(default_graph) == len(default_graph.edges)
+    incident_edges = default_graph.incident_edges
+    assert isinstance(incident_edges, tuple)
+    assert all(isinstance(incident, tuple) for incident in incident_edges)
+    with pytest.raises(AttributeError):
+        default_graph.incident_edges = []
+
+
+def test_edges_of_unfrozen_graphs_are_writable() -> None:
+    g = Graph(3)
+    g.edges.append((0, 1))  # type: ignore
+    assert len(g) == 1
+    assert g.incident_edges[1] == [(0, 0)]
+    g.edges.append((1, 2))  # type: ignore
+    assert list(g.neighbors(1)) == [0, 2]
+    assert g.incident_edges[1] == [(0, 0), (2, 1)]
+
+    g.edges = [(0, 2)]
+    assert list(g) == [(0, 2)]
+    assert g.degrees() == [1, 0, 1]
+    g.incident_edges = [[(2, 0)], [], [(0, 0)]]
+    assert g.incident_edges[0] == [(2, 0)]
+
+    # the incident edges built before freezing are frozen as well
+    g.freeze()
+    assert g.incident_edges == (((2, 0),), (), ((0, 0),))
+
+
+def test_grid_topologies_are_cached(solver: Solver) -> None:
+    g = graph._grid_graph(3, 4)
+    assert g.is_frozen
+    assert graph._grid_graph(3, 4) is g
+    assert graph._grid_graph(4, 3) is not g
+    assert list(g.edges) == graph._build_grid_graph(3, 4).edges
+
+    edges1, g1 = graph._from_grid_frame(BoolGridFrame(solver, 2, 3))
+    edges2, g2 = graph._from_grid_frame(BoolGridFrame(solver, 2, 3))
+    assert g1 is g2
+    assert edges1[0] is not edges2[0]
+    assert len(edges1) == len(g1)
+
+
 def test_active_vertices_connected_grid(solver: Solver) -> None:
     is_active = solver.bool_array((3, 4))
     graph.active_vertices_connected(solver, is_active)
@@ -285,3 +381,72 @@ def test_active_edges_connected_crossable(solver: Solver) -> None:
     assert grid_frame.vertical[0, 0].sol is True
     assert grid_frame.vertical[0, 3].sol is True
     assert grid_frame.vertical[2, 0].sol is None
+
+
+def test_graph_edges_are_shared(solver: Solver, default_graph: Graph) -> None:
+    is_active = solver.bool_array((2, 3))
+    graph.active_vertices_connected(solver, is_active, use_graph_primitive=True)
+    graph.active_vertices_connected(solver, ~is_active, use_graph_primitive=True)
+    graph.active_vertices_connected(
+        solver, solver.bool_array(8), graph=default_graph, use_graph_primitive=True
+    )
+    c0, c1, c2 = solver.constraints
+    assert c0.operands[-1] is c1.operands[-1]  # type: ignore
+    assert c0.operands[-1] is not c2.operands[-1]  # type: ignore
+    assert solver.graph_edges(default_graph) is c2.operands[-1]  # type: ignore
+    # frozen graphs are looked up by identity, and the other ones by their edges
+    frozen = Graph(3)
+    frozen.add_edges([(0, 1), (1, 2)])
+    frozen.freeze()
+    assert solver.graph_edges(frozen) is solver.graph_edges(frozen)
+    assert solver.graph_edges(frozen) is not solver.graph_edges([(0, 1), (1, 2)])
+    assert solver.graph_edges(default_graph) is solver.graph_edges(list(default_graph))
+
+    assert _convert_expr(c0) == (
+        "(graph-active-vertices-connected 6 7 b0 b1 b2 b3 b4 b5 0 1 0 3 1 2 1 4 2 5 3 4 4 5)"
+    )
+
+
+def test_lazy_connectivity(solver: Solver) -> None:
+    cspuz.config.use_lazy_connectivity = True
+    is_active = solver.bool_array((3, 4))
+    graph.active_vertices_connected(solver, is_active, use_graph_primitive=False)
+    assert len(solver.variables) == 12
+    assert solver.constraints[0].op == Op.LAZY_ACTIVE_VERTICES_CONNECTED  # type: ignore
+
+    # the active cells form either of the paths from (0, 0) to (2, 3) around (1, 1) and (1, 2)
+    solver.ensure(is_active[0, 0], is_active[2, 3], ~is_active[1, 1], ~is_active[1, 2])
+    solver.ensure(cspuz.count_true(is_active) == 6)
+    solver.add_answer_key(is_active)
+    assert solver.solve(backend="z3")
+    assert is_active[0, 0].sol is True
+    assert is_active[1, 1].sol is False
+    assert is_active[0, 1].sol is None
+    assert solver.perf_stats()["refinement_rounds"] > 1  # type: ignore
+
+    solver.ensure(~is_active[0, 2])
+    assert solver.solve(backend="z3")
+    assert [[is_active[y, x].sol for x in range(4)] for y in range(3)] == [
+        [True, False, False, False],
+        [True, False, False, False],
+        [True, True, True, True],
+    ]
+
+
+def test_lazy_connectivity_of_exprs(solver: Solver, default_graph: Graph) -> None:
+    cspuz.config.use_lazy_connectivity = True
+    is_active = solver.bool_array(8)
+    graph.active_vertices_connected(
+        solver, ~is_active, graph=default_graph, use_graph_primitive=False
+    )
+    assert len(solver.variables) == 16  # auxiliary variables for `~is_active`
+
+    solver.ensure(is_active[0], is_active[4], ~is_active[5], ~is_active[7])
+    csp_solver = new_backend(Z3Backend, solver.variables, solver.constraints)
+    assert isinstance(csp_solver, RefiningBackend)
+    assert not csp_solver.solve()
+
+    csp_solver = new_backend(Z3Backend, solver.variables, solver.constraints[:-1])
+    restored = RefiningBackend.deserialize(solver.variables, csp_solver.serialize())
+    assert restored.solve()
+    assert is_active[7].sol is True
@@ -0,0 +1,130 @@
+import time
+from typing import Any, Iterator, List
+
+import pytest
+
+import cspuz
+from cspuz import Solver, graph
+from cspuz.backend.z3 import Z3Backend
+from cspuz.portfolio import PortfolioMember, reset_win_counts, win_counts
+from tests.util import make_model
+
+
+class SleepingBackend(Z3Backend):
+    def solve(self) -> bool:
+        time.sleep(30)
+        return super().solve()
+
+    def solve_irrefutably(self, is_answer_key: List[bool]) -> bool:
+        time.sleep(30)
+        return super().solve_irrefutably(is_answer_key)
+
+
+class FailingBackend(Z3Backend):
+    def solve(self) -> bool:
+        raise RuntimeError("failed")
+
+    def solve_irrefutably(self, is_answer_key: List[bool]) -> bool:
+        raise RuntimeError("failed")
+
+
+class FlatModelBackend(Z3Backend):
+    # accepts constraints only through `add_flat_model`
+    def add_constraint(self, constraint: Any) -> None:
+        if not getattr(self, "_from_flat_model", False):
+            raise RuntimeError("constraints must be added by add_flat_model")
+        super().add_constraint(constraint)
+
+    def add_flat_model(self, model: Any) -> None:
+        self._from_flat_model = True
+        super().add_flat_model(model)
+
+
+@pytest.fixture
+def portfolio() -> Iterator[List[Any]]:
+    members = cspuz.config.portfolio
+    cspuz.config.portfolio = []
+    reset_win_counts()
+    yield cspuz.config.portfolio
+    cspuz.config.portfolio = members
+
+
+def test_parse_member() -> None:
+    member = PortfolioMember.parse("z3")
+    assert member.backend == "z3"
+    assert member.config_overrides == {}
+    assert member.name == "z3"
+
+    member = PortfolioMember.parse("cspuz_core:use_graph_primitive=false, cse_threshold=3")
+    assert member.backend == "cspuz_core"
+    assert member.config_overrides == {"use_graph_primitive": False, "cse_threshold": 3}
+    assert member.name == "cspuz_core:cse_threshold=3,use_graph_primitive=False"
+
+    with pytest.raises(ValueError):
+        PortfolioMember.parse("z3:no_such_config=1")
+    with pytest.raises(ValueError):
+        PortfolioMember.parse("z3:use_graph_primitive")
+    with pytest.raises(ValueError):
+        PortfolioMember.parse("portfolio")
+
+
+def test_first_answer_wins(portfolio: List[Any]) -> None:
+    portfolio += [PortfolioMember(SleepingBackend), "z3"]
+
+    start = time.monotonic()
+    model = make_model(3)
+    assert model.solve(backend="portfolio")
+    assert [v.sol for v in model.variables] == [0, 1, 1, 1]
+    model = make_model(1)
+    assert model.solve(backend="portfolio")
+    assert [v.sol for v in model.variables] == [0, None, None, None]
+    model = make_model(4)
+    assert not model.find_answer(backend="portfolio")
+    assert time.monotonic() - start < 20
+
+    assert win_counts() == {"z3": 3}
+    perf_stats = model.perf_stats()
+    assert perf_stats is not None
+    assert perf_stats["portfolio_winner"] == "z3"
+
+
+def test_failure_of_member(portfolio: List[Any]) -> None:
+    portfolio += [PortfolioMember(FailingBackend), "z3"]
+    model = make_model(2)
+    assert model.find_answer(backend="portfolio")
+    assert sum(v.sol for v in model.variables) == 2  # type: ignore
+    assert win_counts() == {"z3": 1}
+
+
+def test_all_members_fail(portfolio: List[Any]) -> None:
+    portfolio += [PortfolioMember(FailingBackend)]
+    with pytest.raises(RuntimeError):
+        make_model(2).solve(backend="portfolio")
+
+
+def test_no_member(portfolio: List[Any]) -> None:
+    with pytest.raises(ValueError):
+        make_model(2).solve(backend="portfolio")
+
+
+def test_graph_primitives_are_lowered(portfolio: List[Any]) -> None:
+    portfolio += ["z3:use_graph_primitive=False"]
+    solver = Solver()
+    is_active = solver.bool_array((2, 2))
+    graph.active_vertices_connected(solver, is_active, use_graph_primitive=True)
+    solver.ensure(is_active[0, 0], is_active[1, 1], cspuz.count_true(is_active) == 3)
+    solver.add_answer_key(is_active)
+    assert solver.solve(backend="portfolio")
+    assert [v.sol for v in is_active] == [True, None, None, True]
+    assert win_counts() == {"z3:use_graph_primitive=False": 1}
+
+
+def test_workers_use_flat_model(portfolio: List[Any]) -> None:
+    portfolio += [PortfolioMember(FlatModelBackend)]
+    solver = Solver()
+    is_active = solver.bool_array((2, 2))
+    graph.active_vertices_connected(solver, is_active, use_graph_primitive=True)
+    solver.ensure(is_active[0, 0], is_active[1, 1], cspuz.count_true(is_active) == 3)
+    solver.add_answer_key(is_active)
+    assert solver.solve(backend="portfolio")
+    assert [v.sol for v in is_active] == [True, None, None, True]
@@ -0,0 +1,340 @@
+import itertools
+from typing import Any, Dict
+
+import pytest
+
+import cspuz
+from cspuz import Solver
+from cspuz.expr import BoolExpr, BoolVar, Expr, ExprLike, IntExpr, IntVar, Op
+from cspuz.simplify import Simplifier, flatten_chains, simplify_constraints
+
+from tests.util import check_equality_expr
+
+
+@pytest.fixture
+def solver() -> Solver:
+    return Solver()
+
+
+@pytest.fixture
+def bx(solver: Solver) -> BoolVar:
+    return solver.bool_var()
+
+
+@pytest.fixture
+def by(solver: Solver) -> BoolVar:
+    return solver.bool_var()
+
+
+@pytest.fixture
+def ix(solver: Solver) -> IntVar:
+    return solver.int_var(0, 5)
+
+
+def simplify(e: ExprLike) -> ExprLike:
+    return Simplifier().simplify(e)
+
+
+def test_not(bx: BoolVar) -> None:
+    assert simplify(Expr(Op.NOT, [True])) is False
+    assert simplify(~~bx) is bx
+
+
+def test_and(bx: BoolVar, by: BoolVar) -> None:
+    assert simplify(bx & False) is False
+    assert simplify(bx & True) is bx
+    assert check_equality_expr(simplify(cspuz.fold_and(bx, True, by)), bx & by)
+    assert simplify(Expr(Op.AND, [])) is True
+
+
+def test_or(bx: BoolVar, by: BoolVar) -> None:
+    assert simplify(bx | True) is True
+    assert simplify(False | bx) is bx
+    assert check_equality_expr(simplify(Expr(Op.OR, [bx, False, by])), bx | by)
+
+
+def test_imp(bx: BoolVar) -> None:
+    assert simplify(bx.then(True)) is True
+    assert check_equality_expr(simplify(bx.then(False)), ~bx)
+    assert simplify(Expr(Op.IMP, [True, bx])) is bx
+    assert simplify(Expr(Op.IMP, [False, bx])) is True
+
+
+def test_iff_xor(bx: BoolVar) -> None:
+    assert simplify(bx == True) is bx  # noqa: E712
+    assert check_equality_expr(simplify(bx == False), ~bx)  # noqa: E712
+    assert simplify(bx ^ False) is bx
+    assert check_equality_expr(simplify(bx ^ True), ~bx)
+
+
+def test_if(bx: BoolVar, ix: IntVar) -> None:
+    assert simplify(cspuz.cond(True, ix, 3)) is ix
+    assert simplify(cspuz.cond(False, ix, 3)) == 3
+    assert simplify(bx.cond(ix, ix)) is ix
+    assert simplify(bx.cond(2, 2)) == 2
+
+
+def test_add_sub_neg(bx: BoolVar, ix: IntVar) -> None:
+    assert simplify(Expr(Op.ADD, [1, 2, 3])) == 6
+    assert check_equality_expr(simplify(Expr(Op.ADD, [1, ix, 2])), ix + 3)
+    assert simplify(Expr(Op.ADD, [ix, 0])) is ix
+    assert simplify(ix - 0) is ix
+    assert simplify(Expr(Op.SUB, [5, 2])) == 3
+    assert simplify(-(-ix)) is ix
+
+
+def test_linear_normal_form(solver: Solver, ix: IntVar) -> None:
+    iy = solver.int_var(0, 5)
+    assert check_equality_expr(simplify(ix + ix), ix * 2)
+    assert simplify(ix - ix) == 0
+    assert simplify(ix + iy - iy) is ix
+    assert check_equality_expr(simplify(2 * ix + 3 * ix + 1 - 1), ix * 5)
+    assert check_equality_expr(simplify((ix * 2) * 3), ix * 6)
+    assert check_equality_expr(simplify(-ix - ix + iy), Expr(Op.ADD, [ix * -2, iy]))
+    assert simplify(ix * 0) == 0
+    assert simplify(ix * 1) is ix
+
+    # expressions are kept as they are unless the normal form is smaller
+    e = ix - iy
+    assert simplify(e) is e
+    e = (ix - iy) - 1
+    assert simplify(e) is e
+
+
+def test_linear_comparison(solver: Solver, ix: IntVar) -> None:
+    iy = solver.int_var(0, 5)
+    iz = solver.int_var(0, 5)
+    assert check_equality_expr(simplify(ix + 1 == 3), ix == 2)
+    assert check_equality_expr(simplify(ix + iy == iy + iz), ix == iz)
+    assert check_equality_expr(simplify(3 * (ix + iy) - 3 * iy == ix), ix == 0)
+    assert check_equality_expr(simplify(2 * ix + 4 * iy < 7), Expr(Op.LE, [ix + iy * 2, 3]))
+    assert check_equality_expr(simplify(2 * ix - 4 * iy > 1), ix >= iy * 2 + 1)
+    assert simplify(2 * ix == 3) is False
+    assert simplify(ix + ix + ix >= 16) is False
+    assert simplify(ix + iy != iy + 3 + ix) is True
+
+    e = ix - iy >= 2
+    assert simplify(e) is e
+
+
+def _evaluate(e: ExprLike, values: Dict[int, int]) -> int:
+    if isinstance(e, int):
+        return e
+    assert isinstance(e, Expr)
+    if isinstance(e, IntVar):
+        return values[e.id]
+    operands = [_evaluate(x, values) for x in e.operands]
+    if e.op == Op.NEG:
+        return -operands[0]
+    if e.op == Op.ADD:
+        return sum(operands)
+    if e.op == Op.SUB:
+        return operands[0] - operands[1]
+    if e.op == Op.MUL:
+        return operands[0] * operands[1]
+    x, y = operands
+    return {
+        Op.EQ: x == y,
+        Op.NE: x != y,
+        Op.LE: x <= y,
+        Op.LT: x < y,
+        Op.GE: x >= y,
+        Op.GT: x > y,
+    }[e.op]
+
+
+@pytest.mark.parametrize("op", [Op.EQ, Op.NE, Op.LE, Op.LT, Op.GE, Op.GT])
+@pytest.mark.parametrize("k", [-3, 0, 1, 4])
+def test_linear_comparison_is_equivalent(solver: Solver, op: Op, k: int) -> None:
+    x = solver.int_var(-2, 2)
+    y = solver.int_var(-2, 2)
+    lhs = [2 * x + 2 * y, x + x - y, 3 * (x - y) + y, -x - x]
+    rhs = [4 * y + k, y + k - y, x * -2 + k, x + 1 + k]
+    for left, right in zip(lhs, rhs):
+        e = BoolExpr(op, [left, right])
+        s = simplify(e)
+        for vx, vy in itertools.product(range(-2, 3), repeat=2):
+            values = {x.id: vx, y.id: vy}
+            assert _evaluate(s, values) == _evaluate(e, values)
+
+
+def test_count_true_with_constants(bx: BoolVar) -> None:
+    assert simplify(cspuz.count_true(True, False, True) == 2) is True
+    assert check_equality_expr(
+        simplify(cspuz.count_true(bx, True) == 2),
+        Expr(Op.EQ, [Expr(Op.COUNT_TRUE, [bx]), 1]),
+    )
+    assert check_equality_expr(
+        simplify(Expr(Op.COUNT_TRUE, [bx, True, False])),
+        Expr(Op.ADD, [Expr(Op.COUNT_TRUE, [bx]), 1]),
+    )
+    assert simplify(Expr(Op.COUNT_TRUE, [True, False, True])) == 2
+    assert simplify(IntExpr(Op.COUNT_TRUE, [bx, False]) <= 1) is True
+
+
+def test_comparison_by_bounds(bx: BoolVar, ix: IntVar) -> None:
+    assert simplify(ix >= 0) is True
+    assert simplify(ix < 0) is False
+    assert simplify(ix <= 5) is True
+    assert simplify(ix > 5) is False
+    assert simplify(ix == 6) is False
+    assert simplify(ix != -1) is True
+    assert simplify(cspuz.count_true([bx]) <= 1) is True
+    assert isinstance(simplify(ix >= 1), Expr)
+    assert isinstance(simplify(ix == 5), Expr)
+
+
+def test_alldifferent(ix: IntVar) -> None:
+    assert simplify(cspuz.alldifferent(1, 2, 3)) is True
+    assert simplify(cspuz.alldifferent(1, 2, 1)) is False
+    assert simplify(cspuz.alldifferent(ix)) is True
+
+
+def test_unchanged_node_is_kept(bx: BoolVar, by: BoolVar) -> None:
+    e = (bx & by) | ~bx
+    assert simplify(e) is e
+
+
+def test_sharing_is_preserved(bx: BoolVar, by: BoolVar) -> None:
+    shared = (bx & True) | by
+    c0 = shared.then(bx)
+    c1 = shared.then(by)
+    simplifier = Simplifier()
+    s0 = simplifier.simplify(c0)
+    s1 = simplifier.simplify(c1)
+    assert isinstance(s0, Expr) and isinstance(s1, Expr)
+    assert s0.operands[0] is s1.operands[0]
+
+
+def test_deep_expression(solver: Solver) -> None:
+    x = solver.bool_array(5000)
+    e = x[0]
+    for i in range(1, 5000):
+        e = Expr(Op.AND, [e, x[i] | True])  # type: ignore
+    assert simplify(e) is x[0]
+
+
+def test_simplify_constraints(bx: BoolVar, by: BoolVar, ix: IntVar) -> None:
+    constraints, num_removed = simplify_constraints([True, bx & True, ix >= 0, bx | by])
+    assert constraints is not None
+    assert len(constraints) == 2
+    assert constraints[0] is bx
+    assert num_removed == 2
+
+
+def test_simplify_constraints_trivially_false(bx: BoolVar, ix: IntVar) -> None:
+    constraints, _ = simplify_constraints([bx, ix > 5])
+    assert constraints is None
+
+
+def flatten(e: ExprLike) -> ExprLike:
+    return flatten_chains([e])[0]
+
+
+def test_flatten_and_chain(solver: Solver, bx: BoolVar, by: BoolVar) -> None:
+    bz = solver.bool_var()
+    assert check_equality_expr(flatten(bx & by & bz), Expr(Op.AND, [bx, by, bz]))
+    assert check_equality_expr(flatten(bx & (by & bz)), Expr(Op.AND, [bx, by, bz]))
+    assert check_equality_expr(flatten(True & (by & bz)), Expr(Op.AND, [True, by, bz]))
+
+
+def test_flatten_or_chain(solver: Solver, bx: BoolVar, by: BoolVar) -> None:
+    bz = solver.bool_var()
+    assert check_equality_expr(flatten(bx | by | bz), Expr(Op.OR, [bx, by, bz]))
+    assert check_equality_expr(flatten((bx | by) | (by | bz)), Expr(Op.OR, [bx, by, by, bz]))
+
+
+def test_flatten_add_chain(solver: Solver, ix: IntVar) -> None:
+    iy = solver.int_var(0, 5)
+    iz = solver.int_var(0, 5)
+    assert check_equality_expr(flatten(ix + iy + iz + 1), Expr(Op.ADD, [ix, iy, iz, 1]))
+    assert check_equality_expr(flatten(1 + (ix + iy)), Expr(Op.ADD, [1, ix, iy]))
+    assert check_equality_expr(
+        flatten((ix - iy) + iz + 1), Expr(Op.ADD, [Expr(Op.SUB, [ix, iy]), iz, 1])
+    )
+
+
+def test_flatten_mixed_ops(solver: Solver, bx: BoolVar, by: BoolVar) -> None:
+    bz = solver.bool_var()
+    e = (bx | by) & bz
+    assert flatten(e) is e
+    e = ((bx | by) | bz) & ((bx & by) & bz)
+    assert check_equality_expr(flatten(e), Expr(Op.AND, [Expr(Op.OR, [bx, by, bz]), bx, by, bz]))
+
+
+def test_flatten_preserves_sharing(solver: Solver, bx: BoolVar, by: BoolVar) -> None:
+    bz = solver.bool_var()
+    shared = bx & by
+    c0, c1, c2 = flatten_chains([shared & bz, (shared & bx) | bz, shared])
+    assert isinstance(c0, Expr) and isinstance(c1, Expr)
+    assert c0.operands[0] is shared
+    assert c1.operands[0].operands[0] is shared  # type: ignore
+    assert c2 is shared
+
+
+def test_long_chain_scaling(solver: Solver) -> None:
+    # Building a chain takes constant time per operator since no operand list is copied, and the
+    # chain is spliced into a single node in linear time.
+    n = 40000
+    xs = solver.int_array(n, 0, 1)
+    e: Any = 0
+    for x in xs:
+        e = e + x
+    node: ExprLike = e
+    for _ in range(n):
+        assert isinstance(node, Expr) and len(node.operands) == 2
+        node = node.operands[0]
+    assert node == 0
+
+    flattened = flatten(e)
+    assert isinstance(flattened, Expr)
+    assert flattened.op == Op.ADD
+    assert len(flattened.operands) == n + 1
+    assert flattened.operands[0] == 0
+    assert all(flattened.operands[i + 1] is xs[i] for i in range(n))
+
+    # the chain is passed to backends as a single node
+    solver.ensure(e <= n // 2)
+    constraints = solver._constraints_for_backend()
+    assert constraints is not None and len(constraints) == 1
+    left: Any = constraints[0].operands[0]  # type: ignore
+    assert left.op == Op.ADD and len(left.operands) == n
+
+
+class TestSolverSimplification:
+    @pytest.fixture(autouse=True)
+    def use_simplification(self) -> None:
+        cspuz.config.default_backend = "z3"
+        cspuz.config.use_simplification = True
+
+    def test_find_answer(self, solver: Solver) -> None:
+        x = solver.bool_var()
+        y = solver.int_var(0, 3)
+        solver.ensure(x | False, y >= 0, (y == 2) & True)
+        assert solver.find_answer()
+        assert x.sol is True
+        assert y.sol == 2
+        stats = solver.simplify_stats()
+        assert stats is not None
+        assert stats["removed_nodes"] == 3
+        assert not stats["trivially_false"]
+
+    def test_trivially_false(self, solver: Solver) -> None:
+        x = solver.bool_var()
+        solver.ensure(x, cspuz.count_true(x) >= 2)
+        solver.add_answer_key(x)
+        assert not solver.solve()
+        assert x.sol is None
+        stats = solver.simplify_stats()
+        assert stats is not None
+        assert stats["trivially_false"]
+
+    def test_disabled(self, solver: Solver) -> None:
+        cspuz.config.use_simplification = False
+        try:
+            x = solver.bool_var()
+            solver.ensure(x | False)
+            assert solver.find_answer()
+            assert solver.simplify_stats() is None
+        finally:
+            cspuz.config.use_simplification = True
@@ -0,0 +1,307 @@
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+
+import cspuz
+from cspuz import Solver, graph
+from cspuz.backend import sugar_like
+from cspuz.backend.sugar_like import (
+    OP_TO_OPNAME,
+    SugarExtendedBackend,
+    SugarLikeBackend,
+    _convert_expr,
+)
+from cspuz.expr import BoolVar, Expr, IntExpr, IntVar, Op
+from cspuz.simplify import flatten_chains
+from tests.util import write_executable_script
+
+
+@pytest.fixture
+def solver() -> Solver:
+    return Solver()
+
+
+def test_convert_atom(solver: Solver) -> None:
+    x = solver.bool_var()
+    y = solver.int_var(0, 3)
+    assert _convert_expr(x) == "b0"
+    assert _convert_expr(y) == "i1"
+    assert _convert_expr(True) == "true"
+    assert _convert_expr(-3) == "-3"
+    assert _convert_expr(None) == "*"
+    assert _convert_expr(Expr(Op.INT_CONSTANT, [4])) == "4"
+
+
+def test_convert_expr(solver: Solver) -> None:
+    x = solver.bool_var()
+    y = solver.int_var(0, 3)
+    z = solver.int_var(0, 3)
+    assert _convert_expr(x.then(y + z >= 2)) == "(=> b0 (>= (+ i1 i2) 2))"
+    assert _convert_expr(~x | (y == IntExpr(Op.INT_CONSTANT, [1]))) == "(|| (! b0) (= i1 1))"
+    assert _convert_expr(x.cond(y, -z) != 1) == "(!= (if b0 i1 (- i2)) 1)"
+    assert _convert_expr(2 * y + z * -3 <= 1) == "(<= (+ (* 2 i1) (* i2 -3)) 1)"
+    assert _convert_expr(Expr(Op.AND, [])) == "(&& )"
+
+
+def _convert_expr_recursive(e: object) -> str:
+    # straightforward recursive emitter as a reference
+    if e is None:
+        return "*"
+    if isinstance(e, bool):
+        return "true" if e else "false"
+    if isinstance(e, int):
+        return str(e)
+    assert isinstance(e, Expr)
+    if isinstance(e, BoolVar):
+        return "b{}".format(e.id)
+    if isinstance(e, IntVar):
+        return "i{}".format(e.id)
+    if e.op == Op.BOOL_CONSTANT:
+        return "true" if e.operands[0] else "false"
+    if e.op == Op.INT_CONSTANT:
+        return str(e.operands[0])
+    if e.op == Op.COUNT_TRUE:
+        return "(+ {})".format(
+            " ".join("(if {} 1 0)".format(_convert_expr_recursive(x)) for x in e.operands)
+        )
+    if e.op == Op.GRAPH_EDGES:
+        return " ".join(map(str, e.operands))
+    return "({} {})".format(OP_TO_OPNAME[e.op], " ".join(map(_convert_expr_recursive, e.operands)))
+
+
+@pytest.mark.parametrize("intern_exprs", [False, True])
+def test_same_as_recursive_emitter(intern_exprs: bool) -> None:
+    solver = Solver(intern_exprs=intern_exprs)
+    is_active = solver.bool_array((6, 6))
+    graph.active_vertices_connected(solver, is_active, use_graph_primitive=False)
+    graph.active_vertices_connected(solver, is_active, use_graph_primitive=True)
+    for y in range(5):
+        for x in range(5):
+            solver.ensure(
+                (is_active[y, x] & is_active[y + 1, x]).then(
+                    ~is_active[y + 1, x + 1] | is_active[y, x + 1]
+                )
+            )
+
+    backend = SugarLikeBackend(solver.variables)
+    backend.add_constraint(solver.constraints)
+    assert backend.converted_constraints == [
+        _convert_expr_recursive(c) for c in solver.constraints
+    ]
+
+
+def test_shared_subexpression_is_converted_once(solver: Solver) -> None:
+    x = solver.bool_var()
+    y = solver.int_var(0, 3)
+    shared = (y >= 1) & x
+    backend = SugarLikeBackend(solver.variables)
+    backend.add_constraint([shared.then(x), shared | ~x])
+    assert backend.converted_constraints == [
+        "(=> (&& (>= i1 1) b0) b0)",
+        "(|| (&& (>= i1 1) b0) (! b0))",
+    ]
+    num_cached = len(backend._converted_exprs)
+    backend.add_constraint(~shared)
+    assert backend.converted_constraints[-1] == "(! (&& (>= i1 1) b0))"
+    assert len(backend._converted_exprs) == num_cached + 1
+
+
+def test_deep_expression(solver: Solver) -> None:
+    x = solver.bool_array(5000)
+    e = x[0]
+    for i in range(1, 5000):
+        e = Expr(Op.OR, [e, x[i]])  # type: ignore
+    text = _convert_expr(e)
+    assert text.startswith("(|| " * 4999 + "b0 b1) b2)")
+    assert text.endswith(" b4999)")
+
+
+class TestCommonSubexpressionElimination:
+    @pytest.fixture(autouse=True)
+    def cse_threshold(self) -> Iterator[None]:
+        cspuz.config.cse_threshold = 1
+        yield
+        cspuz.config.cse_threshold = None
+
+    def test_shared_subexpressions(self, solver: Solver) -> None:
+        x = solver.bool_array(3)
+        y = solver.int_array(3, 0, 3)
+        t = x[0].cond(y[0] + y[1] + y[2], y[0] - y[1])
+        u = (t >= 1) & (x[1] | x[2]) & (y[2] != y[1])
+        backend = SugarLikeBackend(solver.variables)
+        # chains are flattened before emission as `Solver` does
+        backend.add_constraint(flatten_chains([u.then(x[0]), u | ~x[0], t + t != 4, ~x[0], ~x[0]]))
+        assert backend.converted_variables[6:] == ["(int cse0 -3 9)", "(bool cse1)"]
+        assert backend.converted_constraints == [
+            "(= cse0 (if b0 (+ i3 i4 i5) (- i3 i4)))",
+            "(iff cse1 (&& (>= cse0 1) (|| b1 b2) (!= i5 i4)))",
+            "(=> cse1 b0)",
+            "(|| cse1 (! b0))",
+            "(!= (+ cse0 cse0) 4)",
+            "(! b0)",
+            "(! b0)",
+        ]
+
+    def test_threshold(self, solver: Solver) -> None:
+        x = solver.bool_array(8)
+        u = cspuz.fold_and(x)
+        v = cspuz.fold_or(x)
+        constraints = [u.then(v), v.then(u), u ^ v]
+
+        backend = SugarLikeBackend(solver.variables)
+        backend.add_constraint(constraints)
+        assert backend.converted_variables[8:] == ["(bool cse0)", "(bool cse1)"]
+
+        cspuz.config.cse_threshold = 3
+        backend = SugarLikeBackend(solver.variables)
+        backend.add_constraint(constraints)
+        assert len(backend.converted_variables) == 8
+
+    def test_unprofitable_subexpression_is_kept(self, solver: Solver) -> None:
+        x = solver.bool_var()
+        y = solver.bool_var()
+        u = x & y
+        backend = SugarLikeBackend(solver.variables)
+        backend.add_constraint([u, ~u])
+        assert backend.converted_variables == ["(bool b0)", "(bool b1)"]
+        assert backend.converted_constraints == ["(&& b0 b1)", "(! (&& b0 b1))"]
+
+    def test_solve_ignores_auxiliary_variables(self, solver: Solver) -> None:
+        x = solver.bool_var()
+        y = solver.int_array(3, 0, 3)
+        u = (y[0] + y[1] + y[2] >= 2) & x
+
+        class Backend(SugarLikeBackend):
+            def _call_solver(self, csp_description: str) -> str:
+                assert "(bool cse0)" in csp_description
+                return "s SATISFIABLE\na b0\ttrue\na i1\t2\na i2\t0\na i3\t1\na cse0\ttrue\n"
+
+        backend = Backend(solver.variables)
+        backend.add_constraint([u, u.then(x), u | x])
+        assert backend.solve()
+        assert x.sol is True
+        assert y[0].sol == 2
+
+    def test_interned_model(self) -> None:
+        solver = Solver(intern_exprs=True)
+        x = solver.bool_array(4)
+        y = solver.int_array(4, 0, 3)
+        for i in range(4):
+            solver.ensure((cspuz.count_true(x) >= 2).then(y[i] == sum(y[j] for j in range(i))))
+        backend = SugarLikeBackend(solver.variables)
+        backend.add_constraint(solver.constraints)
+        assert backend.converted_variables[8:] == ["(bool cse0)"]
+        assert backend.converted_constraints[0] == (
+            "(iff cse0 (>= (+ (if b0 1 0) (if b1 1 0) (if b2 1 0) (if b3 1 0)) 2))"
+        )
+
+
+def test_description_is_extended_incrementally(solver: Solver) -> None:
+    x = solver.bool_var()
+    y = solver.int_var(0, 3)
+    descriptions = []
+
+    class Backend(SugarLikeBackend):
+        def _call_solver(self, csp_description: str) -> str:
+            descriptions.append(csp_description)
+            return "unsat\n" if "#" in csp_description else "s UNSATISFIABLE\n"
+
+    backend = Backend(solver.variables)
+    backend.add_constraint([x.then(y >= 2)])
+    assert not backend.solve()
+    first_chunk = backend._description[0]
+    backend.add_constraint(x)
+    assert not backend.solve()
+    assert not backend.solve_irrefutably([True, True])
+    # the chunks encoded earlier are reused, and only the new lines are encoded
+    assert backend._description[0] is first_chunk
+    assert backend._description[1:] == [b"\nb0"]
+    assert descriptions == [
+        "(bool b0)\n(int i1 0 3)\n(=> b0 (>= i1 2))",
+        "(bool b0)\n(int i1 0 3)\n(=> b0 (>= i1 2))\nb0",
+        "(bool b0)\n(int i1 0 3)\n(=> b0 (>= i1 2))\nb0\n#b0 i1",
+    ]
+
+
+def test_description_chunks(solver: Solver, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(sugar_like, "_CHUNK_SIZE", 16)
+    x = solver.bool_array(10)
+    backend = SugarLikeBackend(solver.variables)
+    backend.add_constraint([x[i] | x[i + 1] for i in range(9)])
+    expected = backend._full_description()
+    backend.add_constraint([cspuz.count_true(x) == 3])
+    expected += "\n(= (+ " + " ".join(f"(if b{i} 1 0)" for i in range(10)) + ") 3)\n#b0"
+
+    chunks = list(backend._description_chunks(["#b0"]))
+    assert len(chunks) > 1
+    assert b"".join(chunks).decode("ascii") == expected
+    assert backend._full_description(["#b0"]) == expected
+
+
+def test_serialized_description_chunks(solver: Solver, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(sugar_like, "_CHUNK_SIZE", 16)
+    x = solver.bool_array(10)
+    backend = SugarLikeBackend(solver.variables)
+    backend.add_constraint([x[i] | x[i + 1] for i in range(9)])
+    expected = backend._full_description(["#b0"])
+
+    restored = SugarLikeBackend.deserialize(solver.variables, backend.serialize())
+    chunks = list(restored._description_chunks(["#b0"]))
+    assert len(chunks) > 1
+    assert all(len(chunk) < 32 for chunk in chunks)
+    assert b"".join(chunks).decode("ascii") == expected
+
+
+def test_dump_description(solver: Solver, tmp_path: Path) -> None:
+    x = solver.bool_var()
+    dump_path = tmp_path / "dump.csp"
+
+    class Backend(SugarLikeBackend):
+        def _call_solver(self, csp_description: str) -> str:
+            return "s SATISFIABLE\na b0\ttrue\na\n"
+
+    backend = Backend(solver.variables)
+    backend.add_constraint(x)
+    cspuz.config.csp_dump_path = str(dump_path)
+    try:
+        assert backend.solve()
+        assert dump_path.read_text() == "(bool b0)\nb0"
+        for chunk in backend._description_chunks(["#b0"]):
+            pass
+        assert dump_path.read_text() == "(bool b0)\nb0\n#b0"
+    finally:
+        cspuz.config.csp_dump_path = None
+
+
+# A fake Sugar-compatible executable, which copies its input to the file given by the environment
+# variable `FAKE_SOLVER_INPUT` and answers that the problem is unsatisfiable.
+FAKE_SOLVER = """
+import os
+import sys
+
+data = sys.stdin.buffer.read()
+with open(os.environ["FAKE_SOLVER_INPUT"], "wb") as f:
+    f.write(data)
+print("unsat" if b"#" in data else "s UNSATISFIABLE")
+"""
+
+
+def test_description_is_streamed(
+    solver: Solver, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    solver_path = write_executable_script(tmp_path / "fake_solver", FAKE_SOLVER)
+    input_path = tmp_path / "input"
+    monkeypatch.setenv("FAKE_SOLVER_INPUT", str(input_path))
+    monkeypatch.setattr(cspuz.config, "backend_path", solver_path)
+
+    x = solver.int_array(5000, 0, 100)
+    backend = SugarExtendedBackend(solver.variables)
+    backend.add_constraint([x[i] < x[i + 1] for i in range(4999)])
+    assert not backend.solve()
+    expected = backend._full_description()
+    assert len(expected) > sugar_like._CHUNK_SIZE * 2
+    assert input_path.read_text() == expected
+
+    assert not backend.solve_irrefutably([True] * 5000)
+    assert input_path.read_text() == expected + "\n#" + " ".join(f"i{i}" for i in range(5000))
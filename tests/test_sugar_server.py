@@ -0,0 +1,112 @@
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+
+import cspuz
+from cspuz import Solver
+from cspuz.backend._server import ServerError, ServerPool
+from tests.util import write_executable_script
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="requires POSIX")
+
+# A tiny server speaking the same protocol as `CspuzSugarInterface --server`: it answers that
+# b0 is true for every problem.
+FAKE_SERVER = """
+import sys
+import time
+
+stdin = sys.stdin.buffer
+stdout = sys.stdout.buffer
+while True:
+    header = stdin.readline()
+    if not header:
+        break
+    if int(header) > 1000000:
+        # stop reading in the middle of a large problem
+        time.sleep(10)
+    problem = stdin.read(int(header)).decode("ascii")
+    if "crash" in problem:
+        sys.exit(1)
+    if "sleep" in problem:
+        time.sleep(10)
+    if "invalid" in problem:
+        result = "error invalid problem\\n"
+    elif "#" in problem:
+        result = "sat\\nb0 true\\n"
+    else:
+        result = "s SATISFIABLE\\na b0\\ttrue\\na\\n"
+    stdout.write(str(len(result)).encode("ascii") + b"\\n" + result.encode("ascii"))
+    stdout.flush()
+"""
+
+
+@pytest.fixture
+def server_path(tmp_path: Path) -> str:
+    return write_executable_script(tmp_path / "fake_server", FAKE_SERVER)
+
+
+@pytest.fixture
+def pool(server_path: str) -> Iterator[ServerPool]:
+    pool = ServerPool([server_path, "--server"], 1)
+    yield pool
+    pool.close()
+
+
+def test_processes_are_reused(pool: ServerPool) -> None:
+    assert pool.request("(bool b0)") == "s SATISFIABLE\na b0\ttrue\na\n"
+    pid = pool._idle[0].proc.pid
+    assert pool.request("(bool b0)\n#b0") == "sat\nb0 true\n"
+    assert pool._idle[0].proc.pid == pid
+    assert pool._num_processes == 1
+
+
+def test_restart_on_crash(pool: ServerPool) -> None:
+    with pytest.raises(ServerError):
+        pool.request("crash")
+    assert pool._num_processes == 0
+    assert pool.request("(bool b0)") == "s SATISFIABLE\na b0\ttrue\na\n"
+
+
+def test_restart_on_timeout(pool: ServerPool) -> None:
+    with pytest.raises(subprocess.TimeoutExpired):
+        pool.request("sleep", timeout=0.5)
+    assert pool._num_processes == 0
+    assert pool.request("(bool b0)", timeout=5) == "s SATISFIABLE\na b0\ttrue\na\n"
+
+
+def test_timeout_while_writing(pool: ServerPool) -> None:
+    # the problem does not fit in the pipe buffer, which the server does not read
+    start = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        pool.request("x" * 2000000, timeout=0.5)
+    assert time.monotonic() - start < 5
+    assert pool._num_processes == 0
+    assert pool.request("(bool b0)", timeout=5) == "s SATISFIABLE\na b0\ttrue\na\n"
+
+
+def test_error_is_reported(pool: ServerPool) -> None:
+    with pytest.raises(ServerError):
+        pool.request("invalid")
+    pid = pool._idle[0].proc.pid
+    assert pool.request("(bool b0)") == "s SATISFIABLE\na b0\ttrue\na\n"
+    assert pool._idle[0].proc.pid == pid
+
+
+def test_backend(server_path: str) -> None:
+    backend_path = cspuz.config.backend_path
+    cspuz.config.backend_path = server_path
+    try:
+        solver = Solver()
+        x = solver.bool_var()
+        solver.ensure(x)
+        assert solver.find_answer(backend="sugar_server")
+        assert x.sol is True
+        solver.add_answer_key(x)
+        assert solver.solve(backend="sugar_server")
+        assert x.sol is True
+    finally:
+        cspuz.config.backend_path = backend_path
@@ -0,0 +1,207 @@
+import itertools
+
+import pytest
+
+import cspuz
+from cspuz import Solver, graph
+from cspuz.backend.z3 import Z3Backend, _convert_expr
+from cspuz.graph import Graph
+
+
+@pytest.fixture
+def solver() -> Solver:
+    return Solver()
+
+
+def test_solve_irrefutably(solver: Solver) -> None:
+    x = solver.bool_var()
+    y = solver.int_var(0, 3)
+    z = solver.int_var(0, 3)
+    w = solver.bool_var()
+    solver.ensure(x.then(y >= 2), x, z != y, (z == 0) | (z == 3), w | ~w)
+
+    backend = Z3Backend(solver.variables)
+    backend.add_constraint(solver.constraints)
+    assert backend.solve_irrefutably([True, True, True, False])
+    assert x.sol is True
+    assert y.sol is None
+    assert z.sol is None
+    assert w.sol is None
+
+    backend.add_constraint(y == 3)
+    assert backend.solve_irrefutably([True, True, True, False])
+    assert x.sol is True
+    assert y.sol == 3
+    assert z.sol == 0
+
+
+def test_solve_irrefutably_unsat(solver: Solver) -> None:
+    x = solver.bool_var()
+    solver.ensure(x, ~x)
+
+    backend = Z3Backend(solver.variables)
+    backend.add_constraint(solver.constraints)
+    assert not backend.solve_irrefutably([True])
+    assert x.sol is None
+
+
+def test_perf_stats(solver: Solver) -> None:
+    x = solver.bool_array(3)
+    solver.ensure(x[0] | x[1], ~x[2])
+    solver.add_answer_key(x)
+
+    assert solver.solve(backend="z3")
+    perf_stats = solver.perf_stats()
+    assert perf_stats is not None
+    assert perf_stats["num_checks"] >= 2
+
+
+@pytest.mark.parametrize("k", range(-1, 5))
+def test_cardinality(solver: Solver, k: int) -> None:
+    import z3  # type: ignore
+
+    x = solver.bool_array(3)
+    backend = Z3Backend(solver.variables)
+    comparisons = {
+        "==": lambda a, b: a == b,
+        "!=": lambda a, b: a != b,
+        "<=": lambda a, b: a <= b,
+        "<": lambda a, b: a < b,
+        ">=": lambda a, b: a >= b,
+        ">": lambda a, b: a > b,
+    }
+    for name, cmp in comparisons.items():
+        for flipped in [False, True]:
+            e = cmp(k, x.count_true()) if flipped else cmp(x.count_true(), k)
+            converted = _convert_expr(e, backend.variables_dict, backend._ctx)
+            if name in ("<=", ">=", "==", "!=") and 0 < k < 3:
+                assert "If" not in str(converted)
+            for values in itertools.product([False, True], repeat=3):
+                substituted = z3.substitute(
+                    converted,
+                    *[(backend.variables_dict[i], z3.BoolVal(b)) for i, b in enumerate(values)],
+                )
+                expected = cmp(k, sum(values)) if flipped else cmp(sum(values), k)
+                assert z3.is_true(z3.simplify(substituted)) == expected, (name, flipped, values)
+
+
+def test_count_true_as_int(solver: Solver) -> None:
+    x = solver.bool_array(4)
+    y = solver.int_var(0, 4)
+    solver.ensure(x.count_true() == y + 2, x[0] | x[1], ~x[1])
+    solver.add_answer_key(x, y)
+    assert solver.solve(backend="z3")
+    assert [v.sol for v in x] == [True, False, None, None]
+    assert y.sol is None
+
+
+def path_graph(n: int) -> Graph:
+    g = Graph(n)
+    for i in range(n - 1):
+        g.add_edge(i, i + 1)
+    return g
+
+
+def test_graph_propagator(solver: Solver) -> None:
+    is_active = solver.bool_array(4)
+    graph.active_vertices_connected(solver, is_active, path_graph(4), use_graph_primitive=True)
+    solver.ensure(is_active[0], is_active[3])
+
+    backend = Z3Backend(solver.variables)
+    backend.add_constraint(solver.constraints)
+    assert backend.solve_irrefutably([True] * 4)
+    assert [v.sol for v in is_active] == [True] * 4
+
+    # the graph constraints are preserved by serialization
+    restored = Z3Backend.deserialize(solver.variables, backend.serialize())
+    restored.add_constraint(~is_active[2])
+    assert not restored.solve()
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_solve_irrefutably_incremental(
+    solver: Solver, monkeypatch: pytest.MonkeyPatch, incremental: bool
+) -> None:
+    monkeypatch.setattr(cspuz.config, "z3_incremental_irrefutable", incremental)
+    is_active = solver.bool_array(5)
+    y = solver.int_var(0, 3)
+    graph.active_vertices_connected(solver, is_active, path_graph(5), use_graph_primitive=True)
+    solver.ensure(is_active[0], is_active[2], ~is_active[4], (y >= 2) == is_active[3])
+
+    backend = Z3Backend(solver.variables)
+    backend.add_constraint(solver.constraints)
+    assert backend.solve_irrefutably([True] * 6)
+    assert [v.sol for v in is_active] == [True, True, True, None, False]
+    assert y.sol is None
+
+    backend.add_constraint(y == 3)
+    assert backend.solve_irrefutably([True] * 6)
+    assert [v.sol for v in is_active] == [True, True, True, True, False]
+    assert y.sol == 3
+
+
+def test_graph_propagator_constants(solver: Solver) -> None:
+    is_active = solver.bool_var()
+    g = path_graph(3)
+    graph.active_vertices_connected(solver, [True, is_active, True], g, use_graph_primitive=True)
+    assert solver.find_answer(backend="z3")
+    assert is_active.sol is True
+
+    graph.active_vertices_connected(solver, [True, False, True], g, use_graph_primitive=True)
+    assert not solver.find_answer(backend="z3")
+
+
+def is_connected(g: Graph, active: list) -> bool:
+    vertices = [v for v in range(g.num_vertices) if active[v]]
+    if not vertices:
+        return True
+    visited = {vertices[0]}
+    queue = [vertices[0]]
+    while queue:
+        v = queue.pop()
+        for w in g.neighbors(v):
+            if active[w] and w not in visited:
+                visited.add(w)
+                queue.append(w)
+    return len(visited) == len(vertices)
+
+
+def test_graph_propagator_enumerate(solver: Solver) -> None:
+    # a cycle of 6 vertices with a chord; removing a vertex may cut off several components
+    g = path_graph(6)
+    g.add_edge(5, 0)
+    g.add_edge(1, 4)
+    is_active = solver.bool_array(6)
+    graph.active_vertices_connected(solver, is_active, g, use_graph_primitive=True)
+
+    backend = Z3Backend(solver.variables)
+    backend.add_constraint(solver.constraints)
+    models = set()
+    while backend.solve():
+        model = tuple(v.sol for v in is_active)
+        models.add(model)
+        backend.add_constraint(cspuz.fold_or([v != s for v, s in zip(is_active, model)]))
+    expected = {a for a in itertools.product([False, True], repeat=6) if is_connected(g, list(a))}
+    assert models == expected
+
+
+def test_graph_division_with_variable_sizes(solver: Solver) -> None:
+    size = solver.int_var(1, 3)
+    is_border = solver.bool_array(2)
+    graph.division_connected_variable_groups_with_borders(
+        solver,
+        group_size=[size, None, 1],
+        is_border=is_border,
+        graph=path_graph(3),
+        use_graph_primitive=True,
+    )
+    solver.ensure(~is_border[0])
+    solver.add_answer_key(size, is_border)
+
+    # the sizes are not boolean and the constraint is encoded without the propagator
+    backend = Z3Backend(solver.variables)
+    backend.add_constraint(solver.constraints)
+    assert backend._graph_specs == []
+    assert solver.solve(backend="z3")
+    assert size.sol == 2
+    assert [v.sol for v in is_border] == [False, True]
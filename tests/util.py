@@ -1,3 +1,8 @@
+import os
+import sys
+from pathlib import Path
+
+from cspuz import Solver
 from cspuz.expr import Expr, ExprLike, BoolVar, IntVar
 
 
@@ -19,3 +24,26 @@ def check_equality_expr(left: ExprLike, right: ExprLike) -> bool:
         if not check_equality_expr(left.operands[i], right.operands[i]):
             return False
     return True
+
+
+def make_model(n: int) -> Solver:
+    # x[0] + ... + x[3] == n where x[0] == 0
+    solver = Solver()
+    x = solver.int_array(4, 0, 1)
+    solver.ensure(sum(x) == n, x[0] == 0)
+    solver.add_answer_key(x)
+    return solver
+
+
+def write_executable_script(path: Path, source: str) -> str:
+    # Writes an executable running the Python script `source` (e.g. a fake solver) to `path` and
+    # returns its path. On Windows, where shebangs do not work, a batch file is written instead.
+    if sys.platform == "win32":
+        script = path.with_suffix(".py")
+        script.write_text(source)
+        launcher = path.with_suffix(".bat")
+        launcher.write_text(f'@"{sys.executable}" "{script}" %*\n')
+        return str(launcher)
+    path.write_text(f"#!{sys.executable}\n{source}")
+    os.chmod(path, 0o755)
+    return str(path)